@@ -58,6 +58,10 @@ class Absolute(HandHistoryConverter):
 #    re_Board       = re.compile(ur"\[ (?P<CARDS>.+) \]")
     
     
+    def setInput(self, *args, **kwargs):
+        self.HORSEHand = False  # only true for the file it was seen in
+        HandHistoryConverter.setInput(self, *args, **kwargs)
+
     def compilePlayerRegexs(self, hand):
         players = set([player[1] for player in hand.players])
         if not players <= self.compiledPlayers: # x <= y means 'x is subset of y'
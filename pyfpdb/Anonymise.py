@@ -1,37 +1,246 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in
+#agpl-3.0.txt in the docs folder of the package.
+
+"""Replace the player names in hand histories with aliases, to share them.
+
+Files are read a hand at a time with the converter's hand splitter, once to
+find the names of the players and again to replace them all in one pass over
+each hand, with a regex made from a trie of the names, so big archives go
+through in bounded memory and in time that doesn't grow with the number of
+players. Several files are
+done at once by a pool of processes. e.g.
+    ./Anonymise.py -k PokerStarsToFpdb -o anon -m names.txt hhdir/
+writes anon/<file> for each file in hhdir, with each name given the same alias
+in all of them, and adds the aliases to names.txt, so names which turn up
+again in later runs keep their aliases. With just one file and no -o the
+result is printed.
+"""
+
+#    Standard Library modules
 import os
+import sys
 import re
 import codecs
-import Options
-import HandHistoryConverter
+import hmac
+import hashlib
+from optparse import OptionParser
+import multiprocessing
+
+#    fpdb/FreePokerTools modules
+import Configuration
+
+
+# set up in each process by initAnonymiser()
+anonConverter = None
+anonNames = {}              # name: alias
+anonKey = None              # key aliases of new names are made from
+
+
+def initAnonymiser(configFile, hhcName, names, key):
+    "Initialiser for the processes anonymiseFile() runs in"
+    global anonConverter, anonNames, anonKey
+    hhcClass = getattr(__import__(hhcName), hhcName[:-6])
+    anonConverter = hhcClass(Configuration.Config(file = configFile), autostart = False)
+    anonNames = dict(names)
+    anonKey = key
+
+def aliasFor(name):
+    """\
+The alias of name. Names not in the map get one made from a keyed hash of the
+name, so every process gives a name the same alias without asking the others."""
+    alias = anonNames.get(name)
+    if alias is None:
+        digest = hmac.new(anonKey, name.encode('utf8'), hashlib.sha1).hexdigest()
+        alias = anonNames[name] = u'Player%s' % digest[:10]
+    return alias
+
+def namesRegex(names):
+    """\
+A regex matching any of names which isn't followed by more of a word, the
+longest where one name starts another. The names are put in a trie, so at each
+place in the text the regex follows the one branch for the characters there
+rather than trying every name in turn."""
+    trie = {}
+    for name in names:
+        node = trie
+        for c in name:
+            node = node.setdefault(c, {})
+        node[u''] = {}      # a name ends here
+    def pattern(node):
+        branches = [re.escape(c) + pattern(child) for (c, child) in sorted(node.iteritems()) if c]
+        if not branches:
+            return u''
+        if len(branches) == 1 and u'' not in node:
+            return branches[0]
+        return u'(?:%s)%s' % (u'|'.join(branches), u'?' if u'' in node else u'')
+    return re.compile(u'%s(?!\w)' % pattern(trie), re.UNICODE)
+
+def handNames(hhc, handText):
+    names = [m.group('PNAME') for m in hhc.re_PlayerInfo.finditer(handText)]
+    if not names and hasattr(hhc, 're_TourneyPlayerInfo'):
+        names = [m.group('PNAME') for m in hhc.re_TourneyPlayerInfo.finditer(handText)]
+    return names
+
+def replaceName(m):
+    # names in the middle of a word are left alone
+    before = m.string[m.start() - 1:m.start()]
+    if before and (before.isalnum() or before == u'_'):
+        return m.group(0)
+    return aliasFor(m.group(0))
+
+def handSeparator(hhc):
+    "Text to write between hands, which the converter splits them at"
+    for separator in (u'\n\n\n', u'\x00'):
+        m = hhc.re_SplitHands.match(separator)
+        if m and m.end() == len(separator):
+            return separator
+    return u'\n\n\n'
+
+def anonymiseFile(path, outPath):
+    """\
+Writes the hands in path to outPath (or stdout, if it's None) with the player
+names replaced. Runs in a process set up by initAnonymiser().
+Returns (path, number of hands, {name: alias} of the names in the file)."""
+    hhc = anonConverter
+    known = set(anonNames)
+    # the names are everyone seated in a hand in the file, as a player can
+    # join, sit out or chat in hands before the first hand they play
+    hhc.setInput(path)
+    names = set()
+    for handText in hhc.allHandsAsIter():
+        names.update(handNames(hhc, handText))
+    regex = namesRegex(names)
+
+    hhc.setInput(path)
+    if outPath is None:
+        out_fh = codecs.getwriter('utf8')(sys.stdout)
+    else:
+        out_fh = codecs.open(outPath, 'w', 'utf8')
+    separator = handSeparator(hhc)
+    hands = 0
+    try:
+        for handText in hhc.allHandsAsIter():
+            if hands:
+                out_fh.write(separator)
+            if names:
+                handText = regex.sub(replaceName, handText)
+            out_fh.write(handText)
+            hands += 1
+        out_fh.write(u'\n')
+    finally:
+        if outPath is not None:
+            out_fh.close()
+    new = dict([(name, alias) for (name, alias) in anonNames.iteritems() if name not in known])
+    return (path, hands, new)
 
-(options, argv) = Options.fpdb_options()
+def readNames(path):
+    """{name: alias} from a file of lines of alias<tab>name, as written by writeNames()"""
+    names = {}
+    if path and os.path.exists(path):
+        for line in codecs.open(path, 'r', 'utf8'):
+            line = line.rstrip(u'\r\n')
+            if line:
+                (alias, name) = line.split(u'\t', 1)
+                names[name] = alias
+    return names
 
-filter = options.hhc
+def writeNames(path, names):
+    out_fh = codecs.open(path, 'w', 'utf8')
+    try:
+        for (name, alias) in sorted(names.iteritems(), key = lambda (name, alias): alias):
+            out_fh.write(u'%s\t%s\n' % (alias, name))
+    finally:
+        out_fh.close()
 
-filter_name = filter.replace("ToFpdb", "")
+def listFiles(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for (dir, subdirs, names) in os.walk(path):
+                files += [os.path.join(dir, name) for name in sorted(names)]
+        else:
+            files.append(path)
+    return files
 
-mod = __import__(filter)
-obj = getattr(mod, filter_name, None)
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
 
-hhc = obj(autostart=False)
+    parser = OptionParser(usage = "%prog [options] file-or-directory ...")
+    parser.add_option("-i", "--infile", dest="infile", metavar="FILE",
+                    help="Hand history file (files and directories can also just be listed)")
+    parser.add_option("-k", "--konverter", dest="hhc", default="PokerStarsToFpdb", metavar="MODULE",
+                    help="Module name for Hand History Converter")
+    parser.add_option("-c", "--configFile", dest="config", default=None,
+                    help="Specifies a configuration file.")
+    parser.add_option("-o", "--outdir", dest="outdir", metavar="DIR",
+                    help="Directory to write the anonymised files to")
+    parser.add_option("-m", "--map", dest="map", metavar="FILE",
+                    help="File of aliases to use and add to, to keep them the same from run to run")
+    parser.add_option("-p", "--processes", dest="processes", default=multiprocessing.cpu_count(), type="int",
+                    help="Number of processes (default: number of cores)")
+    (options, argv) = parser.parse_args(args = argv)
 
-if os.path.exists(options.infile):
-    in_fh = codecs.open(options.infile, 'r', "utf8")
-    filecontents = in_fh.read()
-    in_fh.close()
-else:
-    print "Could not find file %s" % options.infile
-    exit(1)
+    files = listFiles(([options.infile] if options.infile else []) + argv)
+    if not files:
+        parser.error("no hand history files given")
+    for path in files:
+        if not os.path.exists(path):
+            print "Could not find file %s" % path
+            return 1
+    if options.outdir is None and len(files) > 1:
+        parser.error("-o is needed for more than one file")
 
-m = hhc.re_PlayerInfo.finditer(filecontents)
+    config = Configuration.Config(file = options.config)
+    names = readNames(options.map)
+    key = os.urandom(16)
+    initArgs = (config.file, options.hhc, names, key)
 
-players = []
-for a in m:
-    players = players + [a.group('PNAME')]
+    jobs = []
+    for path in files:
+        outPath = None
+        if options.outdir is not None:
+            outPath = os.path.join(options.outdir, os.path.basename(path))
+            if os.path.abspath(outPath) == os.path.abspath(path):
+                parser.error("-o would overwrite %s" % path)
+            if outPath in [job[1] for job in jobs]:
+                parser.error("more than one file is called %s" % os.path.basename(path))
+        jobs.append((path, outPath))
+    if options.outdir is not None and not os.path.isdir(options.outdir):
+        os.makedirs(options.outdir)
 
-uniq = set(players)
+    if options.processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(options.processes, len(jobs)), initAnonymiser, initArgs)
+        try:
+            results = [pool.apply_async(anonymiseFile, job) for job in jobs]
+            results = [result.get() for result in results]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        initAnonymiser(*initArgs)
+        results = [anonymiseFile(*job) for job in jobs]
 
-for i, name in enumerate(uniq, 1):
-    filecontents = filecontents.replace(name, 'Player%d' %i)
+    for (path, hands, new) in results:
+        names.update(new)
+        if options.outdir is not None:
+            print "%s: %d hands, %d new names" % (path, hands, len(new))
+    if options.map:
+        writeNames(options.map, names)
 
-print filecontents
+if __name__ == '__main__':
+    sys.exit(main())
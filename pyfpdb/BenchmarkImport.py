@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in
+#agpl-3.0.txt in the docs folder of the package.
+
+"""Measure how fast hand histories are parsed, with 1 to n parse processes.
+
+Hands are converted and their stats worked out exactly as a bulk import
+would, but nothing is written to the database. e.g.
+    ./BenchmarkImport.py -c PokerStars -f regression-test-files/cash/Stars -p 4
+Converters for the same site can be compared on the same files with e.g.
+    ./BenchmarkImport.py -m PokerStarsToFpdb,PokerStarsLexerToFpdb -f regression-test-files/cash/Stars -p 1
+"""
+
+#    Standard Library modules
+import os
+import sys
+from time import time
+from optparse import OptionParser
+import multiprocessing
+
+#    fpdb/FreePokerTools modules
+import Configuration
+import HandHistoryConverter
+import Hand
+
+
+def listFiles(path):
+    if os.path.isdir(path):
+        files = []
+        for (dir, subdirs, names) in os.walk(path):
+            files += [os.path.join(dir, name) for name in names]
+        return sorted(files)
+    return [path]
+
+def parseFiles(config, hhcClass, files, processes, columnar = False):
+    """Parse files with the given number of processes. Returns (hands, errors, seconds)"""
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, HandHistoryConverter.initParseWorker, (config.file,))
+    hands = errors = 0
+    start = time()
+    try:
+        for file in files:
+            hhc = hhcClass(config, in_path = file, autostart = False)
+            for hand in hhc.iterHands(pool, processes, columnar = columnar):
+                if pool is None and hand is not None and not columnar:
+                    Hand.HandRows(hand)     # the stats the workers work out too
+            hands += hhc.numHands
+            errors += hhc.numErrors
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return (hands, errors, time() - start)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = OptionParser()
+    parser.add_option("-f", "--file", dest="filename", metavar="FILE", default="regression-test-files/cash/Stars",
+                    help="Hand history file, or directory of them")
+    parser.add_option("-c", "--convert", dest="filtername", default="PokerStars", metavar="FILTER",
+                    help="Conversion filter (*Full Tilt Poker, PokerStars, Everleaf, Absolute)")
+    parser.add_option("-m", "--module", dest="module", metavar="MODULE",
+                    help="Converter module to use instead of the site's, e.g. PokerStarsLexerToFpdb, "
+                         "or several separated by commas to compare them")
+    parser.add_option("-p", "--processes", dest="processes", default=multiprocessing.cpu_count(), type="int",
+                    help="Most parse processes to try (default: number of cores)")
+    parser.add_option("-r", "--repeat", dest="repeat", default=1, type="int",
+                    help="Parse the files this many times per run, to get a measurable time")
+    parser.add_option("-b", "--batchStats", action="store_true", dest="columnarStats", default=False,
+                    help="Work out the stats a batch of hands at a time, in columns")
+    (options, argv) = parser.parse_args(args = argv)
+
+    config = Configuration.Config()
+    if options.module:
+        hhcClasses = [getattr(__import__(module), module[:-6]) for module in options.module.split(',')]
+    else:
+        hhcClasses = [HandHistoryConverter.getSiteHhc(config, options.filtername)]
+    files = listFiles(options.filename) * options.repeat
+
+    rates = []      # (converter, hands/s in one process)
+    for hhcClass in hhcClasses:
+        print "%s: %d files, %d cores" % (hhcClass.__name__, len(files), multiprocessing.cpu_count())
+        print "processes   hands  errors   seconds   hands/s  speedup"
+        base = None
+        for processes in xrange(1, options.processes + 1):
+            (hands, errors, secs) = parseFiles(config, hhcClass, files, processes, options.columnarStats)
+            rate = hands / secs
+            if base is None:
+                base = rate
+            print "%9d %7d %7d %9.2f %9.0f %7.2fx" % (processes, hands, errors, secs, rate, rate / base)
+        rates.append((hhcClass.__name__, base))
+
+    if len(rates) > 1:
+        print
+        print "converter              hands/s  relative   (one process)"
+        for (name, rate) in rates:
+            print "%-20s %9.0f %8.2fx" % (name, rate, rate / rates[0][1])
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in
+#agpl-3.0.txt in the docs folder of the package.
+
+"""Time every converter on the hand histories in regression-test-files.
+
+Each *ToFpdb converter is given each file it can convert the first hands of, so the Stars
+files go through PokerStarsToFpdb and PokerStarsLexerToFpdb, the Full Tilt files
+through FulltiltToFpdb and so on.
+Files are read again as many times as it takes to reach -n hands, so that small
+samples give a measurable time. For each converter this prints hands/s (the
+best of -r runs), the time taken by each stage of building a hand (splitting
+the file into hands, the game type, each read method, working out the stats)
+and the peak RSS of the process it ran in. Each converter is run in a process
+of its own, so one's memory doesn't count against the next. e.g.
+    ./BenchmarkSuite.py -n 5000 -o bench-new.json -C bench-old.json
+writes the results to bench-new.json and shows how hands/s changed from the
+results of an earlier run in bench-old.json.
+"""
+
+#    Standard Library modules
+import os
+import sys
+import glob
+import itertools
+import json
+import subprocess
+import platform
+import datetime
+from time import time
+from optparse import OptionParser
+import multiprocessing
+try:
+    import resource
+except ImportError:     # not on windows
+    resource = None
+
+#    fpdb/FreePokerTools modules
+import Configuration
+import Hand
+from Exceptions import FpdbParseError
+from BenchmarkImport import listFiles
+
+
+# The stages of building a hand that are timed, in the order they're done.
+# split, stats and other aren't converter methods: split is cutting the file into
+# hand texts, stats is working out the HandsPlayers stats and other is the rest
+# of building the hand.
+STAGES = ('split', 'readGameType', 'readHandInfo', 'readPlayerStacks', 'markStreets',
+          'readBlinds', 'readAntes', 'readBringIn', 'readButton', 'readHeroCards',
+          'readShowdownActions', 'readCommunityCards', 'readAction', 'readCollectPot',
+          'readShownCards', 'getRake', 'guessMaxSeats', 'readOther', 'other', 'stats')
+
+def converterModules():
+    """Names of the *ToFpdb modules next to this one"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    return sorted([os.path.basename(path)[:-3] for path in glob.glob(os.path.join(here, '*ToFpdb.py'))])
+
+def peakRss():
+    """Most memory this process has had resident so far, in kB, or None if that can't be found"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024     # bytes there, kB everywhere else
+    return rss
+
+def gitCommit():
+    try:
+        proc = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (out, err) = proc.communicate()
+    except OSError:
+        return None
+    return out.strip() or None
+
+def reads(hhc, path):
+    """True if hhc can convert one of the first few hands in path"""
+    hhc.setInput(path)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')     # some converters print the hands they can't read
+    try:
+        for handText in itertools.islice(hhc.allHandsAsIter(), 5):
+            if hhc.isSummary(handText):
+                return False
+            try:
+                if hhc.processHand(handText) is not None:
+                    return True
+            except FpdbParseError:
+                pass
+    except Exception:
+        pass    # a file for some other site
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return False
+
+def timeStages(hhc, seconds):
+    """Have the stage methods of hhc add the time they take to seconds[stage]"""
+    def timed(stage, method):
+        def timedMethod(*args, **kwargs):
+            start = time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds[stage] += time() - start
+        return timedMethod
+    for stage in STAGES:
+        if hasattr(hhc, stage):
+            setattr(hhc, stage, timed(stage, getattr(hhc, stage)))
+
+def parseFile(hhc, path, seconds = None):
+    """\
+Convert the hands in path and work out their stats, as an import would.
+If seconds is given, the time each stage takes is added to it (timeStages()
+must have been called on hhc with the same dict).
+Returns (hands, errors), not counting hands of unsupported game types."""
+    hands = errors = 0
+    building = 0.0      # seconds in processHand()
+    if seconds is not None:
+        reading = sum([secs for (stage, secs) in seconds.iteritems() if stage not in ('split', 'other', 'stats')])
+    hhc.setInput(path)
+    handTexts = hhc.allHandsAsIter()
+    while True:
+        start = time()
+        handText = next(handTexts, None)
+        split = time()
+        if handText is None:
+            break
+        try:
+            hand = hhc.processHand(handText)
+        except FpdbParseError:
+            errors += 1
+            continue
+        built = time()
+        if hand is None:
+            continue
+        Hand.HandRows(hand)
+        hands += 1
+        if seconds is not None:
+            seconds['split'] += split - start
+            building += built - split
+            seconds['stats'] += time() - built
+    if seconds is not None:
+        # other is the part of processHand() the reads weren't
+        reading = sum([secs for (stage, secs) in seconds.iteritems() if stage not in ('split', 'other', 'stats')]) - reading
+        seconds['other'] += building - reading
+    return (hands, errors)
+
+def benchmarkConverter(configFile, module, files, target, runs):
+    """\
+Benchmark the converter in module on each of files it can read, each read
+enough times to make at least target hands. Meant to be run in a process of
+its own. Returns a dict of the results, or None if the converter reads none of files."""
+    config = Configuration.Config(file = configFile)
+    hhcClass = getattr(__import__(module), module[:-6])
+    hhc = hhcClass(config, autostart = False)
+
+    results = []
+    for path in files:
+        if not reads(hhc, path):
+            continue
+        (hands, errors) = parseFile(hhc, path)     # also warms up the converter's caches
+        repeat = max(1, -(-target // hands)) if hands else 1
+        best = None
+        for run in xrange(runs):
+            start = time()
+            for i in xrange(repeat):
+                parseFile(hhc, path)
+            secs = time() - start
+            if best is None or secs < best:
+                best = secs
+        results.append({'path': path, 'repeat': repeat,
+                        'hands': hands * repeat, 'errors': errors * repeat, 'seconds': best,
+                        'handsPerSecond': hands * repeat / best if best else None})
+    if not results:
+        return None
+
+    seconds = dict.fromkeys(STAGES, 0.0)
+    timeStages(hhc, seconds)
+    for result in results:
+        for i in xrange(result['repeat']):
+            parseFile(hhc, result['path'], seconds)
+
+    hands = sum([result['hands'] for result in results])
+    secs = sum([result['seconds'] for result in results])
+    return {'converter': module, 'files': results, 'hands': hands,
+            'errors': sum([result['errors'] for result in results]), 'seconds': secs,
+            'handsPerSecond': hands / secs if secs else None,
+            'stages': seconds, 'peakRss': peakRss()}
+
+def runSeparately(function, *args):
+    """function(*args), run in a new process"""
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(function, args)
+    finally:
+        pool.close()
+        pool.join()
+
+def printResult(result):
+    print "%s: %d hands/s, peak RSS %s kB" % (result['converter'], result['handsPerSecond'],
+                                             result['peakRss'] if result['peakRss'] is not None else '?')
+    print "  %-60s %7s %6s %8s %9s" % ("file", "hands", "errors", "seconds", "hands/s")
+    for f in result['files']:
+        print "  %-60s %7d %6d %8.2f %9.0f" % (f['path'][-60:], f['hands'], f['errors'], f['seconds'], f['handsPerSecond'])
+    total = sum(result['stages'].values())
+    print "  %-20s %8s %9s %6s" % ("stage", "seconds", "us/hand", "%")
+    for stage in STAGES:
+        secs = result['stages'][stage]
+        if secs:
+            print "  %-20s %8.3f %9.1f %5.1f%%" % (stage, secs, secs * 1e6 / result['hands'], secs * 100 / total)
+    print
+
+def compare(results, old, threshold):
+    """\
+Print how hands/s of each converter changed from old, the results of an earlier run.
+Returns the number of converters more than threshold (a fraction) slower."""
+    before = dict([(result['converter'], result['handsPerSecond']) for result in old['converters']])
+    print "compared with commit %s, run %s" % (old.get('commit'), old.get('date'))
+    print "converter                  before     after   change"
+    slower = 0
+    for result in results:
+        if result['converter'] not in before:
+            continue
+        change = result['handsPerSecond'] / before[result['converter']] - 1
+        flag = ''
+        if change < -threshold:
+            slower += 1
+            flag = '  SLOWER'
+        print "%-22s %10.0f %9.0f %+7.1f%%%s" % (result['converter'], before[result['converter']],
+                                                 result['handsPerSecond'], change * 100, flag)
+    return slower
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = OptionParser(usage = "%prog [options] [file-or-directory ...]")
+    parser.add_option("-m", "--module", dest="modules", metavar="MODULES",
+                    help="Converter modules to time, separated by commas (default: every *ToFpdb module)")
+    parser.add_option("-c", "--configFile", dest="config", default=None,
+                    help="Specifies a configuration file.")
+    parser.add_option("-n", "--hands", dest="target", default=1000, type="int",
+                    help="Read each file as many times as it takes to convert at least this many hands (default: 1000)")
+    parser.add_option("-r", "--runs", dest="runs", default=3, type="int",
+                    help="Time this many runs of each file and keep the fastest (default: 3)")
+    parser.add_option("-o", "--output", dest="output", metavar="FILE",
+                    help="Write the results to FILE as JSON")
+    parser.add_option("-C", "--compare", dest="compare", metavar="FILE",
+                    help="Compare hands/s with the results in FILE, from an earlier -o")
+    parser.add_option("-t", "--threshold", dest="threshold", default=5.0, type="float",
+                    help="With -C, exit with status 1 if a converter is more than this percentage slower (default: 5)")
+    (options, argv) = parser.parse_args(args = argv)
+
+    paths = argv or ['regression-test-files/cash', 'regression-test-files/tour']
+    files = []
+    for path in paths:
+        files += listFiles(path)
+    modules = options.modules.split(',') if options.modules else converterModules()
+    config = Configuration.Config(file = options.config)
+    old = None
+    if options.compare:
+        old = json.load(open(options.compare))     # before -o can overwrite it
+
+    results = []
+    for module in modules:
+        try:
+            result = runSeparately(benchmarkConverter, config.file, module, files, options.target, options.runs)
+        except Exception, e:
+            print "%s: failed: %s" % (module, e)
+            continue
+        if result is None:
+            continue
+        printResult(result)
+        results.append(result)
+
+    if options.output:
+        out = open(options.output, 'w')
+        try:
+            json.dump({'commit': gitCommit(), 'date': datetime.datetime.now().isoformat(),
+                       'python': platform.python_version(), 'platform': platform.platform(),
+                       'hands': options.target, 'runs': options.runs, 'converters': results},
+                      out, indent = 1, sort_keys = True)
+        finally:
+            out.close()
+    if old is not None:
+        if compare(results, old, options.threshold / 100):
+            return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -265,9 +265,9 @@ or None if we fail to get the info """
                                                          hand))
 
     def readCollectPot(self, hand):
-        pots = [Decimal(0) for n in range(hand.maxseats)]
+        pots = [0 for n in range(hand.maxseats)]   # in cents, as hand.pot has them
         for m in self.re_CollectPot.finditer(hand.handText):
-            pots[int(m.group('PSEAT'))] += Decimal(m.group('POT'))
+            pots[int(m.group('PSEAT'))] += Hand.toCents(m.group('POT'))
         # Regarding the processing logic for "committed", see Pot.end() in
         # Hand.py
         committed = sorted([(v,k) for (k,v) in hand.pot.committed.items()])
@@ -276,7 +276,7 @@ or None if we fail to get the info """
             if committed[-1][1] == pname:
                 pots[p] -= committed[-1][0] - committed[-2][0]
             if pots[p] > 0:
-                hand.addCollectPot(player=pname, pot=pots[p])
+                hand.addCollectPot(player=pname, pot=Hand.fromCents(pots[p]))
 
     def readShownCards(self, hand):
         for m in self.re_ShownCards.finditer(hand.handText):
@@ -417,10 +417,20 @@ class Import:
         self.saveActions = string_to_bool(node.getAttribute("saveActions"), default=True)
         self.fastStoreHudCache = string_to_bool(node.getAttribute("fastStoreHudCache"), default=False)
         self.saveStarsHH = string_to_bool(node.getAttribute("saveStarsHH"), default=False)
+        self.leanHands = string_to_bool(node.getAttribute("leanHands"), default=False)
+        self.warmPlayerCache = string_to_bool(node.getAttribute("warmPlayerCache"), default=False)
+        try:
+            self.insertBatchSize = int(node.getAttribute("insertBatchSize"))
+        except ValueError:
+            self.insertBatchSize = 100
+        try:
+            self.handIndexMax = int(node.getAttribute("handIndexMax"))
+        except ValueError:
+            self.handIndexMax = 2000000
 
     def __str__(self):
-        return "    interval = %s\n    callFpdbHud = %s\n    hhArchiveBase = %s\n    saveActions = %s\n    fastStoreHudCache = %s\n" \
-            % (self.interval, self.callFpdbHud, self.hhArchiveBase, self.saveActions, self.fastStoreHudCache)
+        return "    interval = %s\n    callFpdbHud = %s\n    hhArchiveBase = %s\n    saveActions = %s\n    fastStoreHudCache = %s\n    leanHands = %s\n    insertBatchSize = %s\n    warmPlayerCache = %s\n    handIndexMax = %s\n" \
+            % (self.interval, self.callFpdbHud, self.hhArchiveBase, self.saveActions, self.fastStoreHudCache, self.leanHands, self.insertBatchSize, self.warmPlayerCache, self.handIndexMax)
 
 class HudUI:
     def __init__(self, node):
@@ -832,6 +842,18 @@ class Config:
         try:    imp['fastStoreHudCache'] = self.imp.fastStoreHudCache
         except:  imp['fastStoreHudCache'] = True
 
+        try:    imp['leanHands'] = self.imp.leanHands
+        except:  imp['leanHands'] = False
+
+        try:    imp['insertBatchSize'] = self.imp.insertBatchSize
+        except:  imp['insertBatchSize'] = 100
+
+        try:    imp['warmPlayerCache'] = self.imp.warmPlayerCache
+        except:  imp['warmPlayerCache'] = False
+
+        try:    imp['handIndexMax'] = self.imp.handIndexMax
+        except:  imp['handIndexMax'] = 2000000
+
         return imp
 
     def get_default_paths(self, site = None):
@@ -38,9 +38,12 @@ from time import time, strftime, sleep
 from decimal import Decimal
 import string
 import re
-import Queue
 import codecs
 import math
+import tempfile
+import array
+import bisect
+from cStringIO import StringIO
 
 import logging
 # logging has been set up in fpdb.py or HUD_main.py, use their settings:
@@ -75,7 +78,7 @@ except ImportError:
     use_numpy = False
 
 
-DB_VERSION = 119
+DB_VERSION = 123
 
 
 # Variance created as sqlite has a bunch of undefined aggregate functions.
@@ -94,6 +97,44 @@ class sqlitemath:
     def mod(self, a, b):
         return a%b
 
+def handNumber(siteHandNo):
+    """siteHandNo as the number the index of hands keeps, or None if it isn't one"""
+    try:
+        return int(siteHandNo)
+    except (TypeError, ValueError):
+        return None
+
+
+# 64-bit ints where C longs are (not on Windows), else doubles, which hold
+# whole numbers exactly up to 2**53
+HAND_NOS_TYPECODE = 'l' if array.array('l').itemsize >= 8 else 'd'
+HAND_NOS_EXACT = 2**63 if HAND_NOS_TYPECODE == 'l' else 2**53
+
+class HandNos(object):
+    """\
+The siteHandNos of one gametype in the index of hands (see Database.knownHandNos()).
+Those loaded from Hands are kept in a sorted array, 8 bytes a hand rather than
+the 30 or so of a set of ints, and those stored since in a set."""
+
+    def __init__(self, handNos=()):
+        self.loaded = array.array(HAND_NOS_TYPECODE, sorted([n for n in handNos if -HAND_NOS_EXACT < n < HAND_NOS_EXACT]))
+        self.added = set([n for n in handNos if not -HAND_NOS_EXACT < n < HAND_NOS_EXACT])
+
+    def __contains__(self, handNo):
+        if handNo in self.added:
+            return True
+        i = bisect.bisect_left(self.loaded, handNo)
+        return i < len(self.loaded) and self.loaded[i] == handNo
+
+    def __len__(self):
+        return len(self.loaded) + len(self.added)
+
+    def add(self, handNo):
+        self.added.add(handNo)
+
+    def discard(self, handNo):
+        self.added.discard(handNo)
+
 
 class Database:
 
@@ -245,6 +286,11 @@ class Database:
         self.database = db_params['db-databaseName']
         self.host = db_params['db-host']
         self.db_path = ''
+        self.bulkLoading = False    # see startBulkLoad()
+        self.hudCacheDeltas = None  # {HudCache key: sums} while gathering them, see gatherHudCache()
+        self.hudCacheUpsert = None  # whether HudCache can be upserted, once it's been looked at
+        self.handIndexMax = self.import_options['handIndexMax']     # see knownSiteHandNos()
+        self.resetHandIndex()
 
         # where possible avoid creating new SQL instance by using the global one passed in
         if sql is None:
@@ -268,7 +314,8 @@ class Database:
                 self.recreate_tables()
                 self.wrongDbVersion = False
 
-            self.pcache      = None     # PlayerId cache
+            self.pcache      = None     # {siteId: {name: Players id}}, see getSqlPlayerIDs()
+            self.pcacheLoaded = None    # sites loaded into pcache by loadPlayerIds()
             self.cachemiss   = 0        # Delete me later - using to count player cache misses
             self.cachehit    = 0        # Delete me later - using to count player cache hits
 
@@ -319,8 +366,10 @@ class Database:
         self.__connected = True
 
     def connect(self, backend=None, host=None, database=None,
-                user=None, password=None, create=False):
-        """Connects a database with the given parameters"""
+                user=None, password=None, create=False, localInfile=False):
+        """Connects a database with the given parameters. localInfile lets mysql
+LOAD DATA LOCAL INFILE, which lets the server read files of the client, so
+only startBulkLoad() asks for it."""
         if backend is None:
             raise FpdbError('Database backend not defined')
         self.backend = backend
@@ -333,10 +382,12 @@ class Database:
         
         if backend == Database.MYSQL_INNODB:
             import MySQLdb
+            self.IntegrityError = MySQLdb.IntegrityError
             if use_pool:
                 MySQLdb = pool.manage(MySQLdb, pool_size=5)
             try:
-                self.connection = MySQLdb.connect(host=host, user=user, passwd=password, db=database, use_unicode=True)
+                self.connection = MySQLdb.connect(host=host, user=user, passwd=password, db=database, use_unicode=True,
+                                                  local_infile=1 if localInfile else 0)
             #TODO: Add port option
             except MySQLdb.Error, ex:
                 if ex.args[0] == 1045:
@@ -347,6 +398,7 @@ class Database:
                     print "*** WARNING UNKNOWN MYSQL ERROR", ex
         elif backend == Database.PGSQL:
             import psycopg2
+            self.IntegrityError = psycopg2.IntegrityError
             import psycopg2.extensions
             if use_pool:
                 psycopg2 = pool.manage(psycopg2, pool_size=5)
@@ -385,6 +437,7 @@ class Database:
         elif backend == Database.SQLITE:
             create = True
             import sqlite3
+            self.IntegrityError = sqlite3.IntegrityError
             if use_pool:
                 sqlite3 = pool.manage(sqlite3, pool_size=1)
             #else:
@@ -468,9 +521,16 @@ class Database:
             if not ok:
                 log.debug("commit failed")
                 raise FpdbError('sqlite commit failed')
+        self.handIndexPending = []
 
     def rollback(self):
         self.connection.rollback()
+        # the hands stored since the last commit are gone again
+        for (gametypeId, siteHandNo) in self.handIndexPending:
+            known = self.handIndex.get(gametypeId)
+            if known is not None:
+                known.discard(siteHandNo)
+        self.handIndexPending = []
 
     def connected(self):
         return self.__connected
@@ -490,11 +550,12 @@ class Database:
         self.cursor.close()
         self.connection.close()
     
-    def reconnect(self, due_to_error=False):
+    def reconnect(self, due_to_error=False, localInfile=False):
         """Reconnects the DB"""
         #print "started reconnect"
         self.disconnect(due_to_error)
-        self.connect(self.backend, self.host, self.database, self.user, self.password)
+        self.connect(self.backend, self.host, self.database, self.user, self.password,
+                     localInfile=localInfile)
     
     def get_backend_name(self):
         """Returns the name of the currently used backend"""
@@ -1094,6 +1155,8 @@ class Database:
             c.execute(self.sql.query['createHandsPlayersTable'])
             c.execute(self.sql.query['createHandsActionsTable'])
             c.execute(self.sql.query['createHudCacheTable'])
+            c.execute(self.sql.query['createImportCheckpointsTable'])
+            c.execute(self.sql.query['createQuarantinedHandsTable'])
 
             # create unique indexes:
             c.execute(self.sql.query['addTourneyIndex'])
@@ -1101,6 +1164,12 @@ class Database:
             c.execute(self.sql.query['addPlayersIndex'])
             c.execute(self.sql.query['addTPlayersIndex'])
             c.execute(self.sql.query['addTTypesIndex'])
+            c.execute(self.sql.query['addHudCacheIndex'])
+            c.execute(self.sql.query['addImportCheckpointsIndex'])
+            c.execute(self.sql.query['addQuarantinedHandsIndex'])
+            self.hudCacheUpsert = None
+            self.pcache = self.pcacheLoaded = None      # the ids are of the old tables
+            self.resetHandIndex()
 
             self.fillDefaultData()
             self.commit()
@@ -1510,8 +1579,21 @@ class Database:
 
         c = self.get_cursor()
 
-        c.execute(q, (
-                p['tableName'], 
+        try:
+            self.executeOrRollBack(c, q, self.handsValues(p))
+        except self.IntegrityError:
+            # stored by another importer since the index of hands was loaded?
+            if not self.isStoredHand(p['gameTypeId'], p['siteHandNo']):
+                raise
+            self.indexHand(p['gameTypeId'], p['siteHandNo'], committed=True)
+            raise FpdbHandDuplicate(p['siteHandNo'])
+        self.indexHand(p['gameTypeId'], p['siteHandNo'])
+        return self.get_last_insert_id(c)
+    # def storeHand
+
+    def handsValues(self, p):
+        """The values of the store_hand query for the Hands row p (a dict)"""
+        return (p['tableName'], 
                 p['gameTypeId'], 
                 p['siteHandNo'], 
                 0, # tourneyId: 0 means not a tourney hand
@@ -1541,11 +1623,252 @@ class Database:
                 p['street3Pot'],
                 p['street4Pot'],
                 p['showdownPot']
-        ))
-        return self.get_last_insert_id(c)
-    # def storeHand
+        )
+
+    # Most values one sqlite statement can have (SQLITE_MAX_VARIABLE_NUMBER as sqlite is usually built)
+    SQLITE_MAX_VARIABLES = 999
+
+    def multiRowInserts(self, q, rows):
+        """\
+Generator of (query, values, number of rows) to insert rows with as few
+statements as possible, given q, which inserts a single row of VALUES. All the
+rows go in one statement, except on sqlite, which limits the number of values
+in a statement (and before 3.7.11 only had single row VALUES)."""
+        (head, row) = q.rsplit('VALUES', 1)
+        row = row.strip()
+        size = len(rows)
+        if self.backend == self.SQLITE and rows:
+            import sqlite3
+            if sqlite3.sqlite_version_info < (3, 7, 11):
+                size = 1
+            else:
+                size = max(1, self.SQLITE_MAX_VARIABLES // len(rows[0]))
+        for start in xrange(0, len(rows), size):
+            chunk = rows[start:start + size]
+            yield ("%sVALUES %s" % (head, ",".join([row] * len(chunk))),
+                   tuple([value for r in chunk for value in r]), len(chunk))
+
+    # pragmas set for bulk loads on sqlite, see startBulkLoad()
+    SQLITE_BULK_PRAGMAS = (('synchronous', 'OFF'), ('journal_mode', 'MEMORY'),
+                           ('temp_store', 'MEMORY'), ('cache_size', '20000'))
+
+    def startBulkLoad(self):
+        """\
+Have storeHands() load rows with the backend's bulk loader rather than INSERTs
+from now until finishBulkLoad(): COPY FROM STDIN on postgres, LOAD DATA LOCAL
+INFILE on mysql, and an executemany of the prepared insert on sqlite, which
+has its syncing to disk turned off for the load. For big imports with the
+indexes dropped (see Importer.runImport()). Except on postgres the Hands ids are
+counted here from the highest in the table, so nothing else may store hands
+in the meantime. On mysql the database is connected again with LOAD DATA LOCAL
+allowed, until finishBulkLoad(), so call this before setting up the session
+(e.g. prepareBulkImport())."""
+        if self.bulkLoading:
+            return
+        self.commit()
+        if self.backend == self.MYSQL_INNODB:
+            self.reconnect(localInfile=True)
+        c = self.get_cursor()
+        if self.backend == self.SQLITE:
+            self.bulkPragmas = []
+            for (pragma, value) in self.SQLITE_BULK_PRAGMAS:
+                c.execute("PRAGMA %s" % pragma)
+                self.bulkPragmas.append((pragma, c.fetchone()[0]))
+                c.execute("PRAGMA %s = %s" % (pragma, value))
+        if self.backend != self.PGSQL:
+            c.execute("SELECT MAX(id) FROM Hands")
+            self.nextHandId = (c.fetchone()[0] or 0) + 1
+        self.bulkLoading = True
+        log.info("bulk loading hands")
+
+    def finishBulkLoad(self):
+        """Go back to storing hands with INSERTs, and commit what was loaded"""
+        if not self.bulkLoading:
+            return
+        self.bulkLoading = False
+        self.commit()
+        if self.backend == self.SQLITE:
+            c = self.get_cursor()
+            for (pragma, value) in self.bulkPragmas:
+                c.execute("PRAGMA %s = %s" % (pragma, value))
+        elif self.backend == self.MYSQL_INNODB:
+            self.reconnect()    # without LOAD DATA LOCAL
+
+    @staticmethod
+    def bulkValue(value):
+        """value as a field of the text format read by COPY and LOAD DATA"""
+        if value is None:
+            return '\\N'
+        if value is True or value is False:
+            return '1' if value else '0'
+        if isinstance(value, unicode):
+            value = value.encode('utf8')
+        elif isinstance(value, float):
+            return repr(value)
+        else:
+            value = str(value)
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def bulkLoad(self, q, rows):
+        """Load rows into the table q (an INSERT of a single row) inserts into"""
+        c = self.get_cursor()
+        if self.backend == self.SQLITE:
+            c.executemany(q.replace('%s', self.sql.query['placeholder']), rows)
+            return
+        m = re.search(r"INSERT\s+INTO\s+(\w+)\s*\((.*?)\)\s*VALUES", q, re.I | re.S)
+        table = m.group(1)
+        columns = [column.strip() for column in m.group(2).split(',')]
+        data = StringIO()
+        for row in rows:
+            data.write('\t'.join([self.bulkValue(value) for value in row]))
+            data.write('\n')
+        if self.backend == self.PGSQL:
+            data.seek(0)
+            c.copy_from(data, table, columns = columns)
+        elif self.backend == self.MYSQL_INNODB:
+            # MySQLdb can only send LOAD DATA a file
+            (fd, path) = tempfile.mkstemp(suffix = '.txt', prefix = 'fpdb-')
+            try:
+                f = os.fdopen(fd, 'wb')
+                f.write(data.getvalue())
+                f.close()
+                c.execute("LOAD DATA LOCAL INFILE %%s INTO TABLE %s CHARACTER SET utf8 (%s)"
+                          % (table, ','.join(columns)), (path,))
+            finally:
+                os.remove(path)
+
+    def storeHands(self, hands):
+        """\
+Store a batch of hands (Hands or HandRows, after prepInsert()) with one
+statement for all their Hands rows and one for all their HandsPlayers rows,
+rather than a storeHand() and storeHandsPlayers() for each.
+The Hands ids are got in bulk: a range taken from the sequence first on
+postgres, and on mysql and sqlite read back after the inserts by gametypeId
+and siteHandNo (see storedHandIds()). Hands already in the database, or
+earlier in the batch, are marked is_duplicate and left out; the others get
+their dbid_hands.
+In a bulk load (see startBulkLoad()) the rows go through bulkLoad() instead.
+Returns the hands stored. Doesn't commit."""
+        stored = []
+        seen = set()
+        for hand in hands:
+            hh = hand.handsRow()
+            key = (hand.dbid_gt, hh['siteHandNo'])
+            if key in seen or self.isDuplicate(*key):
+                log.info("storeHands(): hid #: %s is a duplicate" % hh['siteHandNo'])
+                hand.is_duplicate = True
+                continue
+            seen.add(key)
+            hh['gameTypeId'] = hand.dbid_gt
+            hh['seats'] = len(hand.dbid_pids)
+            stored.append(hand)
+        if not stored:
+            return stored
+
+        c = self.get_cursor()
+        rows = [self.handsValues(hand.handsRow()) for hand in stored]
+        if self.bulkLoading:
+            if self.backend == self.PGSQL:
+                c.execute(self.sql.query['nextHandIds'], (len(rows),))
+                ids = [row[0] for row in c.fetchall()]
+            else:
+                ids = range(self.nextHandId, self.nextHandId + len(rows))
+                self.nextHandId += len(rows)
+            self.bulkLoad(self.sql.query['store_hand_with_id'],
+                          [(hid,) + row for (hid, row) in zip(ids, rows)])
+        elif self.backend == self.PGSQL:
+            c.execute(self.sql.query['nextHandIds'], (len(rows),))
+            ids = [row[0] for row in c.fetchall()]
+            rows = [(hid,) + row for (hid, row) in zip(ids, rows)]
+            kept = self.insertHands(self.sql.query['store_hand_with_id'], stored, rows)
+            (stored, ids) = ([stored[i] for i in kept], [ids[i] for i in kept])
+        else:
+            q = self.sql.query['store_hand'].replace('%s', self.sql.query['placeholder'])
+            kept = self.insertHands(q, stored, rows)
+            stored = [stored[i] for i in kept]
+            ids = self.storedHandIds(stored)
+
+        inserts = []
+        for (hand, hid) in zip(stored, ids):
+            hand.dbid_hands = hid
+            self.indexHand(hand.dbid_gt, hand.handsRow()['siteHandNo'])
+            inserts += hand.handsPlayersRows(self)
+        if self.bulkLoading:
+            self.bulkLoad(self.sql.query['store_hands_players'], inserts)
+            return stored
+        q = self.sql.query['store_hands_players'].replace('%s', self.sql.query['placeholder'])
+        for (q, values, n) in self.multiRowInserts(q, inserts):
+            c.execute(q, values)
+        return stored
+
+    def insertHands(self, q, hands, rows):
+        """\
+Insert the Hands rows of hands with q, in as few statements as multiRowInserts()
+allows, returning the indexes of the hands inserted. A hand another importer
+stored since the index of hands was loaded gets past isDuplicate(), but not the
+unique index on Hands: when an insert is turned away, its hands are looked up
+with isStoredHand(), and the insert done again without those stored already."""
+        c = self.get_cursor()
+        kept = []
+        start = 0
+        for (query, values, n) in self.multiRowInserts(q, rows):
+            chunk = range(start, start + n)
+            start += n
+            try:
+                self.executeOrRollBack(c, query, values)
+            except self.IntegrityError:
+                stored = [i for i in chunk if self.isStoredHand(hands[i].dbid_gt, hands[i].handsRow()['siteHandNo'])]
+                if not stored:
+                    raise
+                for i in stored:
+                    siteHandNo = hands[i].handsRow()['siteHandNo']
+                    log.info("storeHands(): hid #: %s is a duplicate, stored since the index of hands was loaded" % siteHandNo)
+                    hands[i].is_duplicate = True
+                    self.indexHand(hands[i].dbid_gt, siteHandNo, committed=True)
+                chunk = [i for i in chunk if i not in stored]
+                kept += [chunk[j] for j in self.insertHands(q, [hands[i] for i in chunk], [rows[i] for i in chunk])]
+            else:
+                kept += chunk
+        return kept
+
+    def executeOrRollBack(self, c, q, values):
+        """\
+Execute q, and if it fails leave the transaction as it was before it. One
+statement failing doesn't undo the rest of the transaction on mysql and sqlite,
+but on postgres it does unless there's a savepoint to roll back to."""
+        if self.backend != self.PGSQL:
+            c.execute(q, values)
+            return
+        c.execute("SAVEPOINT execute_or_roll_back")
+        try:
+            c.execute(q, values)
+        except:
+            c.execute("ROLLBACK TO SAVEPOINT execute_or_roll_back")
+            raise
+        c.execute("RELEASE SAVEPOINT execute_or_roll_back")
+
+    def storedHandIds(self, hands):
+        """\
+The Hands ids of hands just inserted, read back by their gametypeId and
+siteHandNo: the rows of a multi-row insert needn't get consecutive ids, as
+another connection can be storing hands at the same time (and mysql's
+innodb_autoinc_lock_mode = 2 interleaves them)."""
+        c = self.get_cursor()
+        keys = [(hand.dbid_gt, handNumber(hand.handsRow()['siteHandNo'])) for hand in hands]
+        found = {}
+        for start in xrange(0, len(keys), self.SQLITE_MAX_VARIABLES):
+            siteHandNos = list(set([siteHandNo for (gtid, siteHandNo) in keys[start:start + self.SQLITE_MAX_VARIABLES]]))
+            q = self.sql.query['getHandIds'].replace('<siteHandNos>', ','.join([self.sql.query['placeholder']] * len(siteHandNos)))
+            c.execute(q, siteHandNos)
+            for (hid, gtid, siteHandNo) in c.fetchall():
+                found[(gtid, handNumber(siteHandNo))] = hid
+        return [found[key] for key in keys]
 
     def storeHandsPlayers(self, hid, pids, pdata):
+        self.storeHandsPlayersRows(self.handsPlayersValues(hid, pids, pdata))
+
+    def handsPlayersValues(self, hid, pids, pdata):
+        """The values of the store_hands_players query for each player in pdata"""
         #print "DEBUG: %s %s %s" %(hid, pids, pdata)
         inserts = []
         for p in pdata:
@@ -1630,7 +1953,10 @@ class Database:
                              pdata[p]['street4CheckCallRaiseChance'],
                              pdata[p]['street4CheckCallRaiseDone']
                             ) )
+        return inserts
 
+    def storeHandsPlayersRows(self, inserts):
+        """Stores HandsPlayers rows already in the order of the store_hands_players query"""
         q = self.sql.query['store_hands_players']
         q = q.replace('%s', self.sql.query['placeholder'])
 
@@ -1639,21 +1965,22 @@ class Database:
         c = self.get_cursor()
         c.executemany(q, inserts)
 
-    def storeHudCache(self, gid, pids, starttime, pdata):
-        """Update cached statistics. If update fails because no record exists, do an insert."""
+    # HudCache position of each HandsPlayers position
+    hudCachePositions = {'B':'B', 'S':'S', 0:'D', 1:'C', 2:'M', 3:'M', 4:'M', 5:'E', 6:'E', 7:'E', 8:'E', 9:'E' }
 
+    def hudCacheStyleKey(self, starttime):
         if self.use_date_in_hudcache:
-            styleKey = datetime.strftime(starttime, 'd%y%m%d')
+            return datetime.strftime(starttime, 'd%y%m%d')
             #styleKey = "d%02d%02d%02d" % (hand_start_time.year-2000, hand_start_time.month, hand_start_time.day)
         else:
             # hard-code styleKey as 'A000000' (all-time cache, no key) for now
-            styleKey = 'A000000'
+            return 'A000000'
+
+    def storeHudCache(self, gid, pids, starttime, pdata):
+        """Update cached statistics. If update fails because no record exists, do an insert."""
+
+        styleKey = self.hudCacheStyleKey(starttime)
 
-        update_hudcache = self.sql.query['update_hudcache']
-        update_hudcache = update_hudcache.replace('%s', self.sql.query['placeholder'])
-        insert_hudcache = self.sql.query['insert_hudcache']
-        insert_hudcache = insert_hudcache.replace('%s', self.sql.query['placeholder'])
-            
         #print "DEBUG: %s %s %s" %(hid, pids, pdata)
         inserts = []
         for p in pdata:
@@ -1717,35 +2044,156 @@ class Database:
             line[55] = gid    # gametypeId
             line[56] = pids[p]    # playerId
             line[57] = len(pids)    # activeSeats
-            pos = {'B':'B', 'S':'S', 0:'D', 1:'C', 2:'M', 3:'M', 4:'M', 5:'E', 6:'E', 7:'E', 8:'E', 9:'E' }
-            line[58] = pos[pdata[p]['position']]
+            line[58] = self.hudCachePositions[pdata[p]['position']]
             line[59] = pdata[p]['tourneyTypeId']
             line[60] = styleKey    # styleKey
             inserts.append(line)
+        self.storeHudCacheLines(inserts)
+
+    def gatherHudCache(self):
+        """\
+Have storeHudCacheLines() keep adding up the lines for each HudCache row,
+until flushHudCache() writes each row once."""
+        if self.hudCacheDeltas is None:
+            self.hudCacheDeltas = {}
+
+    def flushHudCache(self):
+        """Write the HudCache lines gathered since gatherHudCache(), and stop gathering"""
+        deltas = self.hudCacheDeltas
+        self.hudCacheDeltas = None
+        if deltas:
+            self.writeHudCache(deltas)
+
+    def storeHudCacheLines(self, inserts):
+        """\
+Adds lines in the order of the update_hudcache query to HudCache. The lines
+are added up for each row (the last 6 values are its key) first, and while
+gathering (see gatherHudCache()) with the lines of earlier calls."""
+        deltas = self.hudCacheDeltas
+        if deltas is None:
+            deltas = {}
+        for line in inserts:
+            key = tuple(line[-6:])
+            if key in deltas:
+                deltas[key] = [total + value for (total, value) in zip(deltas[key], line)]
+            else:
+                deltas[key] = list(line[:-6])
+        if self.hudCacheDeltas is None:
+            self.writeHudCache(deltas)
 
-
+    def canUpsertHudCache(self):
+        """True if HudCache has the unique key upsert_hudcache needs, and the database can do it"""
+        if self.backend == self.SQLITE:
+            import sqlite3
+            if sqlite3.sqlite_version_info < (3, 24, 0):
+                return False
+        elif self.backend == self.PGSQL:
+            if self.connection.server_version < 90500:
+                return False
+        c = self.get_cursor()
+        c.execute(self.sql.query['hudCacheIndexExists'])
+        if not c.fetchall():
+            log.info("HudCache has no hudCacheKey index, recreate the tables to have its rows upserted")
+            return False
+        return True
+
+    def writeHudCache(self, deltas):
+        """\
+Add {key: sums} to HudCache, with one upsert a row, or where that can't be done
+an update and, for rows not there yet, an insert.
+The rows are done in order, so importers running at once lock them in the same order."""
+        if self.hudCacheUpsert is None:
+            self.hudCacheUpsert = self.canUpsertHudCache()
         cursor = self.get_cursor()
+        if self.hudCacheUpsert:
+            upsert_hudcache = self.sql.query['upsert_hudcache'].replace('%s', self.sql.query['placeholder'])
+            cursor.executemany(upsert_hudcache, [key + tuple(sums) for (key, sums) in sorted(deltas.iteritems())])
+            return
 
-        for row in inserts:
+        update_hudcache = self.sql.query['update_hudcache']
+        update_hudcache = update_hudcache.replace('%s', self.sql.query['placeholder'])
+        insert_hudcache = self.sql.query['insert_hudcache']
+        insert_hudcache = insert_hudcache.replace('%s', self.sql.query['placeholder'])
+
+        for (key, sums) in sorted(deltas.iteritems()):
+            row = sums + list(key)
             # Try to do the update first:
             num = cursor.execute(update_hudcache, row)
-            #print "DEBUG: values: %s" % row[-6:]
             # Test statusmessage to see if update worked, do insert if not
             # num is a cursor in sqlite
             if ((self.backend == self.PGSQL and cursor.statusmessage != "UPDATE 1")
                     or (self.backend == self.MYSQL_INNODB and num == 0) 
                     or (self.backend == self.SQLITE and num.rowcount == 0)):
-                #move the last 6 items in WHERE clause of row from the end of the array
-                # to the beginning for the INSERT statement
-                #print "DEBUG: using INSERT: %s" % num
-                row = row[-6:] + row[:-6]
-                num = cursor.execute(insert_hudcache, row)
-                #print "DEBUG: Successfully(?: %s) updated HudCacho using INSERT" % num
+                num = cursor.execute(insert_hudcache, list(key) + sums)
+
+    def resetHandIndex(self):
+        self.handIndex = {}             # {gametypeId: HandNos} of the indexed sites
+        self.handIndexSites = {}        # {siteId: True if its hands are in handIndex, False if too many}
+        self.handIndexGametypes = {}    # {gametypeId: siteId}
+        self.handIndexPending = []      # (gametypeId, siteHandNo) indexed since the last commit
+
+    def knownHandNos(self, gametypeId):
+        """\
+The siteHandNos in Hands for gametypeId, from the index of hands, or None if
+its site has too many hands to be indexed. The first time a site's hands are
+asked for they're all loaded, with one query."""
+        if gametypeId not in self.handIndexGametypes:
+            c = self.get_cursor()
+            c.execute(self.sql.query['getGametypeSite'], (gametypeId,))
+            row = c.fetchone()
+            self.handIndexGametypes[gametypeId] = row[0] if row else None
+        return self.knownSiteHandNos(self.handIndexGametypes[gametypeId], gametypeId)
+
+    def knownSiteHandNos(self, siteId, gametypeId):
+        if siteId not in self.handIndexSites:
+            c = self.get_cursor()
+            c.execute(self.sql.query['countSiteHands'], (siteId,))
+            count = c.fetchone()[0]
+            # sites with more than handIndexMax hands (handIndexMax in HUD_config.xml) aren't
+            # indexed, to save memory; their hands are looked up in the database instead
+            if count > self.handIndexMax:
+                log.info("site %s has %d hands, too many to index: looking them up instead" % (siteId, count))
+                self.handIndexSites[siteId] = False
             else:
-                #print "DEBUG: Successfully updated HudCacho using UPDATE"
-                pass
+                c.execute(self.sql.query['getSiteHandNos'], (siteId,))
+                handNos = {}
+                for (gtid, siteHandNo) in c.fetchall():
+                    self.handIndexGametypes[gtid] = siteId
+                    siteHandNo = handNumber(siteHandNo)
+                    if siteHandNo is not None:      # others are looked up by isDuplicate()
+                        handNos.setdefault(gtid, []).append(siteHandNo)
+                for (gtid, nos) in handNos.iteritems():
+                    self.handIndex[gtid] = HandNos(nos)
+                self.handIndexSites[siteId] = True
+                log.info("indexed %d hands of site %s" % (count, siteId))
+        if not self.handIndexSites[siteId]:
+            return None
+        self.handIndexGametypes[gametypeId] = siteId
+        return self.handIndex.setdefault(gametypeId, HandNos())
+
+    def indexHand(self, gametypeId, siteHandNo, committed=False):
+        """Note a hand in Hands, if its site is indexed: one stored since the last commit, or a committed one"""
+        known = self.handIndex.get(gametypeId)
+        siteHandNo = handNumber(siteHandNo)
+        if known is not None and siteHandNo is not None:
+            known.add(siteHandNo)
+            if not committed:
+                self.handIndexPending.append((gametypeId, siteHandNo))
 
     def isDuplicate(self, gametypeID, siteHandNo):
+        """\
+True if the hand is already in Hands, going by the index of hands where its
+site is indexed. Hands stored by something else since the index was loaded
+still can't be stored twice, as Hands has a unique index on them: storeHand()
+and storeHands() look them up with isStoredHand() when it turns them away."""
+        if handNumber(siteHandNo) is not None:
+            known = self.knownHandNos(gametypeID)
+            if known is not None:
+                return handNumber(siteHandNo) in known
+        return self.isStoredHand(gametypeID, siteHandNo)
+
+    def isStoredHand(self, gametypeID, siteHandNo):
+        """True if the hand is in Hands, looking it up in the database"""
         dup = False
         c = self.get_cursor()
         c.execute(self.sql.query['isAlreadyInDB'], (gametypeID, siteHandNo))
@@ -1754,6 +2202,55 @@ class Database:
             dup = True
         return dup
 
+    def getKnownHands(self, siteid, game, siteHandNos):
+        """The members of siteHandNos (strings) already in Hands for this site and gametype.
+Unlike getGameTypeId() an unknown gametype isn't added, as none of its hands can be known.
+They're looked up in the index of hands, or if the site isn't indexed with one query."""
+        c = self.get_cursor()
+        c.execute(self.sql.query['getGametypeNL'], (siteid, game['type'], game['category'], game['limitType'],
+                        int(Decimal(game['sb'])*100), int(Decimal(game['bb'])*100)))
+        tmp = c.fetchone()
+        if tmp is None or not siteHandNos:
+            return set()
+        known = self.knownSiteHandNos(siteid, tmp[0])
+        if known is not None:
+            return set([hid for hid in siteHandNos if int(hid) in known])
+        q = self.sql.query['getKnownHands'].replace('<siteHandNos>', ','.join([self.sql.query['placeholder']] * len(siteHandNos)))
+        c.execute(q, [tmp[0]] + [int(hid) for hid in siteHandNos])
+        return set([str(row[0]) for row in c.fetchall()])
+
+    def getImportCheckpoint(self, path):
+        """Returns (inode, size, mtime, byteOffset) saved for path, or None"""
+        c = self.get_cursor()
+        c.execute(self.sql.query['getImportCheckpoint'], (path,))
+        return c.fetchone()
+
+    def storeImportCheckpoint(self, path, inode, size, mtime, byteOffset):
+        """Remember how far into path the import got. Caller commits."""
+        c = self.get_cursor()
+        c.execute(self.sql.query['updateImportCheckpoint'], (inode, size, mtime, byteOffset, path))
+        if c.rowcount == 0:
+            c.execute(self.sql.query['insertImportCheckpoint'], (inode, size, mtime, byteOffset, path))
+
+    def getQuarantinedHands(self):
+        """Returns [(path, byteOffset, filter, handText)] of the hands in the quarantine"""
+        c = self.get_cursor()
+        c.execute(self.sql.query['getQuarantinedHands'])
+        return c.fetchall()
+
+    def storeQuarantinedHand(self, path, byteOffset, filter, error, handText):
+        """Put a hand which failed to convert in the quarantine, replacing any
+hand already there from the same place in the same file. Caller commits."""
+        c = self.get_cursor()
+        c.execute(self.sql.query['updateQuarantinedHand'], (filter, error, handText, path, byteOffset))
+        if c.rowcount == 0:
+            c.execute(self.sql.query['insertQuarantinedHand'], (filter, error, handText, path, byteOffset))
+
+    def deleteQuarantinedHand(self, path, byteOffset):
+        """Take a hand out of the quarantine. Caller commits."""
+        c = self.get_cursor()
+        c.execute(self.sql.query['deleteQuarantinedHand'], (path, byteOffset))
+
     def getGameTypeId(self, siteid, game):
         c = self.get_cursor()
         #FIXME: Fixed for NL at the moment
@@ -1771,21 +2268,99 @@ class Database:
         return tmp[0]
 
     def getSqlPlayerIDs(self, pnames, siteid):
-        result = {}
-        if(self.pcache == None):
-            self.pcache = LambdaDict(lambda  key:self.insertPlayer(key[0], key[1]))
- 
-        for player in pnames:
-            result[player] = self.pcache[(player,siteid)]
-            # NOTE: Using the LambdaDict does the same thing as:
-            #if player in self.pcache:
-            #    #print "DEBUG: cachehit"
-            #    pass
-            #else:
-            #    self.pcache[player] = self.insertPlayer(player, siteid)
-            #result[player] = self.pcache[player]
-
-        return result
+        """{name: Players id} for pnames at site siteid, adding those not in Players yet"""
+        ids = self.playerIds(siteid)
+        if [name for name in pnames if name not in ids]:
+            self.cachePlayerIds(pnames, siteid)
+        return dict([(name, ids[name]) for name in pnames])
+
+    def playerIds(self, siteid):
+        """The cached {name: Players id} of site siteid"""
+        if self.pcache is None:
+            self.pcache = {}
+        if siteid not in self.pcache:
+            self.pcache[siteid] = {}
+        return self.pcache[siteid]
+
+    # names looked up with one query (sqlite limits the values of a statement)
+    PLAYER_LOOKUP_SIZE = 500
+
+    def cachePlayerIds(self, pnames, siteid):
+        """\
+Put the ids of pnames at site siteid in the player id cache: those not cached
+are looked up with one query per PLAYER_LOOKUP_SIZE names, and those not in
+Players are added with a multi-row insert and looked up again. A name the
+database takes to be another's (mysql compares names without case) is left
+to insertPlayer()."""
+        ids = self.playerIds(siteid)
+        wanted = {}     # database form of each name: name
+        dbnames = []    # in the order they came, so new players get ids in that order
+        for name in pnames:
+            if name not in ids:
+                dbname = Charset.to_db_utf8(name)
+                if dbname not in wanted:
+                    wanted[dbname] = name
+                    dbnames.append(dbname)
+        if not dbnames:
+            return
+        c = self.get_cursor()
+        placeholder = self.sql.query['placeholder']
+
+        def lookUp(dbnames):
+            for start in xrange(0, len(dbnames), self.PLAYER_LOOKUP_SIZE):
+                chunk = dbnames[start:start + self.PLAYER_LOOKUP_SIZE]
+                c.execute("SELECT name, id FROM Players WHERE siteId=%s AND name IN (%s)"
+                          % (placeholder, ",".join([placeholder] * len(chunk))), [siteid] + chunk)
+                for (dbname, pid) in c.fetchall():
+                    name = wanted.get(Charset.to_db_utf8(dbname))
+                    if name is not None:
+                        ids[name] = pid
+            return [n for n in dbnames if wanted[n] not in ids]
+
+        missing = lookUp(dbnames)
+        if missing:
+            q = "INSERT INTO Players (name, siteId) VALUES (%s, %s)"
+            if self.backend == self.MYSQL_INNODB:
+                q = q.replace("INSERT", "INSERT IGNORE")    # a name the same but for case is taken
+            q = q.replace('%s', placeholder)
+            for (q, values, n) in self.multiRowInserts(q, [(m, siteid) for m in missing]):
+                c.execute(q, values)
+            for dbname in lookUp(missing):
+                ids[wanted[dbname]] = self.insertPlayer(wanted[dbname], siteid)
+
+    def loadPlayerIds(self, siteids):
+        """\
+Fill the player id cache with every player of each site in siteids, so names
+seen before needn't be looked up as hands are imported. Sites already loaded
+are skipped. Returns about how many bytes the cache takes, or None if every
+site was loaded already."""
+        if self.pcacheLoaded is None:
+            self.pcacheLoaded = set()
+        siteids = [siteid for siteid in siteids if siteid not in self.pcacheLoaded]
+        if not siteids:
+            return None
+        c = self.get_cursor()
+        for siteid in siteids:
+            ids = self.playerIds(siteid)
+            c.execute("SELECT name, id FROM Players WHERE siteId=%s".replace('%s', self.sql.query['placeholder']), (siteid,))
+            for (name, pid) in c.fetchall():
+                ids.setdefault(name, pid)
+            self.pcacheLoaded.add(siteid)
+            log.info("loaded %d players of site %s" % (len(ids), siteid))
+        size = self.playerCacheSize()
+        log.info("player id cache: %d players, about %d kB" % (sum([len(siteIds) for siteIds in self.pcache.values()]), size // 1024))
+        return size
+
+    def playerCacheSize(self):
+        """About how many bytes the player id cache takes"""
+        if not self.pcache:
+            return 0
+        size = sys.getsizeof(self.pcache)
+        for ids in self.pcache.itervalues():
+            size += sys.getsizeof(ids)
+            for (name, pid) in ids.iteritems():
+                size += sys.getsizeof(name) + sys.getsizeof(pid)
+        return size
 
     def insertPlayer(self, name, site_id):
         result = None
@@ -1869,81 +2444,6 @@ class Database:
     #end def store_tourneys_players
 
 
-    # read HandToWrite objects from q and insert into database
-    def insert_queue_hands(self, q, maxwait=10, commitEachHand=True):
-        n,fails,maxTries,firstWait = 0,0,4,0.1
-        sendFinal = False
-        t0 = time()
-        while True:
-            try:
-                h = q.get(True)  # (True,maxWait) has probs if 1st part of import is all dups
-            except Queue.Empty:
-                # Queue.Empty exception thrown if q was empty for
-                # if q.empty() also possible - no point if testing for Queue.Empty exception
-                # maybe increment a counter and only break after a few times?
-                # could also test threading.active_count() or look through threading.enumerate()
-                # so break immediately if no threads, but count up to X exceptions if a writer
-                # thread is still alive???
-                print "queue empty too long - writer stopping ..."
-                break
-            except:
-                print "writer stopping, error reading queue: " + str(sys.exc_info())
-                break
-            #print "got hand", str(h.get_finished())
-
-            tries,wait,again = 0,firstWait,True
-            while again:
-                try:
-                    again = False # set this immediately to avoid infinite loops!
-                    if h.get_finished():
-                        # all items on queue processed
-                        sendFinal = True
-                    else:
-                        self.store_the_hand(h)
-                        # optional commit, could be every hand / every N hands / every time a 
-                        # commit message received?? mark flag to indicate if commits outstanding
-                        if commitEachHand:
-                            self.commit()
-                        n = n + 1
-                except:
-                    #print "iqh store error", sys.exc_value # debug
-                    self.rollback()
-                    if re.search('deadlock', str(sys.exc_info()[1]), re.I):
-                        # deadlocks only a problem if hudcache is being updated
-                        tries = tries + 1
-                        if tries < maxTries and wait < 5:    # wait < 5 just to make sure
-                            print "deadlock detected - trying again ..."
-                            sleep(wait)
-                            wait = wait + wait
-                            again = True
-                        else:
-                            print "too many deadlocks - failed to store hand " + h.get_siteHandNo()
-                    if not again:
-                        fails = fails + 1
-                        err = traceback.extract_tb(sys.exc_info()[2])[-1]
-                        print "***Error storing hand: "+err[2]+"("+str(err[1])+"): "+str(sys.exc_info()[1])
-            # finished trying to store hand
-
-            # always reduce q count, whether or not this hand was saved ok
-            q.task_done()
-        # while True loop
-
-        self.commit()
-        if sendFinal:
-            q.task_done()
-        print "db writer finished: stored %d hands (%d fails) in %.1f seconds" % (n, fails, time()-t0)
-    # end def insert_queue_hands():
-
-
-    def send_finish_msg(self, q):
-        try:
-            h = HandToWrite(True)
-            q.put(h)
-        except:
-            err = traceback.extract_tb(sys.exc_info()[2])[-1]
-            print "***Error sending finish: "+err[2]+"("+str(err[1])+"): "+str(sys.exc_info()[1])
-    # end def send_finish_msg():
-
     def tRecogniseTourneyType(self, tourney):
         log.debug("Database.tRecogniseTourneyType")
         typeId = 1
@@ -1998,116 +2498,6 @@ class Database:
 
         
 
-# Class used to hold all the data needed to write a hand to the db
-# mainParser() in fpdb_parse_logic.py creates one of these and then passes it to 
-# self.insert_queue_hands()
-
-class HandToWrite:
-
-    def __init__(self, finished = False): # db_name and game not used any more
-        try:
-            self.finished = finished
-            self.config = None
-            self.settings = None
-            self.base = None
-            self.category = None
-            self.siteTourneyNo = None
-            self.buyin = None
-            self.fee = None
-            self.knockout = None
-            self.entries = None
-            self.prizepool = None
-            self.tourneyStartTime = None
-            self.isTourney = None
-            self.tourneyTypeId = None
-            self.siteID = None
-            self.siteHandNo = None
-            self.gametypeID = None
-            self.handStartTime = None
-            self.names = None
-            self.playerIDs = None
-            self.startCashes = None
-            self.positions = None
-            self.antes = None
-            self.cardValues = None
-            self.cardSuits = None
-            self.boardValues = None
-            self.boardSuits = None
-            self.winnings = None
-            self.rakes = None
-            self.actionTypes = None
-            self.allIns = None
-            self.actionAmounts = None
-            self.actionNos = None
-            self.hudImportData = None
-            self.maxSeats = None
-            self.tableName = None
-            self.seatNos = None
-            self.payin_amounts = None # tourney import was complaining mightily about this missing
-        except:
-            print "htw.init error: " + str(sys.exc_info())
-            raise
-    # end def __init__
-
-    def set_all( self, config, settings, base, category, siteTourneyNo, buyin
-               , fee, knockout, entries, prizepool, tourneyStartTime
-               , isTourney, tourneyTypeId, siteID, siteHandNo
-               , gametypeID, handStartTime, names, playerIDs, startCashes
-               , positions, antes, cardValues, cardSuits, boardValues, boardSuits
-               , winnings, rakes, actionTypes, allIns, actionAmounts
-               , actionNos, hudImportData, maxSeats, tableName, seatNos):
-        
-        try:
-            self.config = config
-            self.settings = settings
-            self.base = base
-            self.category = category
-            self.siteTourneyNo = siteTourneyNo
-            self.buyin = buyin
-            self.fee = fee
-            self.knockout = knockout
-            self.entries = entries
-            self.prizepool = prizepool
-            self.tourneyStartTime = tourneyStartTime
-            self.isTourney = isTourney
-            self.tourneyTypeId = tourneyTypeId
-            self.siteID = siteID
-            self.siteHandNo = siteHandNo
-            self.gametypeID = gametypeID
-            self.handStartTime = handStartTime
-            self.names = names
-            self.playerIDs = playerIDs
-            self.startCashes = startCashes
-            self.positions = positions
-            self.antes = antes
-            self.cardValues = cardValues
-            self.cardSuits = cardSuits
-            self.boardValues = boardValues
-            self.boardSuits = boardSuits
-            self.winnings = winnings
-            self.rakes = rakes
-            self.actionTypes = actionTypes
-            self.allIns = allIns
-            self.actionAmounts = actionAmounts
-            self.actionNos = actionNos
-            self.hudImportData = hudImportData
-            self.maxSeats = maxSeats
-            self.tableName = tableName
-            self.seatNos = seatNos
-        except:
-            print "htw.set_all error: " + str(sys.exc_info())
-            raise
-    # end def set_hand
-
-    def get_finished(self):
-        return( self.finished )
-    # end def get_finished
-    
-    def get_siteHandNo(self):
-        return( self.siteHandNo )
-    # end def get_siteHandNo
-
-
 if __name__=="__main__":
     c = Configuration.Config()
     sql = SQL.Sql(db_server = 'sqlite')
@@ -15,9 +15,14 @@
 #In the "official" distribution you can find the license in
 #agpl-3.0.txt in the docs folder of the package.
 
+#    Standard Library modules
+import array
+import operator
+from itertools import izip, imap
+
 #fpdb modules
 import Card
-from decimal import Decimal
+import Hand
 
 DEBUG = False
 
@@ -117,7 +122,6 @@ class DerivedStats():
 
         #print "DEBUG: self.getStreetTotals = (%s, %s, %s, %s, %s)" %  hand.getStreetTotals()
         totals = hand.getStreetTotals()
-        totals = [int(100*i) for i in totals]
         self.hands['street1Pot']  = totals[0]
         self.hands['street2Pot']  = totals[1]
         self.hands['street3Pot']  = totals[2]
@@ -137,7 +141,7 @@ class DerivedStats():
         #hand.players = [[seat, name, chips],[seat, name, chips]]
         for player in hand.players:
             self.handsplayers[player[1]]['seatNo'] = player[0]
-            self.handsplayers[player[1]]['startCash'] = int(100 * Decimal(player[2]))
+            self.handsplayers[player[1]]['startCash'] = Hand.toCents(player[2])
 
         for i, street in enumerate(hand.actionStreets[2:]):
             self.seen(self.hand, i+1)
@@ -148,21 +152,21 @@ class DerivedStats():
             self.bets(self.hand, i)
 
         # Winnings is a non-negative value of money collected from the pot, which already includes the
-        # rake taken out. hand.collectees is Decimal, database requires cents
+        # rake taken out. hand.collectees is in cents, as the database has it
         for player in hand.collectees:
-            self.handsplayers[player]['winnings'] = int(100 * hand.collectees[player])
+            self.handsplayers[player]['winnings'] = hand.collectees[player]
             #FIXME: This is pretty dodgy, rake = hand.rake/#collectees
             # You can really only pay rake when you collect money, but
             # different sites calculate rake differently.
             # Should be fine for split-pots, but won't be accurate for multi-way pots
-            self.handsplayers[player]['rake'] = int(100* hand.rake)/len(hand.collectees)
+            self.handsplayers[player]['rake'] = hand.rake/len(hand.collectees)
             if self.handsplayers[player]['street1Seen'] == True:
                 self.handsplayers[player]['wonWhenSeenStreet1'] = 1.0
             if self.handsplayers[player]['sawShowdown'] == True:
                 self.handsplayers[player]['wonAtSD'] = 1.0
 
         for player in hand.pot.committed:
-            self.handsplayers[player]['totalProfit'] = int(self.handsplayers[player]['winnings'] - (100*hand.pot.committed[player])- (100*hand.pot.common[player]))
+            self.handsplayers[player]['totalProfit'] = self.handsplayers[player]['winnings'] - hand.pot.committed[player] - hand.pot.common[player]
 
         self.calcCBets(hand)
 
@@ -511,3 +515,262 @@ class DerivedStats():
                 break
         return betOrRaise
 
+
+
+# The kinds of HandsPlayers column a DerivedStatsBatch keeps, with the array typecode
+# each is kept in. CENTS and OTHER columns are lists: cents can outgrow a C long
+# (32 bits on Windows), and not all OTHER values are numbers.
+FLAG, COUNT, FLOAT = 'B', 'h', 'd'
+CENTS = OTHER = None
+
+def _streets(kind, *formats):
+    return [(f % i, kind) for i in range(1, 5) for f in formats]
+
+# The HandsPlayers columns in the order Database.storeHandsPlayers() stores them
+HANDSPLAYERS_COLUMNS = ([('startCash', CENTS), ('seatNo', OTHER)]
+                        + [('card%d' % i, COUNT) for i in range(1, 8)]
+                        + [('winnings', CENTS), ('rake', CENTS), ('totalProfit', CENTS), ('street0VPI', FLAG)]
+                        + _streets(FLAG, 'street%dSeen')
+                        + [('sawShowdown', FLAG), ('wonAtSD', FLOAT)]
+                        + [('street%dAggr' % i, FLAG) for i in range(5)]
+                        + _streets(FLAG, 'street%dCBChance') + _streets(FLAG, 'street%dCBDone')
+                        + [('wonWhenSeenStreet1', FLOAT)]
+                        + [('street%dCalls' % i, COUNT) for i in range(5)]
+                        + [('street%dBets' % i, COUNT) for i in range(5)]
+                        + [('position', OTHER), ('tourneyTypeId', OTHER), ('startCards', COUNT),
+                           ('street0_3BChance', FLAG), ('street0_3BDone', FLAG)]
+                        + _streets(FLAG, 'otherRaisedStreet%d') + _streets(FLAG, 'foldToOtherRaisedStreet%d')
+                        + [(name, FLAG) for name in ('stealAttemptChance', 'stealAttempted', 'foldBbToStealChance',
+                                                     'foldedBbToSteal', 'foldSbToStealChance', 'foldedSbToSteal')]
+                        + _streets(FLAG, 'foldToStreet%dCBChance', 'foldToStreet%dCBDone')
+                        + _streets(FLAG, 'street%dCheckCallRaiseChance', 'street%dCheckCallRaiseDone'))
+
+# Columns DerivedStats works out but which aren't stored
+SCRATCH_COLUMNS = [('street0_4BChance', FLAG), ('street0_4BDone', FLAG), ('collected', FLAG)]
+
+# The HandsPlayers columns that go in HudCache lines, in the order of the
+# update_hudcache query (after its count of hands)
+HUDCACHE_COLUMNS = (['street0VPI', 'street0Aggr', 'street0_3BChance', 'street0_3BDone']
+                    + ['street%dSeen' % i for i in range(1, 5)] + ['sawShowdown']
+                    + ['street%dAggr' % i for i in range(1, 5)]
+                    + ['otherRaisedStreet%d' % i for i in range(1, 5)]
+                    + ['foldToOtherRaisedStreet%d' % i for i in range(1, 5)]
+                    + ['wonWhenSeenStreet1', 'wonAtSD', 'stealAttemptChance', 'stealAttempted',
+                       'foldBbToStealChance', 'foldedBbToSteal', 'foldSbToStealChance', 'foldedSbToSteal']
+                    + [f % i for i in range(1, 5) for f in ('street%dCBChance', 'street%dCBDone')]
+                    + [f % i for i in range(1, 5) for f in ('foldToStreet%dCBChance', 'foldToStreet%dCBDone')]
+                    + ['totalProfit']
+                    + [f % i for i in range(1, 5) for f in ('street%dCheckCallRaiseChance', 'street%dCheckCallRaiseDone')])
+
+COLUMN_KINDS = dict(HANDSPLAYERS_COLUMNS + SCRATCH_COLUMNS)
+COLUMN_DEFAULTS = {'position': 2, 'tourneyTypeId': 1}
+
+
+# Actions are kept in DerivedStatsBatch.actCode as these numbers (0 for the rest)
+FOLDS, CHECKS, CALLS, BETS, RAISES, COMPLETES = range(1, 7)
+ACTION_CODES = {'folds': FOLDS, 'checks': CHECKS, 'calls': CALLS, 'bets': BETS, 'raises': RAISES, 'completes': COMPLETES}
+
+
+class DerivedStatsBatch(object):
+    """\
+The HandsPlayers rows of a batch of hands, kept a column at a time in arrays
+allocated once for the whole batch rather than in a dict of stats per player.
+Each hand is added with addHand(), which works out the stats that depend on the
+order of its actions with the DerivedStats methods, and puts its actions in the
+action columns (actRow, actStreet, actCode). finish() then works out the stats
+that only count actions (street0VPI, streetN Seen, Aggr, Calls and Bets,
+wonWhenSeenStreet1 and playersVpi) a column at a time over every hand in the
+batch. Picklable, so parse worker processes can hand back a whole batch at once."""
+
+    MAX_SEATS = 10      # rows allocated per hand
+
+    def __init__(self, size):
+        self.size = size
+        self.capacity = 0
+        self.columns = {}
+        for name in COLUMN_KINDS:
+            self.columns[name] = self.newColumn(name, 0)
+        self.grow(size * self.MAX_SEATS)
+        self.numRows = 0
+        self.hands = []         # the Hands row (a dict) of each hand
+        self.players = []       # {player name: row} of each hand
+        self.firstRows = array.array('l')   # each hand's rows are firstRow onwards, one per player
+        self.actRow = array.array('l')
+        self.actStreet = array.array('b')   # actionStreets[1:] index
+        self.actCode = array.array('b')
+        self.rows = None
+
+    def newColumn(self, name, length):
+        kind = COLUMN_KINDS[name]
+        default = COLUMN_DEFAULTS.get(name, 0)
+        if kind is OTHER:
+            return [default] * length
+        return array.array(kind, [default]) * length
+
+    def grow(self, rows):
+        for name in self.columns:
+            self.columns[name].extend(self.newColumn(name, rows))
+        self.capacity += rows
+
+    def full(self):
+        return len(self.hands) >= self.size
+
+    def addHand(self, hand):
+        """Adds the rows of hand, returning its index in the batch"""
+        self.firstRows.append(self.numRows)
+        rows = {}
+        for player in hand.players:
+            rows[player[1]] = self.numRows
+            self.numRows += 1
+        if self.numRows > self.capacity:
+            self.grow(max(self.numRows - self.capacity, self.size * self.MAX_SEATS))
+        stats = BatchedStats(hand, self, rows)
+        stats.getStats(hand)
+        self.hands.append(stats.hands)
+        self.players.append(rows)
+        return len(self.hands) - 1
+
+    def addActions(self, hand, rows):
+        for (street, name) in enumerate(hand.actionStreets[1:]):
+            for act in hand.actions[name]:
+                row = rows.get(act[0])
+                if row is not None:
+                    self.actRow.append(row)
+                    self.actStreet.append(street)
+                    self.actCode.append(ACTION_CODES.get(act[1], 0))
+
+    def actedRows(self):
+        """{(street, action code): rows of the players making that action on that street}"""
+        acted = {}
+        for (row, street, code) in izip(self.actRow, self.actStreet, self.actCode):
+            rows = acted.get((street, code))
+            if rows is None:
+                rows = acted[street, code] = []
+            rows.append(row)
+        return acted
+
+    def finish(self):
+        """Works out the stats which count actions, a column at a time over the whole batch"""
+        columns = self.columns
+        acted = self.actedRows()
+        for street in range(5):
+            def rowsOf(*codes):
+                return [row for code in codes for row in acted.get((street, code), ())]
+            if street > 0:
+                self.setFlags('street%dSeen' % street, rowsOf(0, *ACTION_CODES.values()))
+            self.setFlags('street%dAggr' % street, rowsOf(COMPLETES, BETS, RAISES))
+            self.addCounts('street%dCalls' % street, rowsOf(CALLS))
+            self.addCounts('street%dBets' % street, rowsOf(BETS))
+            if street == 0:
+                self.setFlags('street0VPI', rowsOf(CALLS, BETS, RAISES))
+
+        columns['wonWhenSeenStreet1'] = array.array('d', imap(operator.mul, columns['collected'], columns['street1Seen']))
+        vpi = columns['street0VPI']
+        ends = self.firstRows[1:] + array.array('l', [self.numRows])
+        for (hand, first, end) in izip(self.hands, self.firstRows, ends):
+            hand['playersVpi'] = sum(vpi[first:end])
+
+        rows = []
+        for (name, kind) in HANDSPLAYERS_COLUMNS:
+            column = columns[name][:self.numRows]
+            if kind is FLAG:
+                column = map(bool, column)
+            rows.append(column)
+        self.rows = zip(*rows)
+
+    def setFlags(self, name, rows):
+        column = self.columns[name]
+        for row in rows:
+            column[row] = 1
+
+    def addCounts(self, name, rows):
+        column = self.columns[name]
+        for row in rows:
+            column[row] += 1
+
+    def handsPlayersRows(self, players, hid, pids):
+        """The HandsPlayers rows storeHandsPlayers() would store for the hand with these players"""
+        return [(hid, pids[name]) + self.rows[row] for (name, row) in players.iteritems()]
+
+    def hudCacheLines(self, players, gid, pids, styleKey, positions):
+        """The lines storeHudCache() would update HudCache with for the hand with these players"""
+        columns = [self.columns[name] for name in HUDCACHE_COLUMNS]
+        (position, tourneyTypeId) = (self.columns['position'], self.columns['tourneyTypeId'])
+        lines = []
+        for (name, row) in players.iteritems():
+            lines.append([1] + [column[row] for column in columns]
+                         + [gid, pids[name], len(pids), positions[position[row]], tourneyTypeId[row], styleKey])
+        return lines
+
+
+class BatchRow(object):
+    """One player's row of a DerivedStatsBatch, read and set like DerivedStats' dict of their stats"""
+    __slots__ = ('columns', 'row')
+
+    def __init__(self, columns, row):
+        self.columns = columns
+        self.row = row
+
+    def __getitem__(self, name):
+        return self.columns[name][self.row]
+
+    def __setitem__(self, name, value):
+        self.columns[name][self.row] = value
+
+
+class BatchedStats(DerivedStats):
+    """\
+DerivedStats of one hand of a DerivedStatsBatch, kept in the batch's columns.
+Only works out the stats that depend on the order of the hand's actions; the
+ones that count actions are left to DerivedStatsBatch.finish()."""
+
+    def __init__(self, hand, batch, rows):
+        DerivedStats.__init__(self, hand)
+        self.batch = batch
+        self.rows = rows
+        for (name, row) in rows.iteritems():
+            self.handsplayers[name] = BatchRow(batch.columns, row)
+
+    def getStats(self, hand):
+        # the columns start out with the defaults DerivedStats.getStats() sets
+        self.assembleHands(hand)
+        self.assembleHandsPlayers(hand)
+
+    def vpip(self, hand):
+        pass    # counted by DerivedStatsBatch.finish()
+
+    def assembleHandsPlayers(self, hand):
+        columns = self.batch.columns
+        for player in hand.players:
+            row = self.rows[player[1]]
+            columns['seatNo'][row] = player[0]
+            columns['startCash'][row] = Hand.toCents(player[2])
+
+        # seen(), aggr(), calls() and bets() are counted by DerivedStatsBatch.finish()
+        self.batch.addActions(hand, self.rows)
+
+        for player in hand.collectees:
+            self.handsplayers[player]['winnings'] = hand.collectees[player]
+            self.handsplayers[player]['rake'] = hand.rake/len(hand.collectees)
+            self.handsplayers[player]['collected'] = True
+            if self.handsplayers[player]['sawShowdown'] == True:
+                self.handsplayers[player]['wonAtSD'] = 1.0
+
+        for player in hand.pot.committed:
+            self.handsplayers[player]['totalProfit'] = self.handsplayers[player]['winnings'] - hand.pot.committed[player] - hand.pot.common[player]
+
+        self.calcCBets(hand)
+
+        cards = [columns['card%d' % (i+1)] for i in range(7)]
+        for player in hand.players:
+            row = self.rows[player[1]]
+            hcs = hand.join_holecards(player[1], asList=True)
+            hcs = hcs + [u'0x', u'0x', u'0x', u'0x', u'0x']
+            for (column, card) in izip(cards, hcs):
+                column[row] = Card.encodeCard(card)
+            columns['startCards'][row] = Card.calcStartCards(hand, player[1])
+
+        self.setPositions(hand)
+        self.calcCheckCallRaise(hand)
+        self.calc34BetStreet0(hand)
+        self.calcSteals(hand)
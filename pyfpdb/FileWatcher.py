@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU Affero General Public License as published by
+#the Free Software Foundation, version 3 of the License.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU Affero General Public License
+#along with this program. If not, see <http://www.gnu.org/licenses/>.
+#In the "official" distribution you can find the license in
+#agpl-3.0.txt in the docs folder of the package.
+
+"""Watching hand history directories for changed files, for auto-import.
+
+On Linux the kernel's inotify tells us which files have been written to, so
+auto-import doesn't have to list the directories and stat every file in them
+to find out. Elsewhere getWatcher() returns None, and the Importer goes on
+polling the directories as it always has."""
+
+#    Standard Library modules
+import os
+import sys
+import errno
+import struct
+import ctypes
+import ctypes.util
+
+import logging
+log = logging.getLogger("importer")
+
+
+# from <sys/inotify.h>
+IN_MODIFY      = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ISDIR       = 0x40000000
+IN_NONBLOCK    = os.O_NONBLOCK
+IN_CLOEXEC     = 0o2000000
+
+
+class InotifyWatcher(object):
+    """\
+Watches directories with inotify. changedFiles() returns the files (and new
+subdirectories) in them which have been written to, created or moved in
+since it was last called. fileno() is readable whenever there are some, so a
+gtk main loop can wake up for them with gobject.io_add_watch()."""
+
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    EVENT = struct.Struct('iIII')   # wd, mask, cookie, len; followed by len bytes of name
+    READ_SIZE = 65536
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self.raiseErrno()
+        self.dirs = {}      # watch descriptor -> (directory, tag)
+
+    def raiseErrno(self, path = None):
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e), path)
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+            self.dirs = {}
+
+    def watchDirectory(self, path, tag = None):
+        """Watch the files in directory path. tag is returned with each of them by changedFiles()"""
+        name = path
+        if isinstance(name, unicode):
+            name = name.encode(sys.getfilesystemencoding())
+        wd = self.libc.inotify_add_watch(self.fd, name, self.MASK)
+        if wd < 0:
+            self.raiseErrno(path)
+        self.dirs[wd] = (path, tag)
+
+    def changedFiles(self):
+        """\
+Returns {path: tag of its directory} of the files changed since the last call,
+without waiting for any, or None if the kernel's queue overflowed and some
+changes were lost, in which case the caller has to look at every file."""
+        changed = {}
+        overflowed = False
+        while True:
+            try:
+                data = os.read(self.fd, self.READ_SIZE)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not data:
+                break
+            pos = 0
+            while pos < len(data):
+                (wd, mask, cookie, size) = self.EVENT.unpack_from(data, pos)
+                pos += self.EVENT.size
+                name = data[pos:pos + size].rstrip('\0')
+                pos += size
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                elif mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)     # the directory has gone
+                elif wd in self.dirs and name:
+                    (dir, tag) = self.dirs[wd]
+                    if isinstance(dir, unicode):
+                        name = name.decode(sys.getfilesystemencoding())
+                    changed[os.path.join(dir, name)] = tag
+        if overflowed:
+            log.warning("Too many changes at once, looking at all the files being watched")
+            return None
+        return changed
+
+
+def getWatcher():
+    """An InotifyWatcher, or None if inotify isn't there and directories have to be polled"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError), e:    # AttributeError: a libc without inotify_init1
+        log.info("Unable to use inotify, polling for changed files instead: %s" % e)
+        return None
@@ -42,6 +42,8 @@ class Fulltilt(HandHistoryConverter):
                                     (?P<LIMIT>(No\sLimit|Pot\sLimit|Limit))?\s
                                     (?P<GAME>(Hold\'em|Omaha\sHi|Omaha\sH/L|7\sCard\sStud|Stud\sH/L|Razz|Stud\sHi))
                                  ''', re.VERBOSE)
+    re_HandNo       = re.compile(r".*\#(?P<HID>[0-9]+):\s")
+    re_GameTypeKey  = re.compile(r"[^\n]*?\#[0-9]+:\s(?P<KEY>[^\n]*?)\s-\s\d+:\d+:\d+")
     re_SplitHands   = re.compile(r"\n\n+")
     re_TailSplitHands   = re.compile(r"(\n\n+)")
     re_HandInfo     = re.compile(r'''.*\#(?P<HID>[0-9]+):\s
@@ -192,6 +194,11 @@ class Fulltilt(HandHistoryConverter):
         # NB: SB, BB must be interpreted as blinds or bets depending on limit type.
         return info
 
+    def readHandNo(self, handText):
+        m = self.re_HandNo.search(handText)
+        if m:
+            return m.group('HID')
+
     def readHandInfo(self, hand):
         m =  self.re_HandInfo.search(hand.handText)
         if m is None:
@@ -355,8 +362,7 @@ class Fulltilt(HandHistoryConverter):
 
                 if street == 'THIRD' and len(oldcards) == 2: # hero in stud game
                     hand.hero = player
-                    hand.dealt.add(player) # need this for stud??
-                    hand.addHoleCards(street, player, closed=oldcards, open=newcards, shown=False, mucked=False, dealt=False)
+                    hand.addHoleCards(street, player, closed=oldcards, open=newcards, shown=False, mucked=False, dealt=True)
                 else:
                     hand.addHoleCards(street, player, open=newcards, closed=oldcards, shown=False, mucked=False, dealt=False)
 
@@ -34,6 +34,7 @@ import string
 class GuiAutoImport (threading.Thread):
     def __init__(self, settings, config, sql):
         self.importtimer = 0
+        self.watchsource = 0    # wakes do_import() up when the importer's watcher sees a change
         self.settings = settings
         self.config = config
         self.sql = sql
@@ -224,11 +225,21 @@ class GuiAutoImport (threading.Thread):
                     if self.importtimer != 0:
                         gobject.source_remove(self.importtimer)
                     self.importtimer = gobject.timeout_add(interval * 1000, self.do_import)
+                    # where files can be watched, import as soon as they change rather than on the next tick
+                    if self.watchsource != 0:
+                        gobject.source_remove(self.watchsource)
+                        self.watchsource = 0
+                    if self.importer.watcher is not None:
+                        self.watchsource = gobject.io_add_watch(self.importer.watcher.fileno(), gobject.IO_IN,
+                                                                lambda fd, condition: self.do_import())
 
             else:
                 self.addText("\nauto-import aborted - global lock not available")
         else: # toggled off
             gobject.source_remove(self.importtimer)
+            if self.watchsource != 0:
+                gobject.source_remove(self.watchsource)
+                self.watchsource = 0
             self.settings['global_lock'].release()
             self.doAutoImportBool = False # do_import will return this and stop the gobject callback timer
             self.addText("\nStopping autoimport - global lock released.")
@@ -343,8 +343,16 @@ def main(argv=None):
                     help="How often to print a one-line status report (0 (default) means never)")
     parser.add_option("-u", "--usage", action="store_true", dest="usage", default=False,
                     help="Print some useful one liners")
+    parser.add_option("-t", "--threads", dest="threads", default=-1, type="int",
+                    help="Number of processes to parse hands with (default: parse in this one)")
     parser.add_option("-s", "--starsarchive", action="store_true", dest="starsArchive", default=False,
                     help="Do the required conversion for Stars Archive format (ie. as provided by support")
+    parser.add_option("-r", "--retryQuarantine", action="store_true", dest="retryQuarantine", default=False,
+                    help="Convert the hands that failed to import again, and insert those that now convert")
+    parser.add_option("-b", "--batchStats", action="store_true", dest="columnarStats", default=False,
+                    help="Work out the players' stats for a batch of hands at a time, in columns")
+    parser.add_option("-B", "--insertBatch", dest="insertBatchSize", default=None, type="int",
+                    help="Number of hands to store with each insert (default: insertBatchSize in HUD_config.xml, or 100)")
     (options, argv) = parser.parse_args(args = argv)
 
     if options.usage == True:
@@ -355,6 +363,7 @@ def main(argv=None):
         print "Everleaf   converter: ./GuiBulkImport -c Everleaf -f filename"
         print "Absolute   converter: ./GuiBulkImport -c Absolute -f filename"
         print "PartyPoker converter: ./GuiBulkImport -c PartyPoker -f filename"
+        print "Retry hands that failed: ./GuiBulkImport -r"
         sys.exit(0)
 
     config = Configuration.Config()
@@ -372,7 +381,13 @@ def main(argv=None):
     if not options.gui:
         print '-q is deprecated. Just use "-f filename" instead'
         # This is because -q on its own causes an error, so -f is necessary and sufficient for cmd line use
-    if not options.filename:
+    if options.retryQuarantine:
+        importer = fpdb_import.Importer(False,settings, config)
+        importer.setCallHud(False)
+        (stored, dups, partial, errs, ttime) = importer.retryQuarantine()
+        print 'GuiBulkImport retried quarantined hands: Stored: %d \tDuplicates: %d \tErrors (still failing): %d in %s seconds'\
+                     % (stored, dups, errs, ttime)
+    elif not options.filename:
         i = GuiBulkImport(settings, config)
         main_window = gtk.Window()
         main_window.connect('destroy', destroy)
@@ -385,11 +400,15 @@ def main(argv=None):
         # importer.setDropIndexes("auto")
         importer.setDropIndexes("don't drop")
         importer.setFailOnError(options.failOnError)
-        importer.setThreads(-1)
+        importer.setThreads(options.threads)
         importer.addBulkImportImportFileOrDir(os.path.expanduser(options.filename), site=options.filtername)
         importer.setCallHud(False)
         if options.starsArchive:
             importer.setStarsArchive(True)
+        if options.columnarStats:
+            importer.setColumnarStats(True)
+        if options.insertBatchSize:
+            importer.setInsertBatchSize(options.insertBatchSize)
         (stored, dups, partial, errs, ttime) = importer.runImport()
         importer.clearFileList()
         print 'GuiBulkImport done: Stored: %d \tDuplicates: %d \tPartial: %d \tErrors: %d in %s seconds - %.0f/sec'\
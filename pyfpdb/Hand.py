@@ -24,10 +24,10 @@ import traceback
 import os
 import os.path
 from decimal import Decimal
-import operator
 import time,datetime
 from copy import deepcopy
 import pprint
+from collections import namedtuple, defaultdict
 
 import logging
 # logging has been set up in fpdb.py or HUD_main.py, use their settings:
@@ -40,6 +40,53 @@ import DerivedStats
 import Card
 
 
+def toCents(amount):
+    """\
+A money amount as read from a hand history (a string such as "1,234.5", or a
+Decimal) as a whole number of cents. Hand and Pot keep all money in cents, so
+bets and pots are added up with ints rather than Decimals."""
+    if isinstance(amount, basestring):
+        amount = amount.strip().replace(u',', u'')
+        (whole, point, frac) = amount.partition(u'.')
+        if whole.isdigit() and len(frac) <= 2 and (frac == u'' or frac.isdigit()):
+            return int(whole) * 100 + int((frac + u'00')[:2])
+        return int(Decimal(amount) * 100)
+    return int(Decimal(str(amount)) * 100)
+
+# The records a Hand keeps its players, hole cards and actions in. They're
+# tuples, so code which indexes them (act[0], player[1], ...) works unchanged.
+# The money in actions is in cents.
+Player = namedtuple('Player', 'seat name chips')
+HoleCards = namedtuple('HoleCards', 'open closed')
+Action = namedtuple('Action', 'player action')                             # folds, checks, stands pat
+Bet = namedtuple('Bet', 'player action amount allin')                      # calls, bets, bringin
+Raise = namedtuple('Raise', 'player action raiseBy raiseTo call allin')
+Post = namedtuple('Post', 'player action blindtype amount allin')          # blinds and antes
+Discard = namedtuple('Discard', 'player action num cards')                 # cards is None unless shown
+
+playerNames = {}
+PLAYER_NAMES_SIZE = 10000   # names internName() shares before starting afresh
+
+def internName(name):
+    """\
+The one copy of a player name shared by all hands, so that a big import
+doesn't keep a copy of each name for every hand (and every action) it's in.
+The names are forgotten once there are PLAYER_NAMES_SIZE of them, so a long
+auto-import session doesn't keep every opponent it has ever seen."""
+    shared = playerNames.get(name)
+    if shared is None:
+        if len(playerNames) >= PLAYER_NAMES_SIZE:
+            playerNames.clear()
+        shared = playerNames[name] = name
+    return shared
+
+def fromCents(cents):
+    """Decimal of an amount in cents, for writing it out: 150 -> 1.50, 200 -> 2"""
+    if cents % 100 == 0:
+        return Decimal(cents / 100)
+    return Decimal(cents).scaleb(-2)
+
+
 class Hand(object):
 
 ###############################################################3
@@ -100,7 +147,7 @@ class Hand(object):
             self.streets[street] = "" # portions of the handText, filled by markStreets()
             self.actions[street] = []
         for street in self.actionStreets:
-            self.bets[street] = {}
+            self.bets[street] = defaultdict(list)   # player name -> bets, for players who've bet
             self.lastBet[street] = 0
             self.board[street] = []
         for street in self.holeStreets:
@@ -126,6 +173,10 @@ class Hand(object):
         self.sym = self.SYMBOL[self.gametype['currency']] # save typing! delete this attr when done
         self.pot.setSym(self.sym)
         self.is_duplicate = False  # i.e. don't update hudcache if true
+        # A lean hand is built with only what's stored in the database, so it has no
+        # button, dealt/shown/mucked/folded/posted players, discards or returned bets,
+        # and can't be written out
+        self.lean = False
 
     def __str__(self):
         vars = ( ("BB", self.bb),
@@ -193,11 +244,16 @@ dealt   whether they were seen in a 'dealt to' line
             print "[ERROR] Tried to add holecards for unknown player: %s" % (player,)
             return
 
-        if dealt:  self.dealt.add(player)
-        if shown:  self.shown.add(player)
-        if mucked: self.mucked.add(player)
+        if not self.lean:   # only written hands say who was dealt, showed and mucked
+            if dealt:  self.dealt.add(player)
+            if shown:  self.shown.add(player)
+            if mucked: self.mucked.add(player)
 
-        self.holecards[street][player] = [open, closed]
+        self.holecards[street][internName(player)] = HoleCards(open, closed)
+
+    @property
+    def pnames(self):
+        return [p[1] for p in self.players]
 
     def prepInsert(self, db):
         #####
@@ -205,7 +261,7 @@ dealt   whether they were seen in a 'dealt to' line
         # These functions are intended for prep insert eventually
         #####
         # Players - base playerid and siteid tuple
-        self.dbid_pids = db.getSqlPlayerIDs([p[1] for p in self.players], self.siteId)
+        self.dbid_pids = db.getSqlPlayerIDs(self.pnames, self.siteId)
 
         #Gametypes
         self.dbid_gt = db.getGameTypeId(self.siteId, self.gametype)
@@ -240,6 +296,16 @@ db: a connected Database object"""
             self.is_duplicate = True  # i.e. don't update hudcache
             raise FpdbHandDuplicate(hh['siteHandNo'])
 
+    def handsRow(self):
+        """The Hands row of the hand, as a dict, for Database.storeHands()"""
+        if not self.stats.hands:
+            self.stats.getStats(self)
+        return self.stats.getHands()
+
+    def handsPlayersRows(self, db):
+        """The HandsPlayers rows of the hand, once it has its dbid_hands"""
+        return db.handsPlayersValues(self.dbid_hands, self.dbid_pids, self.stats.getHandsPlayers())
+
     def updateHudCache(self, db):
         db.storeHudCache(self.dbid_gt, self.dbid_pids, self.starttime, self.stats.getHandsPlayers())
 
@@ -256,23 +322,20 @@ seat    (int) indicating the seat
 name    (string) player name
 chips   (string) the chips the player has at the start of the hand (can be None)
 If a player has None chips he won't be added."""
-        log.debug("addPlayer: %s %s (%s)" % (seat, name, chips))
+        log.debug("addPlayer: %s %s (%s)", seat, name, chips)
         if chips is not None:
             chips = re.sub(u',', u'', chips) #some sites have commas
-            self.players.append([seat, name, chips])
-            self.stacks[name] = Decimal(chips)
+            name = internName(name)
+            self.players.append(Player(seat, name, chips))
+            self.stacks[name] = toCents(chips)
             self.pot.addPlayer(name)
-            for street in self.actionStreets:
-                self.bets[street][name] = []
-                #self.holecards[name] = {} # dict from street names.
-                #self.discards[name] = {} # dict from street names.
 
 
     def addStreets(self, match):
         # go through m and initialise actions to empty list for each street.
         if match:
             self.streets.update(match.groupdict())
-            log.debug("markStreets:\n"+ str(self.streets))
+            log.debug("markStreets:\n%s", self.streets)
         else:
             log.error("markstreets didn't match")
             log.error("    - Assuming hand cancelled")
@@ -280,14 +343,14 @@ If a player has None chips he won't be added."""
             raise FpdbParseError
 
     def checkPlayerExists(self,player):
-        if player not in [p[1] for p in self.players]:
+        if player not in self.stacks:
             print "checkPlayerExists", player, "fail"
             raise FpdbParseError
 
 
 
     def setCommunityCards(self, street, cards):
-        log.debug("setCommunityCards %s %s" %(street,  cards))
+        log.debug("setCommunityCards %s %s", street, cards)
         self.board[street] = [self.card(c) for c in cards]
 #        print "DEBUG: self.board: %s" % self.board
 
@@ -303,9 +366,9 @@ For sites (currently only Carbon Poker) which record "all in" as a special actio
 """
         self.checkPlayerExists(player)
         amount = re.sub(u',', u'', amount) #some sites have commas
-        Ai = Decimal(amount)
+        Ai = toCents(amount)
         Bp = self.lastBet[street]
-        Bc = reduce(operator.add, self.bets[street][player], 0)
+        Bc = sum(self.bets[street][player])
         C = Bp - Bc
         if Ai <= C:
             self.addCall(street, player, amount)
@@ -316,15 +379,16 @@ For sites (currently only Carbon Poker) which record "all in" as a special actio
             self._addRaise(street, player, C, Rb, Ai)
 
     def addAnte(self, player, ante):
-        log.debug("%s %s antes %s" % ('BLINDSANTES', player, ante))
+        log.debug("%s %s antes %s", 'BLINDSANTES', player, ante)
         if player is not None:
             ante = re.sub(u',', u'', ante) #some sites have commas
-            self.bets['BLINDSANTES'][player].append(Decimal(ante))
-            self.stacks[player] -= Decimal(ante)
-            act = (player, 'posts', "ante", ante, self.stacks[player]==0)
+            cents = toCents(ante)
+            self.bets['BLINDSANTES'][player].append(cents)
+            self.stacks[player] -= cents
+            act = Post(internName(player), 'posts', "ante", cents, self.stacks[player]==0)
             self.actions['BLINDSANTES'].append(act)
-#            self.pot.addMoney(player, Decimal(ante))
-            self.pot.addCommonMoney(player, Decimal(ante))
+#            self.pot.addMoney(player, cents)
+            self.pot.addCommonMoney(player, cents)
 #I think the antes should be common money, don't have enough hand history to check
         
     def addBlind(self, player, blindtype, amount):
@@ -336,46 +400,49 @@ For sites (currently only Carbon Poker) which record "all in" as a special actio
         #   - this is a call of 1 sb and a raise to 1 bb
         #
 
-        log.debug("addBlind: %s posts %s, %s" % (player, blindtype, amount))
+        log.debug("addBlind: %s posts %s, %s", player, blindtype, amount)
         if player is not None:
             amount = re.sub(u',', u'', amount) #some sites have commas
-            self.stacks[player] -= Decimal(amount)
-            act = (player, 'posts', blindtype, amount, self.stacks[player]==0)
+            cents = toCents(amount)
+            self.stacks[player] -= cents
+            act = Post(internName(player), 'posts', blindtype, cents, self.stacks[player]==0)
             self.actions['BLINDSANTES'].append(act)
 
             if blindtype == 'both':
                 # work with the real ammount. limit games are listed as $1, $2, where
                 # the SB 0.50 and the BB is $1, after the turn the minimum bet amount is $2....
-                amount = self.bb 
-                self.bets['BLINDSANTES'][player].append(Decimal(self.sb))
-                self.pot.addCommonMoney(player, Decimal(self.sb))
+                cents = toCents(self.bb)
+                self.bets['BLINDSANTES'][player].append(toCents(self.sb))
+                self.pot.addCommonMoney(player, toCents(self.sb))
 
             if blindtype == 'secondsb':
-                amount = Decimal(0)
-                self.bets['BLINDSANTES'][player].append(Decimal(self.sb))
-                self.pot.addCommonMoney(player, Decimal(self.sb))
+                cents = 0
+                self.bets['BLINDSANTES'][player].append(toCents(self.sb))
+                self.pot.addCommonMoney(player, toCents(self.sb))
 
-            self.bets['PREFLOP'][player].append(Decimal(amount))
-            self.pot.addMoney(player, Decimal(amount))
-            self.lastBet['PREFLOP'] = Decimal(amount)
-            self.posted = self.posted + [[player,blindtype]]
+            self.bets['PREFLOP'][player].append(cents)
+            self.pot.addMoney(player, cents)
+            self.lastBet['PREFLOP'] = cents
+            if not self.lean:
+                self.posted.append((internName(player), blindtype))
 
 
 
     def addCall(self, street, player=None, amount=None):
         if amount:
             amount = re.sub(u',', u'', amount) #some sites have commas
-        log.debug("%s %s calls %s" %(street, player, amount))
+        log.debug("%s %s calls %s", street, player, amount)
         # Potentially calculate the amount of the call if not supplied
         # corner cases include if player would be all in
         if amount is not None:
-            self.bets[street][player].append(Decimal(amount))
-            #self.lastBet[street] = Decimal(amount)
-            self.stacks[player] -= Decimal(amount)
+            cents = toCents(amount)
+            self.bets[street][player].append(cents)
+            #self.lastBet[street] = cents
+            self.stacks[player] -= cents
             #print "DEBUG %s calls %s, stack %s" % (player, amount, self.stacks[player])
-            act = (player, 'calls', amount, self.stacks[player]==0)
+            act = Bet(internName(player), 'calls', cents, self.stacks[player]==0)
             self.actions[street].append(act)
-            self.pot.addMoney(player, Decimal(amount))
+            self.pot.addMoney(player, cents)
 
     def addRaiseBy(self, street, player, amountBy):
         """\
@@ -394,9 +461,9 @@ Add a raise by amountBy on [street] by [player]
         #
         amountBy = re.sub(u',', u'', amountBy) #some sites have commas
         self.checkPlayerExists(player)
-        Rb = Decimal(amountBy)
+        Rb = toCents(amountBy)
         Bp = self.lastBet[street]
-        Bc = reduce(operator.add, self.bets[street][player], 0)
+        Bc = sum(self.bets[street][player])
         C = Bp - Bc
         Rt = Bp + Rb
 
@@ -411,9 +478,9 @@ Add a raise by amountBy on [street] by [player]
 For sites which by "raises x" mean "calls and raises putting a total of x in the por". """
         self.checkPlayerExists(player)
         amount = re.sub(u',', u'', amount) #some sites have commas
-        CRb = Decimal(amount)
+        CRb = toCents(amount)
         Bp = self.lastBet[street]
-        Bc = reduce(operator.add, self.bets[street][player], 0)
+        Bc = sum(self.bets[street][player])
         C = Bp - Bc
         Rb = CRb - C
         Rt = Bp + Rb
@@ -428,17 +495,17 @@ Add a raise on [street] by [player] to [amountTo]
         self.checkPlayerExists(player)
         amountTo = re.sub(u',', u'', amountTo) #some sites have commas
         Bp = self.lastBet[street]
-        Bc = reduce(operator.add, self.bets[street][player], 0)
-        Rt = Decimal(amountTo)
+        Bc = sum(self.bets[street][player])
+        Rt = toCents(amountTo)
         C = Bp - Bc
         Rb = Rt - C - Bc
         self._addRaise(street, player, C, Rb, Rt)
 
     def _addRaise(self, street, player, C, Rb, Rt):
-        log.debug("%s %s raise %s" %(street, player, Rt))
+        log.debug("%s %s raise %s", street, player, Rt)
         self.bets[street][player].append(C + Rb)
         self.stacks[player] -= (C + Rb)
-        act = (player, 'raises', Rb, Rt, C, self.stacks[player]==0)
+        act = Raise(internName(player), 'raises', Rb, Rt, C, self.stacks[player]==0)
         self.actions[street].append(act)
         self.lastBet[street] = Rt # TODO check this is correct
         self.pot.addMoney(player, C+Rb)
@@ -446,47 +513,50 @@ Add a raise on [street] by [player] to [amountTo]
 
 
     def addBet(self, street, player, amount):
-        log.debug("%s %s bets %s" %(street, player, amount))
+        log.debug("%s %s bets %s", street, player, amount)
         amount = re.sub(u',', u'', amount) #some sites have commas
         self.checkPlayerExists(player)
-        self.bets[street][player].append(Decimal(amount))
-        self.stacks[player] -= Decimal(amount)
+        cents = toCents(amount)
+        self.bets[street][player].append(cents)
+        self.stacks[player] -= cents
         #print "DEBUG %s bets %s, stack %s" % (player, amount, self.stacks[player])
-        act = (player, 'bets', amount, self.stacks[player]==0)
+        act = Bet(internName(player), 'bets', cents, self.stacks[player]==0)
         self.actions[street].append(act)
-        self.lastBet[street] = Decimal(amount)
-        self.pot.addMoney(player, Decimal(amount))
+        self.lastBet[street] = cents
+        self.pot.addMoney(player, cents)
 
 
     def addStandsPat(self, street, player):
         self.checkPlayerExists(player)
-        act = (player, 'stands pat')
+        act = Action(internName(player), 'stands pat')
         self.actions[street].append(act)
 
 
     def addFold(self, street, player):
-        log.debug("%s %s folds" % (street, player))
+        log.debug("%s %s folds", street, player)
         self.checkPlayerExists(player)
-        self.folded.add(player)
+        if not self.lean:
+            self.folded.add(player)
         self.pot.addFold(player)
-        self.actions[street].append((player, 'folds'))
+        self.actions[street].append(Action(internName(player), 'folds'))
 
 
     def addCheck(self, street, player):
         #print "DEBUG: %s %s checked" % (street, player)
-        logging.debug("%s %s checks" % (street, player))
+        log.debug("%s %s checks", street, player)
         self.checkPlayerExists(player)
-        self.actions[street].append((player, 'checks'))
+        self.actions[street].append(Action(internName(player), 'checks'))
 
 
     def addCollectPot(self,player, pot):
-        log.debug("%s collected %s" % (player, pot))
+        log.debug("%s collected %s", player, pot)
         self.checkPlayerExists(player)
-        self.collected = self.collected + [[player, pot]]
+        cents = toCents(pot)
+        self.collected = self.collected + [[player, cents]]
         if player not in self.collectees:
-            self.collectees[player] = Decimal(pot)
+            self.collectees[player] = cents
         else:
-            self.collectees[player] += Decimal(pot)
+            self.collectees[player] += cents
 
 
     def addShownCards(self, cards, player, holeandboard=None, shown=True, mucked=False):
@@ -494,7 +564,7 @@ Add a raise on [street] by [player] to [amountTo]
 For when a player shows cards for any reason (for showdown or out of choice).
 Card ranks will be uppercased
 """
-        log.debug("addShownCards %s hole=%s all=%s" % (player, cards,  holeandboard))
+        log.debug("addShownCards %s hole=%s all=%s", player, cards, holeandboard)
         if cards is not None:
             self.addHoleCards(cards,player,shown, mucked)
         elif holeandboard is not None:
@@ -515,7 +585,7 @@ Card ranks will be uppercased
             self.totalcollected = 0;
             #self.collected looks like [[p1,amount][px,amount]]
             for entry in self.collected:
-                self.totalcollected += Decimal(entry[1]) 
+                self.totalcollected += entry[1]
 
     def getGameTypeAsString(self):
         """\
@@ -557,24 +627,24 @@ Map the tuple self.gametype onto the pokerstars string describing it
         elif act[1] == 'checks':
             return ("%s: checks " %(act[0]))
         elif act[1] == 'calls':
-            return ("%s: calls %s%s%s" %(act[0], self.sym, act[2], ' and is all-in' if act[3] else ''))
+            return ("%s: calls %s%s%s" %(act[0], self.sym, fromCents(act[2]), ' and is all-in' if act[3] else ''))
         elif act[1] == 'bets':
-            return ("%s: bets %s%s%s" %(act[0], self.sym, act[2], ' and is all-in' if act[3] else ''))
+            return ("%s: bets %s%s%s" %(act[0], self.sym, fromCents(act[2]), ' and is all-in' if act[3] else ''))
         elif act[1] == 'raises':
-            return ("%s: raises %s%s to %s%s%s" %(act[0], self.sym, act[2], self.sym, act[3], ' and is all-in' if act[5] else ''))
+            return ("%s: raises %s%s to %s%s%s" %(act[0], self.sym, fromCents(act[2]), self.sym, fromCents(act[3]), ' and is all-in' if act[5] else ''))
         elif act[1] == 'completea':
-            return ("%s: completes to %s%s%s" %(act[0], self.sym, act[2], ' and is all-in' if act[3] else ''))
+            return ("%s: completes to %s%s%s" %(act[0], self.sym, fromCents(act[2]), ' and is all-in' if act[3] else ''))
         elif act[1] == 'posts':
             if(act[2] == "small blind"):
-                return ("%s: posts small blind %s%s%s" %(act[0], self.sym, act[3], ' and is all-in' if act[4] else ''))
+                return ("%s: posts small blind %s%s%s" %(act[0], self.sym, fromCents(act[3]), ' and is all-in' if act[4] else ''))
             elif(act[2] == "big blind"):
-                return ("%s: posts big blind %s%s%s" %(act[0], self.sym, act[3], ' and is all-in' if act[4] else ''))
+                return ("%s: posts big blind %s%s%s" %(act[0], self.sym, fromCents(act[3]), ' and is all-in' if act[4] else ''))
             elif(act[2] == "both"):
-                return ("%s: posts small & big blinds %s%s%s" %(act[0], self.sym, act[3], ' and is all-in' if act[4] else ''))
+                return ("%s: posts small & big blinds %s%s%s" %(act[0], self.sym, fromCents(act[3]), ' and is all-in' if act[4] else ''))
             elif(act[2] == "ante"):
-                return ("%s: posts the ante %s%s%s" %(act[0], self.sym, act[3], ' and is all-in' if act[4] else ''))
+                return ("%s: posts the ante %s%s%s" %(act[0], self.sym, fromCents(act[3]), ' and is all-in' if act[4] else ''))
         elif act[1] == 'bringin':
-            return ("%s: brings in for %s%s%s" %(act[0], self.sym, act[2], ' and is all-in' if act[3] else ''))
+            return ("%s: brings in for %s%s%s" %(act[0], self.sym, fromCents(act[2]), ' and is all-in' if act[3] else ''))
         elif act[1] == 'discards':
             return ("%s: discards %s %s%s" %(act[0], act[2], 'card' if act[2] == 1 else 'cards' , " [" + " ".join(self.discards[street][act[0]]) + "]" if self.hero == act[0] else ''))
         elif act[1] == 'stands pat':
@@ -625,8 +695,13 @@ Map the tuple self.gametype onto the pokerstars string describing it
         return table_string
 
 
+    def checkWritable(self):
+        if self.lean:
+            raise FpdbError("Hand %s was built lean (leanHands in HUD_config.xml), so can't be written out" % self.handid)
+
     def writeHand(self, fh=sys.__stdout__):
         # PokerStars format.
+        self.checkWritable()
         print >>fh, self.writeGameLine()
         print >>fh, self.writeTableLine()
 
@@ -649,17 +724,19 @@ class HoldemOmahaHand(Hand):
         #Generally, we call 'read' methods here, which get the info according to the particular filter (hhc)
         # which then invokes a 'addXXX' callback
         if builtFrom == "HHC":
+            self.lean = self.pot.lean = hhc.leanHands
             hhc.readHandInfo(self)
             if self.gametype['type'] == 'tour':
                 self.tablename = "%s %s" % (self.tourNo, self.tablename)
             hhc.readPlayerStacks(self)
-            hhc.compilePlayerRegexs(self)
+            hhc.loadPlayerRegexs(self)
             hhc.markStreets(self)
             if self.cancelled:
                 return
             hhc.readBlinds(self)
             hhc.readAntes(self)
-            hhc.readButton(self)
+            if not self.lean:
+                hhc.readButton(self)
             hhc.readHeroCards(self)
             hhc.readShowdownActions(self)
             # Read actions in street order
@@ -690,8 +767,9 @@ class HoldemOmahaHand(Hand):
 
     def addShownCards(self, cards, player, shown=True, mucked=False, dealt=False):
         if player == self.hero: # we have hero's cards just update shown/mucked
-            if shown:  self.shown.add(player)
-            if mucked: self.mucked.add(player)
+            if not self.lean:
+                if shown:  self.shown.add(player)
+                if mucked: self.mucked.add(player)
         else:
             if len(cards) in (2, 4):  # avoid adding board by mistake (Everleaf problem)
                 self.addHoleCards('PREFLOP', player, open=[], closed=cards, shown=shown, mucked=mucked, dealt=dealt)
@@ -736,6 +814,7 @@ class HoldemOmahaHand(Hand):
 
 
     def writeHTMLHand(self):
+        self.checkWritable()
         from nevow import tags as T
         from nevow import flat
         players_who_act_preflop = (([x[0] for x in self.actions['PREFLOP']]+[x[0] for x in self.actions['BLINDSANTES']]))
@@ -898,12 +977,12 @@ class HoldemOmahaHand(Hand):
         # Immediately before the summary.
         # The current importer uses those lines for importing winning rather than the summary
         for name in self.pot.returned:
-            print >>fh, ("Uncalled bet (%s%s) returned to %s" %(self.sym, self.pot.returned[name],name))
+            print >>fh, ("Uncalled bet (%s%s) returned to %s" %(self.sym, fromCents(self.pot.returned[name]),name))
         for entry in self.collected:
-            print >>fh, ("%s collected %s%s from x pot" %(entry[0], self.sym, entry[1]))
+            print >>fh, ("%s collected %s%s from x pot" %(entry[0], self.sym, fromCents(entry[1])))
 
         print >>fh, ("*** SUMMARY ***")
-        print >>fh, "%s | Rake %s%.2f" % (self.pot, self.sym, self.rake)
+        print >>fh, "%s | Rake %s%.2f" % (self.pot, self.sym, fromCents(self.rake))
 
         board = []
         for street in ["FLOP", "TURN", "RIVER"]:
@@ -915,9 +994,9 @@ class HoldemOmahaHand(Hand):
             seatnum = player[0]
             name = player[1]
             if name in self.collectees and name in self.shown:
-                print >>fh, ("Seat %d: %s showed [%s] and won (%s%s)" % (seatnum, name, " ".join(self.holecards['PREFLOP'][name][1]), self.sym, self.collectees[name]))
+                print >>fh, ("Seat %d: %s showed [%s] and won (%s%s)" % (seatnum, name, " ".join(self.holecards['PREFLOP'][name][1]), self.sym, fromCents(self.collectees[name])))
             elif name in self.collectees:
-                print >>fh, ("Seat %d: %s collected (%s%s)" % (seatnum, name, self.sym, self.collectees[name]))
+                print >>fh, ("Seat %d: %s collected (%s%s)" % (seatnum, name, self.sym, fromCents(self.collectees[name])))
             #~ elif name in self.shown:
                 #~ print >>fh, _("Seat %d: %s showed [%s]" % (seatnum, name, " ".join(self.holecards[name]['PREFLOP'])))
             elif name in self.folded:
@@ -947,15 +1026,17 @@ class DrawHand(Hand):
         self.bb = gametype['bb']
         # Populate the draw hand.
         if builtFrom == "HHC":
+            self.lean = self.pot.lean = hhc.leanHands
             hhc.readHandInfo(self)
             if self.gametype['type'] == 'tour':
                 self.tablename = "%s %s" % (self.tourNo, self.tablename)
             hhc.readPlayerStacks(self)
-            hhc.compilePlayerRegexs(self)
+            hhc.loadPlayerRegexs(self)
             hhc.markStreets(self)
             hhc.readBlinds(self)
             hhc.readAntes(self)
-            hhc.readButton(self)
+            if not self.lean:
+                hhc.readButton(self)
             hhc.readHeroCards(self)
             hhc.readShowdownActions(self)
             # Read actions in street order
@@ -983,45 +1064,47 @@ class DrawHand(Hand):
         #   - this is a call of 1 sb and a raise to 1 bb
         #
 
-        log.debug("addBlind: %s posts %s, %s" % (player, blindtype, amount))
+        log.debug("addBlind: %s posts %s, %s", player, blindtype, amount)
         if player is not None:
-            self.bets['DEAL'][player].append(Decimal(amount))
-            self.stacks[player] -= Decimal(amount)
+            cents = toCents(amount)
+            self.bets['DEAL'][player].append(cents)
+            self.stacks[player] -= cents
             #print "DEBUG %s posts, stack %s" % (player, self.stacks[player])
-            act = (player, 'posts', blindtype, amount, self.stacks[player]==0)
+            act = Post(internName(player), 'posts', blindtype, cents, self.stacks[player]==0)
             self.actions['BLINDSANTES'].append(act)
-            self.pot.addMoney(player, Decimal(amount))
+            self.pot.addMoney(player, cents)
             if blindtype == 'big blind':
-                self.lastBet['DEAL'] = Decimal(amount)
+                self.lastBet['DEAL'] = cents
             elif blindtype == 'both':
                 # extra small blind is 'dead'
-                amount = Decimal(amount)/3
-                amount += amount
-                self.lastBet['DEAL'] = Decimal(amount)
-        self.posted = self.posted + [[player,blindtype]]
+                self.lastBet['DEAL'] = cents * 2 / 3
+        if not self.lean:
+            self.posted.append((internName(player), blindtype))
         #print "DEBUG: self.posted: %s" %(self.posted)
 
     def addShownCards(self, cards, player, shown=True, mucked=False, dealt=False):
         if player == self.hero: # we have hero's cards just update shown/mucked
-            if shown:  self.shown.add(player)
-            if mucked: self.mucked.add(player)
+            if not self.lean:
+                if shown:  self.shown.add(player)
+                if mucked: self.mucked.add(player)
         else:
 # TODO: Probably better to find the last street with action and add the hole cards to that street
             self.addHoleCards('DRAWTHREE', player, open=[], closed=cards, shown=shown, mucked=mucked, dealt=dealt)
 
 
     def discardDrawHoleCards(self, cards, player, street):
-        log.debug("discardDrawHoleCards '%s' '%s' '%s'" % (cards, player, street))
+        log.debug("discardDrawHoleCards '%s' '%s' '%s'", cards, player, street)
         self.discards[street][player] = set([cards])
 
 
     def addDiscard(self, street, player, num, cards):
         self.checkPlayerExists(player)
         if cards:
-            act = (player, 'discards', num, cards)
-            self.discardDrawHoleCards(cards, player, street)
+            act = Discard(internName(player), 'discards', num, cards)
+            if not self.lean:   # only written out, in the hero's discard line
+                self.discardDrawHoleCards(cards, player, street)
         else:
-            act = (player, 'discards', num)
+            act = Discard(internName(player), 'discards', num, None)
         self.actions[street].append(act)
 
     def holecardsAsSet(self, street, player):
@@ -1062,7 +1145,7 @@ class DrawHand(Hand):
 
         if 'BLINDSANTES' in self.actions:
             for act in self.actions['BLINDSANTES']:
-                print >>fh, _("%s: %s %s %s%s" %(act[0], act[1], act[2], self.sym, act[3]))
+                print >>fh, _("%s: %s %s %s%s" %(act[0], act[1], act[2], self.sym, fromCents(act[3])))
 
         if 'DEAL' in self.actions:
             print >>fh, _("*** DEALING HANDS ***")
@@ -1116,12 +1199,12 @@ class DrawHand(Hand):
         # Immediately before the summary.
         # The current importer uses those lines for importing winning rather than the summary
         for name in self.pot.returned:
-            print >>fh, _("Uncalled bet (%s%s) returned to %s" %(self.sym, self.pot.returned[name],name))
+            print >>fh, _("Uncalled bet (%s%s) returned to %s" %(self.sym, fromCents(self.pot.returned[name]),name))
         for entry in self.collected:
-            print >>fh, _("%s collected %s%s from x pot" %(entry[0], self.sym, entry[1]))
+            print >>fh, _("%s collected %s%s from x pot" %(entry[0], self.sym, fromCents(entry[1])))
 
         print >>fh, _("*** SUMMARY ***")
-        print >>fh, "%s | Rake %s%.2f" % (self.pot, self.sym, self.rake)
+        print >>fh, "%s | Rake %s%.2f" % (self.pot, self.sym, fromCents(self.rake))
         print >>fh, "\n\n"
 
 
@@ -1145,11 +1228,12 @@ class StudHand(Hand):
         #Generally, we call a 'read' method here, which gets the info according to the particular filter (hhc)
         # which then invokes a 'addXXX' callback
         if builtFrom == "HHC":
+            self.lean = self.pot.lean = hhc.leanHands
             hhc.readHandInfo(self)
             if self.gametype['type'] == 'tour':
                 self.tablename = "%s %s" % (self.tourNo, self.tablename)
             hhc.readPlayerStacks(self)
-            hhc.compilePlayerRegexs(self)
+            hhc.loadPlayerRegexs(self)
             hhc.markStreets(self)
             hhc.readAntes(self)
             hhc.readBringIn(self)
@@ -1158,7 +1242,7 @@ class StudHand(Hand):
             for street in self.actionStreets:
                 if street == 'BLINDSANTES': continue # OMG--sometime someone folds in the ante round
                 if self.streets[street]:
-                    log.debug(street + self.streets[street])
+                    log.debug("%s%s", street, self.streets[street])
                     hhc.readAction(self, street)
                     self.pot.markTotal(street)
             hhc.readCollectPot(self)
@@ -1173,8 +1257,9 @@ class StudHand(Hand):
 
     def addShownCards(self, cards, player, shown=True, mucked=False, dealt=False):
         if player == self.hero: # we have hero's cards just update shown/mucked
-            if shown:  self.shown.add(player)
-            if mucked: self.mucked.add(player)
+            if not self.lean:
+                if shown:  self.shown.add(player)
+                if mucked: self.mucked.add(player)
         else:
             self.addHoleCards('THIRD',   player, open=[cards[2]], closed=cards[0:2], shown=shown, mucked=mucked)
             self.addHoleCards('FOURTH',  player, open=[cards[3]], closed=[cards[2]],  shown=shown, mucked=mucked)
@@ -1191,10 +1276,10 @@ street  (string) the street name (in streetList)
 open  list of card bigrams e.g. ['2h','Jc'], dealt face up
 closed    likewise, but known only to player
 """
-        log.debug("addPlayerCards %s, o%s x%s" % (player,  open, closed))
+        log.debug("addPlayerCards %s, o%s x%s", player, open, closed)
         try:
             self.checkPlayerExists(player)
-            self.holecards[street][player] = (open, closed)
+            self.holecards[street][internName(player)] = HoleCards(open, closed)
         except FpdbParseError, e:
             print "[ERROR] Tried to add holecards for unknown player: %s" % (player,)
 
@@ -1205,12 +1290,12 @@ closed    likewise, but known only to player
         """\
 Add a complete on [street] by [player] to [amountTo]
 """
-        log.debug("%s %s completes %s" % (street, player, amountTo))
+        log.debug("%s %s completes %s", street, player, amountTo)
         amountTo = re.sub(u',', u'', amountTo) #some sites have commas
         self.checkPlayerExists(player)
         Bp = self.lastBet['THIRD']
-        Bc = reduce(operator.add, self.bets[street][player], 0)
-        Rt = Decimal(amountTo)
+        Bc = sum(self.bets[street][player])
+        Rt = toCents(amountTo)
         C = Bp - Bc
         Rb = Rt - C
         self._addRaise(street, player, C, Rb, Rt)
@@ -1223,13 +1308,14 @@ Add a complete on [street] by [player] to [amountTo]
 
     def addBringIn(self, player, bringin):
         if player is not None:
-            log.debug("Bringin: %s, %s" % (player , bringin))
-            self.bets['THIRD'][player].append(Decimal(bringin))
-            self.stacks[player] -= Decimal(bringin)
-            act = (player, 'bringin', bringin, self.stacks[player]==0)
+            log.debug("Bringin: %s, %s", player, bringin)
+            cents = toCents(bringin)
+            self.bets['THIRD'][player].append(cents)
+            self.stacks[player] -= cents
+            act = Bet(internName(player), 'bringin', cents, self.stacks[player]==0)
             self.actions['THIRD'].append(act)
-            self.lastBet['THIRD'] = Decimal(bringin)
-            self.pot.addMoney(player, Decimal(bringin))
+            self.lastBet['THIRD'] = cents
+            self.pot.addMoney(player, cents)
 
     def getStreetTotals(self):
         # street1Pot INT,                  /* pot size at flop/street4 */
@@ -1253,7 +1339,7 @@ Add a complete on [street] by [player] to [amountTo]
 
         if 'BLINDSANTES' in self.actions:
             for act in self.actions['BLINDSANTES']:
-                print >>fh, _("%s: posts the ante %s%s" %(act[0], self.sym, act[3]))
+                print >>fh, _("%s: posts the ante %s%s" %(act[0], self.sym, fromCents(act[3])))
 
         if 'THIRD' in self.actions:
             dealt = 0
@@ -1334,12 +1420,12 @@ Add a complete on [street] by [player] to [amountTo]
         # Immediately before the summary.
         # The current importer uses those lines for importing winning rather than the summary
         for name in self.pot.returned:
-            print >>fh, _("Uncalled bet (%s%s) returned to %s" %(self.sym, self.pot.returned[name],name))
+            print >>fh, _("Uncalled bet (%s%s) returned to %s" %(self.sym, fromCents(self.pot.returned[name]),name))
         for entry in self.collected:
-            print >>fh, _("%s collected %s%s from x pot" %(entry[0], self.sym, entry[1]))
+            print >>fh, _("%s collected %s%s from x pot" %(entry[0], self.sym, fromCents(entry[1])))
 
         print >>fh, _("*** SUMMARY ***")
-        print >>fh, "%s | Rake %s%.2f" % (self.pot, self.sym, self.rake)
+        print >>fh, "%s | Rake %s%.2f" % (self.pot, self.sym, fromCents(self.rake))
 # TODO: side pots
 
         board = []
@@ -1352,9 +1438,9 @@ Add a complete on [street] by [player] to [amountTo]
             seatnum = player[0]
             name = player[1]
             if name in self.collectees and name in self.shown:
-                print >>fh, _("Seat %d: %s showed [%s] and won (%s%s)" % (seatnum, name, self.join_holecards(name), self.sym, self.collectees[name]))
+                print >>fh, _("Seat %d: %s showed [%s] and won (%s%s)" % (seatnum, name, self.join_holecards(name), self.sym, fromCents(self.collectees[name])))
             elif name in self.collectees:
-                print >>fh, _("Seat %d: %s collected (%s%s)" % (seatnum, name, self.sym, self.collectees[name]))
+                print >>fh, _("Seat %d: %s collected (%s%s)" % (seatnum, name, self.sym, fromCents(self.collectees[name])))
             elif name in self.shown:
                 print >>fh, _("Seat %d: %s showed [%s]" % (seatnum, name, self.join_holecards(name)))
             elif name in self.mucked:
@@ -1408,6 +1494,112 @@ Add a complete on [street] by [player] to [amountTo]
             return holecards
 
 
+class HandRows(object):
+    """\
+The rows a hand will be stored as, without the Hand object they were worked out from.
+Small and picklable, so a hand can be parsed in one process and inserted from another.
+Has the same prepInsert/insert/updateHudCache interface as Hand."""
+
+    def __init__(self, hand):
+        hand.stats.getStats(hand)
+        self.siteId = hand.siteId
+        self.gametype = hand.gametype
+        self.starttime = hand.starttime
+        self.pnames = [p[1] for p in hand.players]
+        self.hands = hand.stats.getHands()
+        self.handsplayers = hand.stats.getHandsPlayers()
+        self.dbid_hands = 0
+        self.dbid_pids = None
+        self.dbid_gt = 0
+        self.is_duplicate = False
+
+    def prepInsert(self, db):
+        self.dbid_pids = db.getSqlPlayerIDs(self.pnames, self.siteId)
+        self.dbid_gt = db.getGameTypeId(self.siteId, self.gametype)
+
+    def insert(self, db):
+        """Same as Hand.insert(), with the stats already worked out"""
+        hh = self.hands
+        if not db.isDuplicate(self.dbid_gt, hh['siteHandNo']):
+            hh['gameTypeId'] = self.dbid_gt
+            hh['seats'] = len(self.dbid_pids)
+            self.dbid_hands = db.storeHand(hh)
+            db.storeHandsPlayers(self.dbid_hands, self.dbid_pids, self.handsplayers)
+        else:
+            log.info("HandRows.insert(): hid #: %s is a duplicate" % hh['siteHandNo'])
+            self.is_duplicate = True  # i.e. don't update hudcache
+            raise FpdbHandDuplicate(hh['siteHandNo'])
+
+    def handsRow(self):
+        return self.hands
+
+    def handsPlayersRows(self, db):
+        return db.handsPlayersValues(self.dbid_hands, self.dbid_pids, self.handsplayers)
+
+    def updateHudCache(self, db):
+        db.storeHudCache(self.dbid_gt, self.dbid_pids, self.starttime, self.handsplayers)
+
+
+class BatchedHandRows(HandRows):
+    """\
+HandRows of a hand whose HandsPlayers rows are in a DerivedStats.DerivedStatsBatch,
+which they're stored straight from. Only usable once the batch is finished."""
+
+    def __init__(self, hand, batch):
+        index = batch.addHand(hand)
+        self.batch = batch
+        self.siteId = hand.siteId
+        self.gametype = hand.gametype
+        self.starttime = hand.starttime
+        self.pnames = [p[1] for p in hand.players]
+        self.hands = batch.hands[index]
+        self.players = batch.players[index]
+        self.dbid_hands = 0
+        self.dbid_pids = None
+        self.dbid_gt = 0
+        self.is_duplicate = False
+
+    def insert(self, db):
+        hh = self.hands
+        if not db.isDuplicate(self.dbid_gt, hh['siteHandNo']):
+            hh['gameTypeId'] = self.dbid_gt
+            hh['seats'] = len(self.dbid_pids)
+            self.dbid_hands = db.storeHand(hh)
+            db.storeHandsPlayersRows(self.batch.handsPlayersRows(self.players, self.dbid_hands, self.dbid_pids))
+        else:
+            log.info("BatchedHandRows.insert(): hid #: %s is a duplicate" % hh['siteHandNo'])
+            self.is_duplicate = True  # i.e. don't update hudcache
+            raise FpdbHandDuplicate(hh['siteHandNo'])
+
+    def handsPlayersRows(self, db):
+        return list(self.batch.handsPlayersRows(self.players, self.dbid_hands, self.dbid_pids))
+
+    def updateHudCache(self, db):
+        db.storeHudCacheLines(self.batch.hudCacheLines(self.players, self.dbid_gt, self.dbid_pids,
+                                                       db.hudCacheStyleKey(self.starttime), db.hudCachePositions))
+
+def batchRows(hands, size):
+    """\
+Generator of BatchedHandRows for hands (None for the Nones among them), worked
+out size hands at a time in a DerivedStats.DerivedStatsBatch, so the stats of a
+whole batch are kept in one set of columns."""
+    batch = DerivedStats.DerivedStatsBatch(size)
+    rows = []
+    for hand in hands:
+        if hand is not None:
+            hand = BatchedHandRows(hand, batch)
+        rows.append(hand)
+        if batch.full():
+            batch.finish()
+            for hand in rows:
+                yield hand
+            batch = DerivedStats.DerivedStatsBatch(size)
+            rows = []
+    batch.finish()
+    for hand in rows:
+        yield hand
+
+
 class Pot(object):
 
 
@@ -1418,14 +1610,16 @@ class Pot(object):
         self.common       = {}
         self.total        = None
         self.returned     = {}
+        self._pots        = None    # worked out by pots
+        self.lean         = False   # don't keep returned, as for a lean Hand
         self.sym          = u'$' # this is the default currency symbol
 
     def setSym(self, sym):
         self.sym = sym
 
     def addPlayer(self,player):
-        self.committed[player] = Decimal(0)
-        self.common[player] = Decimal(0)
+        self.committed[player] = 0
+        self.common[player] = 0
 
     def addFold(self, player):
         # addFold must be called when a player folds
@@ -1463,25 +1657,31 @@ class Pot(object):
             #print "DEBUG: returning %f to %s" % (lastbet, returnto)
             self.total -= lastbet
             self.committed[returnto] -= lastbet
-            self.returned[returnto] = lastbet
-
-
-        # Work out side pots
-        commitsall = sorted([(v,k) for (k,v) in self.committed.items() if v >0])
-
-        self.pots = []
-        while len(commitsall) > 0:
-            commitslive = [(v,k) for (v,k) in commitsall if k in self.contenders]
-            v1 = commitslive[0][0]
-            self.pots += [sum([min(v,v1) for (v,k) in commitsall])]
-            commitsall = [((v-v1),k) for (v,k) in commitsall if v-v1 >0]
+            if not self.lean:   # only written hands say what was returned
+                self.returned[returnto] = lastbet
+        self._pots = None
 
+    @property
+    def pots(self):
+        """\
+The main pot and then the side pots, worked out from what each player put in
+the first time they're asked for, as only the written hand shows them."""
+        if self._pots is None:
+            commitsall = sorted([(v,k) for (k,v) in self.committed.items() if v >0])
+
+            self._pots = []
+            while len(commitsall) > 0:
+                commitslive = [(v,k) for (v,k) in commitsall if k in self.contenders]
+                v1 = commitslive[0][0]
+                self._pots += [sum([min(v,v1) for (v,k) in commitsall])]
+                commitsall = [((v-v1),k) for (v,k) in commitsall if v-v1 >0]
         # TODO: I think rake gets taken out of the pots.
         # so it goes:
         # total pot x. main pot y, side pot z. | rake r
         # and y+z+r = x
         # for example:
         # Total pot $124.30 Main pot $98.90. Side pot $23.40. | Rake $2
+        return self._pots
 
     def __str__(self):
         if self.sym is None:
@@ -1491,12 +1691,12 @@ class Pot(object):
             # NB if I'm sure end() is idempotent, call it here.
             raise FpdbParseError
 
-        ret = "Total pot %s%.2f" % (self.sym, self.total)
+        ret = "Total pot %s%.2f" % (self.sym, fromCents(self.total))
         if len(self.pots) < 2:
             return ret;
-        ret += " Main pot %s%.2f" % (self.sym, self.pots[0])
+        ret += " Main pot %s%.2f" % (self.sym, fromCents(self.pots[0]))
 
-        return ret + ''.join([ (" Side pot %s%.2f." % (self.sym, self.pots[x]) ) for x in xrange(1, len(self.pots)) ])
+        return ret + ''.join([ (" Side pot %s%.2f." % (self.sym, fromCents(self.pots[x])) ) for x in xrange(1, len(self.pots)) ])
 
 def assemble(cnxn, handid):
     c = cnxn.cursor()
@@ -24,8 +24,13 @@ import os
 import os.path
 import xml.dom.minidom
 import codecs
+import gzip
+import bz2
+import zipfile
 from decimal import Decimal
 import operator
+import itertools
+from collections import deque, OrderedDict
 from xml.dom.minidom import Node
 import time
 import datetime
@@ -50,6 +55,22 @@ import gtk
 class HandHistoryConverter():
 
     READ_CHUNK_SIZE = 10000 # bytes to read at a time from file in tail mode
+    READ_BULK_SIZE = 1048576 # bytes to read at a time when splitting a whole file into hands
+    PARSE_BATCH_SIZE = 100   # hands sent to a worker process at a time when parsing in a pool
+    KNOWN_BATCH_SIZE = 200   # hands looked up in the database at a time by dropKnownHands()
+    CODEPAGE_PROBE_SIZE = 65536 # bytes from the start of a file findCodepage() goes by
+    GAMETYPE_CACHE_SIZE = 1024  # hand headers readGameType() remembers the gametype of
+    TAIL_MIN_SLEEP = 0.05    # seconds to wait for more of a tailed file, while hands are coming in
+    TAIL_MAX_SLEEP = 1.0     # and at most, when they aren't
+    TAIL_CARRY = 32          # characters before new text which are searched for splitters again when tailing
+    HOLD_SECONDS = 10        # how long after a file was written to a last hand with no splitter after it is held
+
+    # Matches the start of a hand, with the part of its header that determineGameType()
+    # goes by (game, limit, stakes, currency, tournament...) in group KEY, and without
+    # the hand number and time, which change from hand to hand. Hands with the same KEY
+    # are of the same gametype, so it's only worked out once (see readGameType()).
+    # None if the site's headers don't allow it.
+    re_GameTypeKey = None
 
     # filetype can be "text" or "xml"
     # so far always "text"
@@ -70,11 +91,37 @@ follow :  whether to tail -f the input"""
 
         self.config = config
         self.import_parameters = self.config.get_import_parameters()
+        # build hands with just what's stored in the database, unless they're to be written out again
+        self.leanHands = self.import_parameters['leanHands'] and not self.import_parameters['saveStarsHH']
         #log = Configuration.get_logger("logging.conf", "parser", log_dir=self.config.dir_log)
+
+        self.follow = follow
+        # leave a last hand with no splitter after it to be read again next time, instead of
+        # converting it, if the file was written to in the last HOLD_SECONDS (the Importer
+        # sets this when it monitors files still being written)
+        self.holdLastHand = False
+        self.heldLastHand = False   # whether the last hand was left, the last time
+        self.compiledPlayers   = set()
+        self.compiledCurrency  = None
+        self.maxseats  = 10
+        self.gametypeCache = {}     # KEY of re_GameTypeKey: gametype, as items
+        self.supportedGames = frozenset([tuple(game) for game in self.readSupportedGames()])
+
+        self.setInput(in_path, out_path, index, starsArchive)
+
+        if autostart:
+            self.start()
+
+    def setInput(self, in_path = '-', out_path = '-', index = 0, starsArchive = False):
+        """\
+Point the converter at another file, or the same file from another byte offset.
+Everything set up for the converter itself, such as the player regexs, is kept,
+so the Importer can keep one converter per filter and reuse it file after file."""
         log.info("HandHistory init - %s subclass, in_path '%s'; out_path '%s'" % (self.sitename, in_path, out_path) )
 
         self.index     = index
         self.starsArchive = starsArchive
+        self.inputNo = next(inputCount)     # tells parse workers when the file changes
 
         self.in_path = in_path
         self.out_path = out_path
@@ -82,6 +129,7 @@ follow :  whether to tail -f the input"""
         self.processedHands = []
         self.numHands = 0
         self.numErrors = 0
+        self.offsetSearchPos = index    # where findHandOffset() looks from
 
         # Tourney object used to store TourneyInfo when called to deal with a Summary file
         self.tourney = None
@@ -90,17 +138,10 @@ follow :  whether to tail -f the input"""
             self.in_fh = sys.stdin
         self.out_fh = get_out_fh(out_path, self.import_parameters)
 
-        self.follow = follow
-        self.compiledPlayers   = set()
-        self.maxseats  = 10
-
         self.status = True
 
         self.parsedObjectType = "HH"      #default behaviour : parsing HH files, can be "Summary" if the parsing encounters a Summary File
 
-        if autostart:
-            self.start()
-
     def __str__(self):
         return """
 HandHistoryConverter: '%(sitename)s'
@@ -113,7 +154,56 @@ HandHistoryConverter: '%(sitename)s'
     def start(self):
         """Process a hand at a time from the input specified by in_path.
 If in follow mode, wait for more data to turn up.
-Otherwise, finish at EOF.
+Otherwise, finish at EOF, keeping the converted hands in self.processedHands.
+Callers that want one hand at a time should iterate over iterHands() instead.
+
+"""
+        if not self.follow:
+            for hand in self.iterHands():
+                self.processedHands.append(hand)
+            return
+
+        while gtk.events_pending():
+            gtk.main_iteration(False)
+
+        if not self.sanityCheck():
+            log.warning("Failed sanity check")
+            return
+
+        try:
+            self.numHands = 0
+            self.numErrors = 0
+            #TODO: See how summary files can be handled on the fly (here they should be rejected as before)
+            log.info("Tailing '%s'" % self.in_path)
+            for handText in self.tailHands():
+                try:
+                    self.processHand(handText)
+                    self.numHands += 1
+                except FpdbParseError, e:
+                    self.numErrors += 1
+                    log.warning("Failed to convert hand %s" % e.hid)
+                    log.warning("Exception msg: '%s'" % str(e))
+                    log.debug(handText)
+        except (IOError, FpdbParseError):
+            log.exception("Error converting '%s'" % self.in_path)
+        finally:
+            if self.out_fh != sys.stdout:
+                self.out_fh.close()
+
+    def iterHands(self, pool = None, poolSize = 1, db = None, columnar = False):
+        """Generator of converted hands from the file at in_path.
+Hands are parsed and yielded one at a time as the file is read, so a caller
+that doesn't keep them around only ever holds a single hand in memory.
+Summary files are read whole and handed to readSummaryInfo(); nothing is yielded for them.
+Hands of unsupported game types are yielded as None.
+If pool is a multiprocessing pool of poolSize processes started with
+initParseWorker(), the hands are parsed by its workers and Hand.HandRows are
+yielded instead of Hands.
+If db is given, hands already in it are skipped without being parsed (see
+dropKnownHands()) and counted in numDuplicates rather than numHands, and hands
+which fail to convert are put in its quarantine (see quarantineHand()).
+If columnar is True, Hand.BatchedHandRows are yielded instead, their stats
+worked out PARSE_BATCH_SIZE hands at a time in columns (see Hand.batchRows()).
 
 """
         while gtk.events_pending():
@@ -127,51 +217,187 @@ Otherwise, finish at EOF.
         try:
             self.numHands = 0
             self.numErrors = 0
-            if self.follow:
-                #TODO: See how summary files can be handled on the fly (here they should be rejected as before)
-                log.info("Tailing '%s'" % self.in_path)
-                for handText in self.tailHands():
-                    try:
-                        self.processHand(handText)
-                        self.numHands += 1
-                    except FpdbParseError, e:
-                        self.numErrors += 1
-                        log.warning("Failed to convert hand %s" % e.hid)
-                        log.warning("Exception msg: '%s'" % str(e))
-                        log.debug(handText)
-            else:
-                handsList = self.allHandsAsList()
-                log.info("Parsing %d hands" % len(handsList))
-                # Determine if we're dealing with a HH file or a Summary file
-                # quick fix : empty files make the handsList[0] fail ==> If empty file, go on with HH parsing
-                if len(handsList) == 0 or self.isSummary(handsList[0]) == False:
-                    self.parsedObjectType = "HH"
-                    for handText in handsList:
-                        try:
-                            self.processedHands.append(self.processHand(handText))
-                        except FpdbParseError, e:
-                            self.numErrors += 1
-                            log.warning("Failed to convert hand %s" % e.hid)
-                            log.warning("Exception msg: '%s'" % str(e))
-                            log.debug(handText)
-                    self.numHands = len(handsList)
+            self.numDuplicates = 0
+            self.offsetSearchPos = self.index
+            handTexts = self.allHandsAsIter()
+            # Determine if we're dealing with a HH file or a Summary file
+            # an empty file is treated as a HH file
+            for handText in handTexts:
+                if self.isSummary(handText):
+                    self.parsedObjectType = "Summary"
+                    summaryParsingStatus = self.readSummaryInfo([handText] + list(handTexts))
                     endtime = time.time()
-                    log.info("Read %d hands (%d failed) in %.3f seconds" % (self.numHands, self.numErrors, endtime - starttime))
-                else:
-                        self.parsedObjectType = "Summary"
-                        summaryParsingStatus = self.readSummaryInfo(handsList)
-                        endtime = time.time()
-                        if summaryParsingStatus :
-                            log.info("Summary file '%s' correctly parsed  (took %.3f seconds)" % (self.in_path, endtime - starttime))
-                        else :
-                            log.warning("Error converting summary file '%s' (took %.3f seconds)" % (self.in_path, endtime - starttime))
-
-        except IOError, ioe:
+                    if summaryParsingStatus :
+                        log.info("Summary file '%s' correctly parsed  (took %.3f seconds)" % (self.in_path, endtime - starttime))
+                    else :
+                        log.warning("Error converting summary file '%s' (took %.3f seconds)" % (self.in_path, endtime - starttime))
+                    return
+                handTexts = itertools.chain([handText], handTexts)
+                break
+
+            self.parsedObjectType = "HH"
+            if db is not None:
+                handTexts = self.dropKnownHands(handTexts, db)
+            if pool is not None:
+                for rows in self.parseInPool(handTexts, pool, poolSize, db, columnar):
+                    yield rows
+                handTexts = []
+            hands = self.convertHands(handTexts, db)
+            if columnar:
+                hands = Hand.batchRows(hands, self.PARSE_BATCH_SIZE)
+            for hand in hands:
+                yield hand
+            endtime = time.time()
+            log.info("Read %d hands (%d failed, %d already in the database) in %.3f seconds"
+                     % (self.numHands, self.numErrors, self.numDuplicates, endtime - starttime))
+            log.debug(str(playerRegexCache))
+
+        except (IOError, EOFError, zipfile.BadZipfile, FpdbParseError):
             log.exception("Error converting '%s'" % self.in_path)
         finally:
             if self.out_fh != sys.stdout:
                 self.out_fh.close()
 
+    def convertHands(self, handTexts, db = None):
+        """Generator of the hands converted from handTexts, quarantining in db those that fail"""
+        for handText in handTexts:
+            self.numHands += 1
+            try:
+                hand = self.processHand(handText)
+            except FpdbParseError, e:
+                self.numErrors += 1
+                log.warning("Failed to convert hand %s" % e.hid)
+                log.warning("Exception msg: '%s'" % str(e))
+                log.debug(handText)
+                self.quarantineHand(db, handText, str(e))
+            else:
+                yield hand
+
+    def parseInPool(self, handTexts, pool, poolSize, db = None, columnar = False):
+        """Generator of Hand.HandRows for handTexts, parsed PARSE_BATCH_SIZE hands at a
+time by the worker processes in pool, in the same order as handTexts.
+No more than two batches per worker are handed out ahead of the caller, so
+memory use doesn't grow with the size of the file. Hands that fail are
+quarantined in db, if it's given. If columnar is True the workers hand back
+Hand.BatchedHandRows, a batch at a time."""
+        pending = deque()
+        while True:
+            batch = list(itertools.islice(handTexts, self.PARSE_BATCH_SIZE))
+            if batch:
+                self.numHands += len(batch)
+                pending.append(pool.apply_async(parseHandTexts, (self.__class__, batch, columnar,
+                                                                 (self.inputNo, self.in_path, self.starsArchive))))
+                if len(pending) <= 2 * poolSize:
+                    continue
+            elif not pending:
+                break
+            (rows, failed) = pending.popleft().get()
+            self.numErrors += len(failed)
+            for (handText, error) in failed:
+                self.quarantineHand(db, handText, error)
+            for hand in rows:
+                yield hand
+
+    def quarantineHand(self, db, handText, error):
+        """\
+Keep handText, which failed to convert with error, in db's QuarantinedHands
+table along with where it is in in_path, so it can be converted again once the
+converter has been fixed (see Importer.retryQuarantine()) without importing the
+whole file again. Caller commits."""
+        if db is None or self.in_path == '-':
+            return
+        offset = self.findHandOffset(handText)
+        try:
+            db.storeQuarantinedHand(self.in_path, offset, self.__class__.__module__, error, handText)
+        except Exception:
+            log.exception("Unable to quarantine a hand from '%s'" % self.in_path)
+
+    def findHandOffset(self, handText):
+        """\
+Byte offset in in_path of the first line of handText, or -1 if it can't be found.
+Hands are handed to it in file order, so each search carries on from where the
+last one left off, going back to the start of the file once if it runs out.
+Only hands that fail are looked for, so good hands cost nothing."""
+        line = handText.lstrip().split('\n', 1)[0].rstrip()
+        if not line:
+            return -1
+        kodec = getattr(self, 'kodec', None) or self.__listof(self.codepage)[0]
+        try:
+            needle = line.encode(kodec)[len(u''.encode(kodec)):]
+        except UnicodeError:
+            return -1
+        for start in (self.offsetSearchPos, 0):
+            offset = self.searchHandHistory(needle, start)
+            if offset >= 0:
+                self.offsetSearchPos = offset + len(needle)
+                return offset
+            if start == 0:
+                break
+        return -1
+
+    def searchHandHistory(self, needle, start):
+        """Byte offset of the first needle in in_path at or after start, or -1"""
+        (in_fh, size) = openHandHistory(self.in_path)
+        try:
+            try:
+                in_fh.seek(start)
+                pos = start
+            except IOError:     # a zip archive member, which can only be read forward
+                pos = 0
+                while pos < start:
+                    data = in_fh.read(min(self.READ_BULK_SIZE, start - pos))
+                    if not data:
+                        return -1
+                    pos += len(data)
+            carry = ''      # the end of the last block, in case needle straddles two
+            while True:
+                data = in_fh.read(self.READ_BULK_SIZE)
+                if not data:
+                    return -1
+                base = pos - len(carry)
+                pos += len(data)
+                data = carry + data
+                i = data.find(needle)
+                if i >= 0:
+                    return base + i
+                carry = data[len(data) - len(needle) + 1:]
+        finally:
+            in_fh.close()
+
+    def dropKnownHands(self, handTexts, db):
+        """Generator of the handTexts which aren't already in db.
+Only the header of each hand is read (readGameType() and readHandNo()),
+and the hand numbers are looked up KNOWN_BATCH_SIZE at a time, so re-importing
+hands costs little more than reading them. Hands which can't be numbered this
+way are passed on, for Hand.insert() to check as before."""
+        siteId = Hand.Hand.SITEIDS[self.sitename]
+        while True:
+            batch = list(itertools.islice(handTexts, self.KNOWN_BATCH_SIZE))
+            if not batch:
+                break
+            headers = []
+            games = {}      # gametype key: (gametype, siteHandNos)
+            for handText in batch:
+                try:
+                    gametype = self.readGameType(handText)
+                    hid = self.readHandNo(handText)
+                except FpdbParseError:
+                    gametype = hid = None
+                if gametype is None or hid is None:
+                    headers.append(None)
+                    continue
+                key = (gametype['type'], gametype['category'], gametype['limitType'], gametype['sb'], gametype['bb'])
+                games.setdefault(key, (gametype, []))[1].append(hid)
+                headers.append((key, hid))
+            known = {}
+            for (key, (gametype, hids)) in games.iteritems():
+                known[key] = db.getKnownHands(siteId, gametype, hids)
+            for (handText, header) in zip(batch, headers):
+                if header is not None and header[1] in known[header[0]]:
+                    self.numDuplicates += 1
+                    log.debug("hid #: %s is already in the database" % header[1])
+                else:
+                    yield handText
 
     def tailHands(self):
         """Generator of handTexts from a tailed file:
@@ -182,79 +408,179 @@ which it expects to find at self.re_TailSplitHands -- see for e.g. Everleaf.py.
 """
         if self.in_path == '-':
             raise StopIteration
-        interval = 1.0 # seconds to sleep between reads for new data
-        fd = codecs.open(self.in_path,'r', self.codepage)
-        data = ''
-        while 1:
-            where = fd.tell()
-            newdata = fd.read(self.READ_CHUNK_SIZE)
-            if not newdata:
+        for handText in self.tailHandTexts(self.tailChunks()):
+            yield handText
+
+    def tailChunks(self):
+        """\
+Generator of chunks of decoded text from in_path, waiting for more at the end
+of the file for ever. The wait between looks for more starts at TAIL_MIN_SLEEP
+and doubles each time there isn't any, up to TAIL_MAX_SLEEP, so a hand is
+picked up soon after it's written without polling an idle file all the time.
+If in_path is replaced by another file, reading goes on in that one at the
+same byte offset."""
+        kodec = self.findCodepage()
+        self.kodec = kodec
+        decoder = codecs.getincrementaldecoder(kodec)()
+        fd = open(self.in_path, 'rb')
+        interval = self.TAIL_MIN_SLEEP
+        pos = 0
+        try:
+            while True:
+                data = fd.read(self.READ_CHUNK_SIZE)
+                if data:
+                    pos += len(data)
+                    interval = self.TAIL_MIN_SLEEP
+                    (decoder, chunk) = self.decodeBytes(decoder, data)
+                    if chunk:
+                        yield chunk
+                    continue
                 fd_results = os.fstat(fd.fileno())
                 try:
                     st_results = os.stat(self.in_path)
                 except OSError:
                     st_results = fd_results
-                if st_results[1] == fd_results[1]:
+                if st_results.st_ino == fd_results.st_ino:
                     time.sleep(interval)
-                    fd.seek(where)
+                    interval = min(interval * 2, self.TAIL_MAX_SLEEP)
                 else:
-                    log.debug("%s changed inode numbers from %d to %d" % (self.in_path, fd_results[1], st_results[1]))
-                    fd = codecs.open(self.in_path, 'r', self.codepage)
-                    fd.seek(where)
-            else:
-                # yield hands
-                data = data + newdata
-                result = self.re_TailSplitHands.split(data)
-                result = iter(result)
-                data = ''
-                # --x       data (- is bit of splitter, x is paragraph)     yield,...,keep
-                # [,--,x]    result of re.split (with group around splitter)
-                # ,x        our output: yield nothing, keep x
-                #
-                # --x--x    [,--,x,--,x]  x,x
-                # -x--x     [-x,--,x]     x,x
-                # x-        [x-]          ,x-
-                # x--       [x,--,]       x,--
-                # x--x      [x,--,x]      x,x
-                # x--x--    [x,--,x,--,]  x,x,--
-
-                # The length is always odd.
-                # 'odd' indices are always splitters.
-                # 'even' indices are always paragraphs or ''
-                # We want to discard all the ''
-                # We want to discard splitters unless the final item is '' (because the splitter could grow with new data)
-                # We want to yield all paragraphs followed by a splitter, i.e. all even indices except the last.
-                for para in result:
-                    try:
-                        result.next()
-                        splitter = True
-                    except StopIteration:
-                        splitter = False
-                    if splitter: # para is followed by a splitter
-                        if para: yield para # para not ''
-                    else:
-                        data = para # keep final partial paragraph
+                    log.debug("%s changed inode numbers from %d to %d" % (self.in_path, fd_results.st_ino, st_results.st_ino))
+                    fd.close()
+                    fd = open(self.in_path, 'rb')
+                fd.seek(pos)    # clears EOF, so that read() sees what's been added since
+        finally:
+            fd.close()
 
+    def tailHandTexts(self, chunks):
+        """\
+Generator of the handTexts in an iterable of chunks of text, each one yielded
+as soon as there's a splitter (self.re_TailSplitHands) after it. Only text
+which hasn't been yielded is kept, and each chunk is searched for splitters
+along with the last TAIL_CARRY characters before it (which could be the start
+of a splitter) rather than the whole of the hand it's part of."""
+        buf = u''       # text after the last splitter found, or a splitter which could still grow
+        scan = 0        # where in buf to look for splitters from
+        for chunk in chunks:
+            buf += chunk
+            pos = 0
+            scanned = len(buf)
+            for m in self.re_TailSplitHands.finditer(buf, scan):
+                if m.end() == m.start():
+                    continue
+                if m.start() > pos:
+                    yield buf[pos:m.start()]
+                if m.end() == len(buf):
+                    pos = scanned = m.start()   # keep the splitter, in case there's more of it to come
+                    break
+                pos = m.end()
+            buf = buf[pos:]
+            scan = max(0, min(scanned - pos, len(buf) - self.TAIL_CARRY))
 
     def allHandsAsList(self):
         """Return a list of handtexts in the file at self.in_path"""
-        #TODO : any need for this to be generator? e.g. stars support can email one huge file of all hands in a year. Better to read bit by bit than all at once.
-        self.readFile()
-        self.obs = self.obs.strip()
-        self.obs = self.obs.replace('\r\n', '\n')
+        return list(self.allHandsAsIter())
+
+    def allHandsAsIter(self):
+        """Generator of handtexts in the file at self.in_path.
+The file is read READ_BULK_SIZE at a time, so memory use is bounded by the
+size of a hand rather than by the size of the file (stars can email one huge
+file of all hands in a year)."""
+        for handText in self.handTextsFromChunks(self.readChunks()):
+            yield handText
+
+    def handTextsFromChunks(self, chunks):
+        """Generator of handtexts from an iterable of chunks of decoded text.
+Does the same clean up that used to be done on the whole file (strip,
+'\\r\\n' to '\\n', starsArchive headers), but on complete lines only, and then
+splits on re_SplitHands. A splitter at the very end of the buffer is left
+alone until more text turns up, as it could still grow.
+If the text doesn't end with a splitter the last hand may still be being
+written: with holdLastHand, and if the file was written to in the last
+HOLD_SECONDS, it isn't yielded and self.index is moved back to the start of it
+once the chunks run out, so it's read again in full next time. Otherwise it's
+yielded like any other hand."""
+        self.heldLastHand = False
         if self.starsArchive == True:
             log.debug("Converting starsArchive format to readable")
-            m = re.compile('^Hand #\d+', re.MULTILINE)
-            self.obs = m.sub('', self.obs)
-
-        if self.obs is None or self.obs == "":
-            log.info("Read no hands.")
-            return []
-        return re.split(self.re_SplitHands,  self.obs)
+            re_Archive = re.compile('^Hand #\d+', re.MULTILINE)
+
+        def clean(text, first):
+            if first:
+                text = text.lstrip()
+            text = text.replace('\r\n', '\n')
+            if self.starsArchive == True:
+                text = re_Archive.sub('', text)
+            return text
+
+        def rawLines(raw, text):
+            # clean() keeps line ends, so the raw text of the last lines of
+            # buf can be found by counting newlines back from the end
+            cut = len(raw)
+            for i in xrange(text.count('\n') + 1):
+                cut = raw.rfind('\n', 0, cut)
+                if cut < 0:
+                    return raw
+            return raw[cut + 1:]
+
+        partial = u''   # incomplete last line of the text read so far
+        buf = u''       # complete lines which haven't been split off as hands yet
+        raw = u''       # the uncleaned text of buf + partial
+        for chunk in chunks:
+            partial += chunk
+            raw += chunk
+            cut = partial.rfind('\n') + 1
+            if cut == 0:
+                continue
+            buf += clean(partial[:cut], buf == '')
+            partial = partial[cut:]
+
+            pos = 0
+            for m in self.re_SplitHands.finditer(buf):
+                if m.end() == len(buf):
+                    break
+                if m.end() == m.start():
+                    continue    # re.split() never splits on an empty match
+                yield buf[pos:m.start()]
+                pos = m.end()
+            if pos:
+                buf = buf[pos:]
+                raw = rawLines(raw, buf + partial)
+
+        buf = buf + clean(partial, buf == '')
+        end = 0
+        for m in self.re_SplitHands.finditer(buf):
+            if m.end() > m.start():
+                end = m.end()
+        if buf[end:].strip() != '' and self.holdLastHand and self.isBeingWritten():
+            self.index -= self.byteLength(rawLines(raw, buf[end:]))
+            self.heldLastHand = True
+            buf = buf[:end]
+
+        buf = buf.rstrip()
+        if buf == '':
+            if self.numHands == 0:
+                log.info("Read no hands.")
+            return
+        pos = 0
+        for m in self.re_SplitHands.finditer(buf):
+            if m.end() == m.start():
+                continue
+            yield buf[pos:m.start()]
+            pos = m.end()
+        yield buf[pos:]
+
+    def isBeingWritten(self):
+        "True if in_path was written to less than HOLD_SECONDS ago"
+        if self.in_path == '-':
+            return False
+        try:
+            return time.time() - statHandHistory(self.in_path).st_mtime < self.HOLD_SECONDS
+        except OSError:
+            return False
 
     def processHand(self, handText):
-        gametype = self.determineGameType(handText)
-        log.debug("gametype %s" % gametype)
+        gametype = self.readGameType(handText)
+        log.debug("gametype %s", gametype)
         hand = None
         l = None
         if gametype is None:
@@ -263,11 +589,8 @@ which it expects to find at self.re_TailSplitHands -- see for e.g. Everleaf.py.
             # TODO: Need to count failed hands.
         else:
             # See if gametype is supported.
-            type = gametype['type']
-            base = gametype['base']
-            limit = gametype['limitType']
-            l = [type] + [base] + [limit]
-        if l in self.readSupportedGames():
+            l = (gametype['type'], gametype['base'], gametype['limitType'])
+        if l in self.supportedGames:
             if gametype['base'] == 'hold':
                 log.debug("hand = Hand.HoldemOmahaHand(self, self.sitename, gametype, handtext)")
                 hand = Hand.HoldemOmahaHand(self.config, self, self.sitename, gametype, handText)
@@ -287,6 +610,27 @@ which it expects to find at self.re_TailSplitHands -- see for e.g. Everleaf.py.
             # From the log we can deduce that it is the hand after the one before :)
 
 
+    def readGameType(self, handText):
+        """\
+determineGameType(handText), remembered by the KEY of re_GameTypeKey so that
+hands from the same table don't each run the site's whole re_GameInfo to get
+the same answer. A new dict is returned each time, as hands change theirs."""
+        m = None
+        if self.re_GameTypeKey is not None:
+            m = self.re_GameTypeKey.match(handText)
+        if m is None:
+            return self.determineGameType(handText)
+        key = m.group('KEY')
+        items = self.gametypeCache.get(key)
+        if items is None:
+            gametype = self.determineGameType(handText)
+            if gametype is None:
+                return None
+            if len(self.gametypeCache) >= self.GAMETYPE_CACHE_SIZE:
+                self.gametypeCache.clear()
+            items = self.gametypeCache[key] = tuple(gametype.iteritems())
+        return dict(items)
+
     # These functions are parse actions that may be overridden by the inheriting class
     # This function should return a list of lists looking like:
     # return [["ring", "hold", "nl"], ["tour", "hold", "nl"]]
@@ -323,11 +667,37 @@ or None if we fail to get the info """
     # BUTTON    button seat number
     def readHandInfo(self, hand): abstract
 
+    # The site's hand number of handText, from its header alone. Returns None if the
+    # converter can't tell, and then dropKnownHands() leaves the hand to be parsed.
+    def readHandNo(self, handText): return None
+
     # Needs to return a list of lists in the format
     # [['seat#', 'player1name', 'stacksize'] ['seat#', 'player2name', 'stacksize'] [...]]
     def readPlayerStacks(self, hand): abstract
 
-    def compilePlayerRegexs(self): abstract
+    # Compiles the regexs that match the names in hand.players into re_ attributes of self,
+    # unless hand.players <= self.compiledPlayers. Called through loadPlayerRegexs()
+    def compilePlayerRegexs(self, hand): abstract
+
+    def loadPlayerRegexs(self, hand):
+        """Make sure the player regexs match everyone in hand.players.
+Reuses the current regexs if they already do, otherwise takes them from
+playerRegexCache, and only calls compilePlayerRegexs() if they aren't there either."""
+        players = frozenset([player[1] for player in hand.players])
+        currency = hand.gametype['currency']
+        if players <= self.compiledPlayers and currency == self.compiledCurrency:
+            return
+        key = (self.__class__, players, currency)
+        regexs = playerRegexCache.get(key)
+        if regexs is None:
+            self.compiledPlayers = set()
+            self.compilePlayerRegexs(hand)
+            regexs = dict([(name, value) for (name, value) in self.__dict__.iteritems() if name.startswith('re_')])
+            playerRegexCache.put(key, regexs)
+        else:
+            self.__dict__.update(regexs)
+        self.compiledPlayers = players
+        self.compiledCurrency = currency
     """Compile dynamic regexes -- these explicitly match known player names and must be updated if a new player joins"""
 
     # Needs to return a MatchObject with group names identifying the streets into the Hand object
@@ -418,28 +788,121 @@ or None if we fail to get the info """
         """Open in_path according to self.codepage. Exceptions caught further up"""
 
         if self.filetype == "text":
-            if self.in_path == '-':
-                # read from stdin
-                log.debug("Reading stdin with %s" % self.codepage) # is this necessary? or possible? or what?
-                in_fh = codecs.getreader('cp1252')(sys.stdin)
-            else:
-                for kodec in self.__listof(self.codepage):
-                    #print "trying", kodec
-                    try:
-                        in_fh = codecs.open(self.in_path, 'r', kodec)
-                        whole_file = in_fh.read()
-                        self.obs = whole_file[self.index:]
-                        self.index = len(whole_file)
-                        in_fh.close()
-                        break
-                    except:
-                        pass
-                else:
-                    print "unable to read file with any codec in list!", self.in_path
+            self.obs = u''.join(self.readChunks())     # readChunks() reads stdin for '-'
         elif self.filetype == "xml":
             doc = xml.dom.minidom.parse(filename)
             self.doc = doc
 
+    def findCodepage(self):
+        """\
+Return the codec in self.codepage to read in_path with, raising FpdbParseError
+if none of them can. It's worked out once per file from the BOM and the first CODEPAGE_PROBE_SIZE
+bytes (see sniffCodepage()) and kept in codepageCache, so later reads of the
+file (the next auto-import, or tailing it) go straight to it."""
+        kodecs = self.__listof(self.codepage)
+        if len(kodecs) == 1:
+            self.codepageSettled = True
+            return kodecs[0]
+        ino = statHandHistory(self.in_path).st_ino
+        cached = codepageCache.get(self.in_path)
+        if cached is not None and cached[0] == ino and cached[1] in kodecs and cached[2]:
+            self.codepageSettled = True
+            return cached[1]
+        (in_fh, size) = openHandHistory(self.in_path)
+        try:
+            (kodec, self.codepageSettled) = sniffCodepage(in_fh.read(self.CODEPAGE_PROBE_SIZE), kodecs, self.CODEPAGE_PROBE_SIZE)
+        finally:
+            in_fh.close()
+        if kodec is None:
+            log.error("Unable to read '%s' with any codec in %s" % (self.in_path, kodecs))
+            raise FpdbParseError("Unable to read '%s' with any codec in %s" % (self.in_path, kodecs))
+        codepageCache[self.in_path] = (ino, kodec, self.codepageSettled)
+        return kodec
+
+    def decodeBytes(self, decoder, data):
+        """\
+Returns (decoder, decoder.decode(data)), unless self.kodec was only a guess from
+text which any of self.codepage could decode (see sniffCodepage()) and data
+shows it was wrong. Then the next codec which can decode data becomes
+self.kodec, and a decoder for it is returned. The text before data was plain
+ascii, so it's the same whichever codec it was decoded with."""
+        state = decoder.getstate()
+        try:
+            return (decoder, decoder.decode(data))
+        except UnicodeDecodeError:
+            if self.codepageSettled:
+                raise
+        kodecs = self.__listof(self.codepage)
+        for kodec in kodecs[kodecs.index(self.kodec) + 1:]:
+            newDecoder = codecs.getincrementaldecoder(kodec)()
+            try:
+                text = newDecoder.decode(state[0] + data)
+            except UnicodeDecodeError:
+                continue
+            log.info("%s isn't %s, reading it as %s" % (self.in_path, self.kodec, kodec))
+            self.kodec = kodec
+            self.codepageSettled = True
+            codepageCache[self.in_path] = (statHandHistory(self.in_path).st_ino, kodec, True)
+            return (newDecoder, text)
+        raise
+
+    def readChunks(self):
+        """Generator of chunks of decoded text from in_path, starting at byte self.index.
+The file is seek()ed to self.index, so only the bytes after it are read and decoded.
+self.index is set to the size of the file in bytes once it has all been read.
+Compressed files are decompressed as they're read (see openHandHistory()), and
+self.index counts uncompressed bytes."""
+        if self.in_path == '-':
+            log.debug("Reading stdin with %s" % self.codepage)
+            in_fh = codecs.getreader('cp1252')(sys.stdin)
+            for chunk in iter(lambda: in_fh.read(self.READ_BULK_SIZE), u''):
+                yield chunk
+            return
+
+        kodec = self.findCodepage()
+        self.kodec = kodec
+        decoder = codecs.getincrementaldecoder(kodec)()
+        (in_fh, size) = openHandHistory(self.in_path)
+        try:
+            if size is not None and self.index > size:
+                log.warning("%s is shorter than it was, reading it from the start" % self.in_path)
+                self.index = 0
+            if self.index > 0:
+                # let the decoder see any BOM, so that utf-16 knows the byte order
+                head = in_fh.read(4)
+                for bom in (codecs.BOM_UTF8, codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+                    if head.startswith(bom):
+                        decoder.decode(bom)
+                        break
+                try:
+                    in_fh.seek(self.index)
+                except IOError:     # a zip archive member, which can only be read up to index
+                    left = self.index - len(head)
+                    while left > 0:
+                        data = in_fh.read(min(self.READ_BULK_SIZE, left))
+                        if not data:
+                            break
+                        left -= len(data)
+            pos = self.index
+            while True:
+                data = in_fh.read(self.READ_BULK_SIZE)
+                if not data:
+                    break
+                pos += len(data)
+                (decoder, chunk) = self.decodeBytes(decoder, data)
+                if chunk:
+                    yield chunk
+            chunk = decoder.decode('', True)
+            if chunk:
+                yield chunk
+            self.index = pos
+        finally:
+            in_fh.close()
+
+    def byteLength(self, text):
+        """Number of bytes text took up in the file, as decoded by readChunks()"""
+        return len(text.encode(self.kodec)) - len(u''.encode(self.kodec))
+
     def guessMaxSeats(self, hand):
         """Return a guess at maxseats when not specified in HH."""
         # if some other code prior to this has already set it, return it
@@ -479,6 +942,7 @@ or None if we fail to get the info """
         return self.out_path
 
     def getLastCharacterRead(self):
+        """Byte offset in in_path of the end of the last complete hand read"""
         return self.index
 
     def isSummary(self, topline):
@@ -503,6 +967,80 @@ or None if we fail to get the info """
 
 
 
+class PlayerRegexCache:
+    """Bounded LRU cache of the player regexs compiled by converters, keyed by
+(converter class, frozenset of player names, currency). Shared by all
+converter instances, so tables that come and go in a file, and files that
+are imported over and over, don't keep recompiling the same regexs."""
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        regexs = self.entries.pop(key, None)
+        if regexs is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries[key] = regexs     # now the most recently used
+        return regexs
+
+    def put(self, key, regexs):
+        self.entries[key] = regexs
+        if len(self.entries) > self.size:
+            self.entries.popitem(last = False)
+
+    def __str__(self):
+        return "player regex cache: %d hits, %d misses, %d entries" % (self.hits, self.misses, len(self.entries))
+
+playerRegexCache = PlayerRegexCache(256)
+
+inputCount = itertools.count()  # numbers setInput() gives each file a converter is set to
+
+parseConfig = None      # Config of a parse worker process, see initParseWorker()
+parseConverters = {}    # converters of a parse worker process by class
+parseInputs = {}        # class: inputNo of the file its converter was last set to
+
+def initParseWorker(configFile):
+    "Initialiser for the worker processes of pools passed to HandHistoryConverter.iterHands()"
+    global parseConfig
+    parseConfig = Configuration.Config(file = configFile)
+
+def parseHandTexts(hhcClass, handTexts, columnar = False, source = (None, '-', False)):
+    """Runs in a parse worker process: converts handTexts with a hhcClass converter.
+source is (inputNo, in_path, starsArchive) of the converter the hands were read
+by; the worker's converter is setInput() to each new file, so nothing a
+converter keeps for a file is carried over to the next.
+Returns (list of Hand.HandRows, or None for unsupported games,
+list of (handText, error) of the hands that failed).
+If columnar is True, the rows are Hand.BatchedHandRows of a single batch."""
+    if hhcClass not in parseConverters:
+        parseConverters[hhcClass] = hhcClass(parseConfig, autostart = False)
+    hhc = parseConverters[hhcClass]
+    (inputNo, in_path, starsArchive) = source
+    if parseInputs.get(hhcClass) != inputNo:
+        hhc.setInput(in_path, starsArchive = starsArchive)
+        parseInputs[hhcClass] = inputNo
+    failed = []
+    def convert():
+        for handText in handTexts:
+            try:
+                hand = hhc.processHand(handText)
+            except FpdbParseError, e:
+                failed.append((handText, str(e)))
+                log.warning("Failed to convert hand %s" % e.hid)
+                log.warning("Exception msg: '%s'" % str(e))
+                log.debug(handText)
+            else:
+                yield hand
+    if columnar:
+        rows = list(Hand.batchRows(convert(), len(handTexts)))
+    else:
+        rows = [hand if hand is None else Hand.HandRows(hand) for hand in convert()]
+    return (rows, failed)
+
 def getTableTitleRe(config, sitename, *args, **kwargs):
     "Returns string to search in windows titles for current site"
     return getSiteHhc(config, sitename).getTableTitleRe(*args, **kwargs)
@@ -532,3 +1070,88 @@ def get_out_fh(out_path, parameters):
             log.error("out_path %s couldn't be opened" % (out_path)) 
     else:
         return(sys.stdout)
+
+# Hand histories can be read straight out of .gz and .bz2 files, and out of zip
+# archives. Each file in a zip archive is imported on its own, under the path
+# of the archive joined with its name in the archive (see zipMembers()).
+
+def zipMembers(path):
+    """Paths of the files in the zip archive at path, to import each of them by"""
+    zf = zipfile.ZipFile(path)
+    try:
+        return [os.path.join(path, info.filename) for info in zf.infolist() if not info.filename.endswith('/')]
+    finally:
+        zf.close()
+
+def splitZipPath(path):
+    """(archive, name in archive) of a path made by zipMembers(), or None for any other path"""
+    start = 0
+    while True:
+        i = path.lower().find('.zip' + os.sep, start)
+        if i < 0:
+            return None
+        if os.path.isfile(path[:i + 4]):
+            return (path[:i + 4], path[i + 5:].replace(os.sep, '/'))
+        start = i + 1
+
+def statHandHistory(path):
+    """os.stat() of the hand history file at path, or of the zip archive it's in"""
+    member = splitZipPath(path)
+    if member is not None:
+        return os.stat(member[0])
+    return os.stat(path)
+
+def handHistoryExists(path):
+    return os.path.exists(path) or splitZipPath(path) is not None
+
+def openHandHistory(path):
+    """\
+Opens the hand history file at path for reading bytes, decompressing it if
+it's a .gz or .bz2 file or is in a zip archive. Returns (file, size), size
+being the uncompressed size in bytes, or None if it can't be known without
+reading the whole file."""
+    member = splitZipPath(path)
+    if member is not None:
+        zf = zipfile.ZipFile(member[0])
+        try:
+            return (zf.open(member[1]), zf.getinfo(member[1]).file_size)
+        finally:
+            zf.close()      # the member stays open on its own file handle
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.gz':
+        return (gzip.GzipFile(path, 'rb'), None)
+    if ext == '.bz2':
+        return (bz2.BZ2File(path, 'rb'), None)
+    in_fh = open(path, 'rb')
+    return (in_fh, os.fstat(in_fh.fileno()).st_size)
+
+# in_path: (inode, codec, settled) as worked out by HandHistoryConverter.findCodepage()
+codepageCache = {}
+
+def sniffCodepage(head, kodecs, size):
+    """\
+Which of the codecs kodecs to read a file starting with the bytes head with
+(at most size of them; fewer if that's the whole file). Goes by the BOM if there
+is one, otherwise it's the first which can decode head; utf-16 only if head has
+NULs in it, as any even number of bytes decodes as utf-16. Returns (codec, settled)
+or (None, True). settled is False if head was plain ascii, so that a later codec
+could still turn out to be the one the rest of the file (or what's yet to be
+written to it) needs."""
+    names = [codecs.lookup(kodec).name for kodec in kodecs]
+    for (bom, name) in ((codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')):
+        if head.startswith(bom) and name in names:
+            return (kodecs[names.index(name)], True)
+    ascii = True
+    try:
+        head.decode('ascii')
+    except UnicodeDecodeError:
+        ascii = False
+    for (kodec, name) in zip(kodecs, names):
+        if name.startswith('utf-16') and '\0' not in head:
+            continue
+        try:
+            codecs.getincrementaldecoder(kodec)().decode(head, len(head) < size)
+        except UnicodeDecodeError:
+            continue
+        return (kodec, not ascii or kodec == kodecs[-1])
+    return (None, True)
@@ -98,11 +98,10 @@ class PartyPoker(HandHistoryConverter):
                     'of the previous hand left the table', re.MULTILINE)
 
 
-    def allHandsAsList(self):
-        list = HandHistoryConverter.allHandsAsList(self)
-        if list is None:
-            return []
-        return filter(lambda text: len(text.strip()), list)
+    def allHandsAsIter(self):
+        for text in HandHistoryConverter.allHandsAsIter(self):
+            if len(text.strip()):
+                yield text
 
     def guessMaxSeats(self, hand):
         """Return a guess at max_seats when not specified in HH."""
@@ -162,9 +161,11 @@ class PartyPoker(HandHistoryConverter):
                 ["tour", "hold", "fl"],
                ]
 
+    def setInput(self, *args, **kwargs):
+        self._gameType = None   # a file's hands all share one gametype
+        HandHistoryConverter.setInput(self, *args, **kwargs)
+
     def _getGameType(self, handText):
-        if not hasattr(self, '_gameType'):
-            self._gameType = None
         if self._gameType is None:
             # let's determine whether hand is trny
             # and whether 5-th line contains head line
@@ -259,10 +260,11 @@ class PartyPoker(HandHistoryConverter):
                     self.totalpot = self.pot.total
                 for i,v in enumerate(self.collected):
                     if v[0] in self.pot.returned:
-                        self.collected[i][1] = Decimal(v[1]) - self.pot.returned[v[0]]
+                        self.collected[i][1] = v[1] - self.pot.returned[v[0]]
                         self.collectees[v[0]] -= self.pot.returned[v[0]]
                 return origTotalPot()
             return totalPot
+        hand.pot.lean = False   # totalPot() needs pot.returned, even for lean hands
         instancemethod = type(hand.totalPot)
         hand.totalPot = instancemethod(getNewTotalPot(hand.totalPot), hand, HoldemOmahaHand)
 
@@ -423,7 +425,7 @@ class PartyPoker(HandHistoryConverter):
                 Bp = hand.lastBet[street]
                 if Bp == 0:
                     actionType = 'bets'
-                elif Bp < Decimal(amount):
+                elif Bp < Hand.toCents(amount):
                     actionType = 'raises'
                 else:
                     actionType = 'calls'
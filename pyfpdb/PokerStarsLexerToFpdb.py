@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Copyright 2008, Carl Gherardi
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+########################################################################
+
+from PokerStarsToFpdb import *
+
+# PokerStars HH Format, read a line at a time.
+# To use it instead of PokerStarsToFpdb, set converter="PokerStarsLexerToFpdb"
+# for PokerStars in the <site> and <hhc> entries of HUD_config.xml
+
+# the characters re's \s stands for (a line has no '\n' left in it)
+SPACE = u' \t\r\f\v'
+
+def cardsAt(line, start, n):
+    """\
+True if line has n cards, as re's "\S\S \S\S ..." would match them, at start."""
+    cards = line[start:start + 3 * n - 1]
+    words = cards.split(u' ')
+    return len(cards) == 3 * n - 1 and cards.split() == words and len(words) == n \
+           and [w for w in words if len(w) == 2] == words
+
+class PokerStarsLexer(PokerStars):
+    """\
+PokerStars converter which reads the body of each hand in one pass over its
+lines, instead of searching the whole hand once for each regex. lexHand() tells
+each line apart by how it starts (seat, post, street marker, dealt cards,
+action, showdown or summary line), cuts it into its fields with string methods
+and files them by street; the read methods then hand those to the Hand. It
+takes the lines the PokerStars regexs would match, with the same fields, and
+a hand with anything it isn't sure of is read with the regexs instead.
+The two header lines are still read by PokerStars.readHandInfo() and
+readButton()."""
+
+    currencySymbols = {'USD': u'$', 'CAD': u'$', 'T$': u'', 'EUR': u'€', 'GBP': u'\xa3'}
+    stackSymbols = (u'$', u'€')
+
+    # street markers of each base, in order: (street, marker, where the street's text starts)
+    streetMarkers = {
+        'hold': (('PREFLOP', u'*** HOLE CARDS ***', 18), ('FLOP', u'*** FLOP ***', 12),
+                 ('TURN', u'*** TURN ***', 24), ('RIVER', u'*** RIVER ***', 28)),
+        'stud': (('THIRD', u'*** 3rd STREET ***', 18), ('FOURTH', u'*** 4th STREET ***', 18),
+                 ('FIFTH', u'*** 5th STREET ***', 18), ('SIXTH', u'*** 6th STREET ***', 18),
+                 ('SEVENTH', u'*** RIVER ***', 13)),
+        'draw': (('DEAL', u'*** DEALING HANDS ***', 21), ('DRAWONE', u'*** FIRST DRAW ***', 18),
+                 ('DRAWTWO', u'*** SECOND DRAW ***', 19), ('DRAWTHREE', u'*** THIRD DRAW ***', 18)),
+    }
+    # the street of the text before the first marker, where there is one
+    firstStreets = {'hold': None, 'stud': 'ANTES', 'draw': 'PREDEAL'}
+    # what markStreets' regex wants after the hold'em markers which deal cards:
+    # (offset, text) for literal text and (offset, n) for n cards
+    boardLayouts = {
+        'FLOP':  ((12, u' ['), (14, 3), (22, u']')),
+        'TURN':  ((12, u' ['), (14, 3), (22, u'] ['), (25, 1), (27, u']')),
+        'RIVER': ((13, u' ['), (15, 4), (26, u'] ['), (29, 1), (31, u']')),
+    }
+    posts = ((u'posts small blind ', 'small blind'), (u'posts big blind ', 'big blind'),
+             (u'posts small & big blinds ', 'both'), (u'posts the ante ', 'ante'))
+    actionTypes = (u'bets', u'checks', u'raises', u'calls', u'folds', u'discards', u'stands pat')
+    positions = (u'(button) (small blind) ', u'(button) ', u'(small blind) ', u'(big blind) ')
+
+    re_Amount = re.compile(u'[.0-9]+')
+
+    def __init__(self, *args, **kwargs):
+        self.lexed = None
+        self.lexedHand = None
+        PokerStars.__init__(self, *args, **kwargs)
+
+    def lexHand(self, hand):
+        """\
+Reads the lines of hand.handText, and returns what the read methods need from
+them as a dict, or None if the hand has to be read with the regexs."""
+        text = hand.handText
+        base = hand.gametype['base']
+        cur = self.currencySymbols.get(hand.gametype['currency'])
+        if cur is None or base not in self.streetMarkers:
+            return None
+        markers = self.streetMarkers[base]
+        street = self.firstStreets[base]
+        seats, names, found = [], set(), []
+        posts = dict([(kind, []) for (prefix, kind) in self.posts])
+        bringins, shows, collects, shown = [], [], [], []
+        actions, dealt = {street: []}, {street: []}
+        pos = 0
+        for line in text.split(u'\n'):
+            start = pos
+            pos += len(line) + 1
+            if line.startswith(u'*** '):
+                for (name, marker, offset) in markers:
+                    if line.startswith(marker):
+                        if pos > len(text):
+                            return None     # nothing after the marker
+                        found.append((name, start, start + offset, line))
+                        street = name
+                        actions[street], dealt[street] = [], []
+                        break
+            elif line.startswith(u'Seat '):
+                colon = line.find(u': ', 5)
+                if colon < 0 or not line[5:colon].isdigit():
+                    continue
+                end = line.rfind(u' in chips)')
+                if end < 0:
+                    self.lexSummary(line[colon + 2:], names, cur, collects, shown)
+                    continue
+                cut = line.rfind(u' (', colon + 2, end)
+                cash = line[cut + 2:end]
+                if cash[:1] in self.stackSymbols:
+                    cash = cash[1:]
+                m = self.re_Amount.match(cash)
+                if found or cut < 0 or m is None or m.end() != len(cash):
+                    return None
+                seats.append((int(line[5:colon]), line[colon + 2:cut], cash))
+                names.add(line[colon + 2:cut])
+            elif line.startswith(u'Dealt to '):
+                cards = self.lexDealt(line[9:], names)
+                if cards is not None and street is not None:
+                    dealt[street].append(cards)
+            else:
+                colon = line.find(u': ')
+                while colon >= 0 and line[:colon] not in names:
+                    colon = line.find(u': ', colon + 1)
+                if colon < 0:
+                    continue
+                name, tail = line[:colon], line[colon + 2:]
+                if tail.startswith(u'posts '):
+                    for (prefix, kind) in self.posts:
+                        if tail.startswith(prefix + cur):
+                            m = self.re_Amount.match(tail, len(prefix) + len(cur))
+                            if m:
+                                posts[kind].append((name, m.group()))
+                            break
+                elif tail.startswith(u'brings') and tail[6:7] in (u'-', u' ') and tail[7:9] == u'in':
+                    for prefix in (u' low for ', u' for '):
+                        if tail.startswith(prefix + cur, 9):
+                            m = self.re_Amount.match(tail, 9 + len(prefix) + len(cur))
+                            if m:
+                                bringins.append((name, m.group()))
+                            break
+                elif tail.startswith(u'shows ['):
+                    end = tail.rfind(u']')
+                    if end >= 7:
+                        shows.append((name, tail[7:end]))
+                else:
+                    for atype in self.actionTypes:
+                        if tail.startswith(atype):
+                            fields = self.lexActionTail(tail[len(atype):], cur)
+                            if fields is not None and street is not None:
+                                actions[street].append((atype, name) + fields)
+                            break
+        if [f[0] for f in found] != [marker[0] for marker in markers[:len(found)]]:
+            return None
+        for (name, marker, offset) in markers:
+            if text.count(marker) != len([f for f in found if f[0] == name]):
+                return None     # a marker the street regexs would see in some other line
+        streets, board = dict([(marker[0], None) for marker in markers]), {}
+        if street is None:
+            streets = None          # no HOLE CARDS: the hand is cancelled
+        elif self.firstStreets[base] is not None:
+            streets[self.firstStreets[base]] = (0, found[0][1] if found else len(text))
+        for (i, (name, start, textStart, line)) in enumerate(found):
+            if name in self.boardLayouts:
+                for (offset, what) in self.boardLayouts[name]:
+                    if not (cardsAt(line, offset, what) if isinstance(what, int) else line.startswith(what, offset)):
+                        return None
+                cards = line[textStart - start:]
+                board[name] = cards[cards.find(u'[') + 1:cards.rfind(u']')]
+            end = found[i + 1][1] if i + 1 < len(found) else len(text)
+            streets[name] = (textStart, end)
+        return {'seats': seats, 'streets': streets, 'board': board, 'posts': posts,
+                'bringins': bringins, 'dealt': dealt, 'actions': actions, 'shows': shows,
+                'collects': collects, 'shown': shown}
+
+    def lexDealt(self, rest, names):
+        """\
+(player, old cards, new cards) of a "Dealt to" line, as re_HeroCards would
+read it from rest (the line after "Dealt to "), or None."""
+        for name in sorted([n for n in names if rest.startswith(n + u' [')], key=len, reverse=True):
+            r = rest[len(name):]
+            old = r.find(u'] [', 3)
+            while old >= 0:
+                new = r.find(u']', old + 4)
+                if new >= 0:
+                    return (name, r[2:old], r[old + 3:new])
+                old = r.find(u'] [', old + 1)
+            new = r.find(u']', 3)
+            if new >= 0:
+                return (name, None, r[2:new])
+        return None
+
+    def lexActionTail(self, s, cur):
+        """\
+(BET, DISCARDED) of what follows the action in an action line, as re_Action
+would read them, or None if re_Action wouldn't take the line."""
+        bet = discarded = None
+        i = 0
+        if s[:1] and s[0] in SPACE:
+            j = 1 + len(cur) if s.startswith(cur, 1) else 1
+            m = self.re_Amount.match(s, j)
+            if m:
+                bet, i = m.group(), m.end()
+        if s[i:i + 1] and s[i] in SPACE and s.startswith(u'to', i + 1) and s[i + 3:i + 4] \
+           and s[i + 3] in SPACE and s.startswith(cur, i + 4):
+            m = self.re_Amount.match(s, i + 4 + len(cur))
+            if m:
+                i = m.end()
+        k = len(s) - len(s[i:].lstrip(SPACE))
+        allin = s.startswith(u'and', k) and s[k + 3:k + 4] and s[k + 3] in SPACE and s.startswith(u'is', k + 4) \
+                and s[k + 6:k + 7] and s[k + 6] in SPACE and s.startswith(u'all', k + 7) and s.startswith(u'in', k + 11)
+        r = s[k + 13:] if allin else s[i:]
+        if not r.strip(SPACE):
+            return (bet, discarded)
+        if allin and not (r[0] in SPACE and r.startswith(u'card', 1)):
+            return None
+        if not allin and not (r[0] in SPACE and r.lstrip(SPACE).startswith(u'card')):
+            return None
+        v = r.lstrip(SPACE)[4:] if not allin else r[5:]
+        if v.startswith(u's'):
+            v = v[1:]
+        w = v.rstrip(SPACE)
+        if not w:
+            return (bet, discarded)
+        if w[0] in SPACE and w[1:2] == u'[' and w.endswith(u']') and len(w) >= 4:
+            return (bet, w[2:-1])
+        return None
+
+    def lexSummary(self, rest, names, cur, collects, shown):
+        """\
+Adds the pot collected and the cards shown or mucked in a summary line (rest is
+the line after "Seat N: ") to collects and shown, as re_CollectPot and
+re_ShownCards would read them."""
+        for name in sorted([n for n in names if rest.startswith(n + u' ')], key=len, reverse=True):
+            r = rest[len(name) + 1:]
+            pot = self.lexCollect(r, cur)
+            if pot is not None:
+                collects.append((name, pot))
+                break
+        for name in sorted([n for n in names if rest.startswith(n + u' ')], key=len, reverse=True):
+            r = rest[len(name) + 1:]
+            cards = self.lexShown(r)
+            if cards is not None:
+                shown.append((name,) + cards)
+                break
+
+    def lexCollect(self, r, cur):
+        for position in self.positions + (u'',):
+            if not r.startswith(position):
+                continue
+            t = r[len(position):]
+            if t.startswith(u'collected ('):
+                starts = [len(u'collected (')]
+            elif t.startswith(u'showed ['):
+                starts, end = [], len(t)
+                while True:
+                    end = t.rfind(u'] and won (', 8, end)
+                    if end < 0:
+                        break
+                    starts.append(end + len(u'] and won ('))
+            else:
+                continue
+            for start in starts:
+                if t.startswith(cur, start):
+                    m = self.re_Amount.match(t, start + len(cur))
+                    if m and t[m.end():m.end() + 1] == u')':
+                        return m.group()
+        return None
+
+    def lexShown(self, r):
+        ends = [0]
+        if r.startswith(u'('):
+            ends, end = [], len(r)
+            while True:
+                end = r.rfind(u') ', 1, end)
+                if end < 0:
+                    break
+                ends.append(end + 2)
+        for start in ends:
+            for showed in (u'showed', u'mucked'):
+                if r.startswith(showed + u' [', start):
+                    end = r.rfind(u']')
+                    if end >= start + 8:
+                        return (r[start + 8:end], showed)
+        return None
+
+    def isLexed(self, hand):
+        return self.lexedHand is hand and self.lexed is not None
+
+    def readPlayerStacks(self, hand):
+        self.lexedHand, self.lexed = hand, self.lexHand(hand)
+        if not self.isLexed(hand):
+            log.debug("readPlayerStacks: reading hand %s with the regexs" % hand.handid)
+            return PokerStars.readPlayerStacks(self, hand)
+        for (seat, name, cash) in self.lexed['seats']:
+            hand.addPlayer(seat, name, cash)
+
+    def loadPlayerRegexs(self, hand):
+        if not self.isLexed(hand):
+            PokerStars.loadPlayerRegexs(self, hand)
+
+    def markStreets(self, hand):
+        if not self.isLexed(hand):
+            return PokerStars.markStreets(self, hand)
+        if self.lexed['streets'] is None:
+            return hand.addStreets(None)
+        for (street, span) in self.lexed['streets'].iteritems():
+            hand.streets[street] = None if span is None else hand.handText[span[0]:span[1]]
+        log.debug("markStreets:\n"+ str(hand.streets))
+
+    def readCommunityCards(self, hand, street):
+        if not self.isLexed(hand):
+            return PokerStars.readCommunityCards(self, hand, street)
+        if street in ('FLOP','TURN','RIVER'):
+            hand.setCommunityCards(street, self.lexed['board'][street].split(' '))
+
+    def readAntes(self, hand):
+        if not self.isLexed(hand):
+            return PokerStars.readAntes(self, hand)
+        for (player, ante) in self.lexed['posts']['ante']:
+            hand.addAnte(player, ante)
+
+    def readBringIn(self, hand):
+        if not self.isLexed(hand):
+            return PokerStars.readBringIn(self, hand)
+        if self.lexed['bringins']:
+            hand.addBringIn(*self.lexed['bringins'][0])
+
+    def readBlinds(self, hand):
+        if not self.isLexed(hand):
+            return PokerStars.readBlinds(self, hand)
+        posts = self.lexed['posts']
+        for (i, (player, amount)) in enumerate(posts['small blind']):
+            hand.addBlind(player, 'small blind' if i == 0 else 'secondsb', amount)
+        for (player, amount) in posts['big blind']:
+            hand.addBlind(player, 'big blind', amount)
+        for (player, amount) in posts['both']:
+            hand.addBlind(player, 'both', amount)
+
+    def readHeroCards(self, hand):
+        if not self.isLexed(hand):
+            return PokerStars.readHeroCards(self, hand)
+        dealt = self.lexed['dealt']
+        for street in ('PREFLOP', 'DEAL'):
+            if street in hand.streets.keys():
+                for (player, oldcards, newcards) in dealt.get(street, ()):
+                    hand.hero = player
+                    hand.addHoleCards(street, hand.hero, closed=newcards.split(' '), shown=False, mucked=False, dealt=True)
+
+        for street, text in hand.streets.iteritems():
+            if not text or street in ('PREFLOP', 'DEAL'): continue  # already done these
+            for (player, oldcards, newcards) in dealt.get(street, ()):
+                newcards = newcards.split(' ')
+                oldcards = [] if oldcards is None else oldcards.split(' ')
+                if street == 'THIRD' and len(newcards) == 3: # hero in stud game
+                    hand.hero = player
+                    hand.addHoleCards(street, player, closed=newcards[0:2], open=[newcards[2]], shown=False, mucked=False, dealt=True)
+                else:
+                    hand.addHoleCards(street, player, open=newcards, closed=oldcards, shown=False, mucked=False, dealt=False)
+
+    def readAction(self, hand, street):
+        if not self.isLexed(hand):
+            return PokerStars.readAction(self, hand, street)
+        for (atype, player, bet, discarded) in self.lexed['actions'].get(street, ()):
+            if atype == u'raises':
+                hand.addRaiseBy(street, player, bet)
+            elif atype == u'calls':
+                hand.addCall(street, player, bet)
+            elif atype == u'bets':
+                hand.addBet(street, player, bet)
+            elif atype == u'folds':
+                hand.addFold(street, player)
+            elif atype == u'checks':
+                hand.addCheck(street, player)
+            elif atype == u'discards':
+                hand.addDiscard(street, player, bet, discarded)
+            elif atype == u'stands pat':
+                hand.addStandsPat(street, player)
+
+    def readShowdownActions(self, hand):
+        if not self.isLexed(hand):
+            return PokerStars.readShowdownActions(self, hand)
+        for (player, cards) in self.lexed['shows']:
+            hand.addShownCards(cards.split(' '), player)
+
+    def readCollectPot(self, hand):
+        if not self.isLexed(hand):
+            return PokerStars.readCollectPot(self, hand)
+        for (player, pot) in self.lexed['collects']:
+            hand.addCollectPot(player=player, pot=pot)
+
+    def readShownCards(self, hand):
+        if not self.isLexed(hand):
+            return PokerStars.readShownCards(self, hand)
+        for (player, cards, showed) in self.lexed['shown']:
+            hand.addShownCards(cards=cards.split(' '), player=player, shown=(showed == u'showed'), mucked=(showed == u'mucked'))
@@ -61,6 +61,7 @@ class PokerStars(HandHistoryConverter):
           \)\s-\s                        # close paren of the stakes
           (?P<DATETIME>.*$)""" % substitutions,
           re.MULTILINE|re.VERBOSE)
+    re_GameTypeKey  = re.compile(u"PokerStars Game #[0-9]+:\s+(?P<KEY>.*?\))\s-\s")
 
     re_PlayerInfo   = re.compile(u"""
           ^Seat\s(?P<SEAT>[0-9]+):\s
@@ -79,6 +80,7 @@ class PokerStars(HandHistoryConverter):
     re_TailSplitHands   = re.compile('(\n\n\n+)')
     re_Button       = re.compile('Seat #(?P<BUTTON>\d+) is the button', re.MULTILINE)
     re_Board        = re.compile(r"\[(?P<CARDS>.+)\]")
+    re_HandNo       = re.compile(r"PokerStars Game #(?P<HID>[0-9]+):")
 #        self.re_setHandInfoRegex('.*#(?P<HID>[0-9]+): Table (?P<TABLE>[ a-zA-Z]+) - \$?(?P<SB>[.0-9]+)/\$?(?P<BB>[.0-9]+) - (?P<GAMETYPE>.*) - (?P<HR>[0-9]+):(?P<MIN>[0-9]+) ET - (?P<YEAR>[0-9]+)/(?P<MON>[0-9]+)/(?P<DAY>[0-9]+)Table (?P<TABLE>[ a-zA-Z]+)\nSeat (?P<BUTTON>[0-9]+)')    
 
     re_DateTime     = re.compile("""(?P<Y>[0-9]{4})\/(?P<M>[0-9]{2})\/(?P<D>[0-9]{2})[\- ]+(?P<H>[0-9]+):(?P<MIN>[0-9]+):(?P<S>[0-9]+)""", re.MULTILINE)
@@ -188,9 +190,14 @@ class PokerStars(HandHistoryConverter):
         # NB: SB, BB must be interpreted as blinds or bets depending on limit type.
         return info
 
+    def readHandNo(self, handText):
+        m = self.re_HandNo.search(handText)
+        if m:
+            return m.group('HID')
+
     def readHandInfo(self, hand):
         info = {}
-        m = self.re_HandInfo.search(hand.handText,re.DOTALL)
+        m = self.re_HandInfo.search(hand.handText)
         if m:
             info.update(m.groupdict())
 #                hand.maxseats = int(m2.group(1))
@@ -202,7 +209,7 @@ class PokerStars(HandHistoryConverter):
 #        m = self.re_Button.search(hand.handText)
 #        if m: info.update(m.groupdict()) 
         # TODO : I rather like the idea of just having this dict as hand.info
-        log.debug("readHandInfo: %s" % info)
+        log.debug("readHandInfo: %s", info)
         for key in info:
             if key == 'DATETIME':
                 #2008/11/12 10:00:48 CET [2008/11/12 4:00:48 ET]
@@ -293,7 +300,7 @@ class PokerStars(HandHistoryConverter):
             hand.addAnte(player.group('PNAME'), player.group('ANTE'))
     
     def readBringIn(self, hand):
-        m = self.re_BringIn.search(hand.handText,re.DOTALL)
+        m = self.re_BringIn.search(hand.handText)
         if m:
             #~ logging.debug("readBringIn: %s for %s" %(m.group('PNAME'),  m.group('BRINGIN')))
             hand.addBringIn(m.group('PNAME'),  m.group('BRINGIN'))
@@ -342,8 +349,7 @@ class PokerStars(HandHistoryConverter):
 
                 if street == 'THIRD' and len(newcards) == 3: # hero in stud game
                     hand.hero = player
-                    hand.dealt.add(player) # need this for stud??
-                    hand.addHoleCards(street, player, closed=newcards[0:2], open=[newcards[2]], shown=False, mucked=False, dealt=False)
+                    hand.addHoleCards(street, player, closed=newcards[0:2], open=[newcards[2]], shown=False, mucked=False, dealt=True)
                 else:
                     hand.addHoleCards(street, player, open=newcards, closed=oldcards, shown=False, mucked=False, dealt=False)
 
@@ -373,7 +379,7 @@ class PokerStars(HandHistoryConverter):
 
     def readShowdownActions(self, hand):
 # TODO: pick up mucks also??
-        for shows in self.re_ShowdownAction.finditer(hand.handText):            
+        for shows in self.re_ShowdownAction.finditer(hand.handText):
             cards = shows.group('CARDS').split(' ')
             hand.addShownCards(cards, shows.group('PNAME'))
 
@@ -1209,6 +1209,84 @@ class Sql:
                         """
 
 
+        ################################
+        # Create ImportCheckpoints
+        ################################
+
+        if db_server == 'mysql':
+            self.query['createImportCheckpointsTable'] = """CREATE TABLE ImportCheckpoints (
+                        id INT UNSIGNED AUTO_INCREMENT NOT NULL, PRIMARY KEY (id),
+                        path TEXT NOT NULL,
+                        inode BIGINT NOT NULL,
+                        size BIGINT NOT NULL,
+                        mtime BIGINT NOT NULL,
+                        byteOffset BIGINT NOT NULL)
+                        ENGINE=INNODB"""
+        elif db_server == 'postgresql':
+            self.query['createImportCheckpointsTable'] = """CREATE TABLE ImportCheckpoints (
+                        id SERIAL, PRIMARY KEY (id),
+                        path TEXT NOT NULL,
+                        inode BIGINT NOT NULL,
+                        size BIGINT NOT NULL,
+                        mtime BIGINT NOT NULL,
+                        byteOffset BIGINT NOT NULL)"""
+        elif db_server == 'sqlite':
+            self.query['createImportCheckpointsTable'] = """CREATE TABLE ImportCheckpoints (
+                        id INTEGER PRIMARY KEY,
+                        path TEXT NOT NULL,
+                        inode INT NOT NULL,
+                        size INT NOT NULL,
+                        mtime INT NOT NULL,
+                        byteOffset INT NOT NULL)"""
+
+
+        ################################
+        # Create QuarantinedHands
+        ################################
+
+        if db_server == 'mysql':
+            self.query['createQuarantinedHandsTable'] = """CREATE TABLE QuarantinedHands (
+                        id INT UNSIGNED AUTO_INCREMENT NOT NULL, PRIMARY KEY (id),
+                        path TEXT NOT NULL,
+                        byteOffset BIGINT NOT NULL,
+                        filter varchar(64) NOT NULL,
+                        error TEXT,
+                        handText MEDIUMTEXT NOT NULL)
+                        ENGINE=INNODB"""
+        elif db_server == 'postgresql':
+            self.query['createQuarantinedHandsTable'] = """CREATE TABLE QuarantinedHands (
+                        id SERIAL, PRIMARY KEY (id),
+                        path TEXT NOT NULL,
+                        byteOffset BIGINT NOT NULL,
+                        filter varchar(64) NOT NULL,
+                        error TEXT,
+                        handText TEXT NOT NULL)"""
+        elif db_server == 'sqlite':
+            self.query['createQuarantinedHandsTable'] = """CREATE TABLE QuarantinedHands (
+                        id INTEGER PRIMARY KEY,
+                        path TEXT NOT NULL,
+                        byteOffset INT NOT NULL,
+                        filter TEXT NOT NULL,
+                        error TEXT,
+                        handText TEXT NOT NULL)"""
+
+
+        # paths can be longer than a varchar(255), so on mysql, which can only index the start
+        # of a TEXT, the index isn't unique: paths which start the same would clash
+        if db_server == 'mysql':
+            self.query['addImportCheckpointsIndex'] = """ALTER TABLE ImportCheckpoints ADD INDEX path(path(255))"""
+        elif db_server == 'postgresql':
+            self.query['addImportCheckpointsIndex'] = """CREATE UNIQUE INDEX checkpointPath ON ImportCheckpoints (path)"""
+        elif db_server == 'sqlite':
+            self.query['addImportCheckpointsIndex'] = """CREATE UNIQUE INDEX checkpointPath ON ImportCheckpoints (path)"""
+
+        if db_server == 'mysql':
+            self.query['addQuarantinedHandsIndex'] = """ALTER TABLE QuarantinedHands ADD INDEX pathOffset(path(255), byteOffset)"""
+        elif db_server == 'postgresql':
+            self.query['addQuarantinedHandsIndex'] = """CREATE UNIQUE INDEX quarantinePathOffset ON QuarantinedHands (path, byteOffset)"""
+        elif db_server == 'sqlite':
+            self.query['addQuarantinedHandsIndex'] = """CREATE UNIQUE INDEX quarantinePathOffset ON QuarantinedHands (path, byteOffset)"""
+
         if db_server == 'mysql':
             self.query['addTourneyIndex'] = """ALTER TABLE Tourneys ADD UNIQUE INDEX siteTourneyNo(siteTourneyNo, tourneyTypeId)"""
         elif db_server == 'postgresql':
@@ -1247,6 +1325,22 @@ class Sql:
             self.query['addTTypesIndex'] = """CREATE UNIQUE INDEX tourneyTypes_all ON TourneyTypes (buyin, fee
                                              , maxSeats, knockout, rebuyOrAddon, speed, headsUp, shootout, matrix, sng)"""
 
+        # HudCache rows are upserted on this key, see Database.storeHudCacheLines()
+        if db_server == 'mysql':
+            self.query['addHudCacheIndex'] = """ALTER TABLE HudCache ADD UNIQUE INDEX hudCacheKey(gametypeId, playerId
+                                               , activeSeats, position, tourneyTypeId, styleKey)"""
+            self.query['hudCacheIndexExists'] = """SHOW INDEX FROM HudCache WHERE Key_name = 'hudCacheKey'"""
+        elif db_server == 'postgresql':
+            self.query['addHudCacheIndex'] = """CREATE UNIQUE INDEX hudCacheKey ON HudCache (gametypeId, playerId
+                                               , activeSeats, position, tourneyTypeId, styleKey)"""
+            self.query['hudCacheIndexExists'] = """SELECT indexname FROM pg_indexes
+                                                   WHERE tablename = 'hudcache' AND indexname = 'hudcachekey'"""
+        elif db_server == 'sqlite':
+            self.query['addHudCacheIndex'] = """CREATE UNIQUE INDEX hudCacheKey ON HudCache (gametypeId, playerId
+                                               , activeSeats, position, tourneyTypeId, styleKey)"""
+            self.query['hudCacheIndexExists'] = """SELECT name FROM sqlite_master
+                                                   WHERE type = 'index' AND name = 'hudCacheKey'"""
+
         self.query['get_last_hand'] = "select max(id) from Hands"
 
         self.query['get_last_hand_of_table'] = "select max(id) from Hands where tableName = %s"
@@ -3274,6 +3368,17 @@ class Sql:
             AND   tourneyTypeId+0=%s
             AND   styleKey=%s"""
 
+        # insert_hudcache, adding to the row with the same key if there is one
+        stats = re.findall(r"(\w+)=\1\+%s", self.query['update_hudcache'])
+        if db_server == 'mysql':
+            self.query['upsert_hudcache'] = self.query['insert_hudcache'] + """
+            ON DUPLICATE KEY UPDATE
+            """ + ",\n            ".join(["%s=%s+VALUES(%s)" % (stat, stat, stat) for stat in stats])
+        elif db_server == 'postgresql' or db_server == 'sqlite':
+            self.query['upsert_hudcache'] = self.query['insert_hudcache'] + """
+            ON CONFLICT (gametypeId, playerId, activeSeats, position, tourneyTypeId, styleKey) DO UPDATE SET
+            """ + ",\n            ".join(["%s=HudCache.%s+excluded.%s" % (stat, stat, stat) for stat in stats])
+
         self.query['get_hero_hudcache_start'] = """select min(hc.styleKey)
                                                    from HudCache hc
                                                    where hc.playerId in <playerid_list>
@@ -3338,6 +3443,54 @@ class Sql:
         self.query['isAlreadyInDB'] = """SELECT id FROM Hands 
                                          WHERE gametypeId=%s AND siteHandNo=%s
         """
+
+        # for the index of hands Database.isDuplicate() keeps
+        self.query['getGametypeSite'] = """SELECT siteId FROM Gametypes WHERE id=%s"""
+
+        self.query['countSiteHands'] = """SELECT COUNT(*) FROM Hands h, Gametypes g
+                                          WHERE g.id = h.gametypeId AND g.siteId = %s
+        """
+
+        self.query['getSiteHandNos'] = """SELECT h.gametypeId, h.siteHandNo FROM Hands h, Gametypes g
+                                          WHERE g.id = h.gametypeId AND g.siteId = %s
+        """
+
+        self.query['getKnownHands'] = """SELECT siteHandNo FROM Hands
+                                         WHERE gametypeId=%s AND siteHandNo IN (<siteHandNos>)
+        """
+
+        # the ids of a batch of hands just stored, see Database.storedHandIds()
+        self.query['getHandIds'] = """SELECT id, gametypeId, siteHandNo FROM Hands
+                                      WHERE siteHandNo IN (<siteHandNos>)
+        """
+
+        self.query['getImportCheckpoint'] = """SELECT inode, size, mtime, byteOffset
+                                               FROM ImportCheckpoints
+                                               WHERE path=%s
+        """
+
+        self.query['insertImportCheckpoint'] = """INSERT INTO ImportCheckpoints
+                                                  (inode, size, mtime, byteOffset, path)
+                                                  VALUES (%s, %s, %s, %s, %s)"""
+
+        self.query['updateImportCheckpoint'] = """UPDATE ImportCheckpoints
+                                                  SET inode=%s, size=%s, mtime=%s, byteOffset=%s
+                                                  WHERE path=%s"""
+
+        self.query['getQuarantinedHands'] = """SELECT path, byteOffset, filter, handText
+                                               FROM QuarantinedHands
+                                               ORDER BY path, byteOffset"""
+
+        self.query['insertQuarantinedHand'] = """INSERT INTO QuarantinedHands
+                                                 (filter, error, handText, path, byteOffset)
+                                                 VALUES (%s, %s, %s, %s, %s)"""
+
+        self.query['updateQuarantinedHand'] = """UPDATE QuarantinedHands
+                                                 SET filter=%s, error=%s, handText=%s
+                                                 WHERE path=%s AND byteOffset=%s"""
+
+        self.query['deleteQuarantinedHand'] = """DELETE FROM QuarantinedHands
+                                                 WHERE path=%s AND byteOffset=%s"""
         
         self.query['getTourneyTypeIdByTourneyNo'] = """SELECT tt.id,
                                                               tt.buyin,
@@ -3511,6 +3664,14 @@ class Sql:
                                                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
                                                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
 
+        # Database.storeHands() takes the ids of a batch of hands from the sequence first
+        # on postgres, and stores them with the hands
+        self.query['store_hand_with_id'] = self.query['store_hand'].replace(
+                                           'INSERT INTO Hands (', 'INSERT INTO Hands (id,', 1).replace(
+                                           '(%s,', '(%s, %s,', 1)
+        if db_server == 'postgresql':
+            self.query['nextHandIds'] = "SELECT nextval('hands_id_seq') FROM generate_series(1, %s)"
+
 
         self.query['store_hands_players'] = """INSERT INTO HandsPlayers (
                 handId,
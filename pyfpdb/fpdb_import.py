@@ -21,27 +21,26 @@
 
 import os  # todo: remove this once import_dir is in fpdb_import
 import sys
-from time import time, strftime, sleep, clock
+from time import time, strftime, clock
 import traceback
 import math
 import datetime
 import re
-import Queue
+import zipfile
 from collections import deque # using Queue for now
-import threading
+import multiprocessing
 
 import logging
 # logging has been set up in fpdb.py or HUD_main.py, use their settings:
 log = logging.getLogger("importer")
 
-import pygtk
-import gtk
-
 #    fpdb/FreePokerTools modules
 
 import Database
 import Configuration
 import Exceptions
+import HandHistoryConverter
+import FileWatcher
 
 
 #    database interface modules
@@ -61,6 +60,9 @@ else:
     psycopg2.extensions.register_type(psycopg2.extensions.UNICODE)
 
 class Importer:
+    # hands stored at a time in a bulk load, at least (see Database.startBulkLoad())
+    BULK_BATCH_SIZE = 1000
+
     def __init__(self, caller, settings, config, sql = None):
         """Constructor"""
         self.settings   = settings
@@ -79,7 +81,10 @@ class Importer:
         self.updatedtime = {}
         self.lines      = None
         self.faobs      = None       # File as one big string
-        self.pos_in_file = {}        # dict to remember how far we have read in the file
+        self.pos_in_file = {}        # dict to remember how far (in bytes) we have read in the file
+        self.converters = {}         # filter: converter, kept to be reused for file after file
+        self.watcher    = None       # FileWatcher for the monitored directories, if it can be used
+        self.watching   = False      # True once runUpdated() has looked at every file, and can go by the watcher
         #Set defaults
         self.callHud    = self.config.get_import_parameters().get("callFpdbHud")
 
@@ -88,18 +93,17 @@ class Importer:
         self.settings.setdefault("handCount", 0)
         #self.settings.setdefault("allowHudcacheRebuild", True) # NOT USED NOW
         #self.settings.setdefault("forceThreads", 2)            # NOT USED NOW
-        self.settings.setdefault("writeQSize", 1000)           # no need to change
-        self.settings.setdefault("writeQMaxWait", 10)          # not used
         self.settings.setdefault("dropIndexes", "don't drop")
         self.settings.setdefault("dropHudCache", "don't drop")
         self.settings.setdefault("starsArchive", False)
+        self.settings.setdefault("columnarStats", False)      # work out stats a batch of hands at a time
+        self.settings.setdefault("insertBatchSize", 100)      # hands stored with one insert into Hands (and HandsPlayers)
+        self.settings.setdefault("warmPlayerCache", False)    # load the ids of all the players of the sites imported first
 
-        self.writeq = None
         self.database = Database.Database(self.config, sql = self.sql)
-        self.writerdbs = []
+        # number of processes parsing hands for runImport; they all hand their
+        # hands back to this process, which does the inserts using self.database
         self.settings.setdefault("threads", 1) # value set by GuiBulkImport
-        for i in xrange(self.settings['threads']):
-            self.writerdbs.append( Database.Database(self.config, sql = self.sql) )
 
         clock() # init clock in windows
 
@@ -124,9 +128,6 @@ class Importer:
 
     def setThreads(self, value):
         self.settings['threads'] = value
-        if self.settings["threads"] > len(self.writerdbs):
-            for i in xrange(self.settings['threads'] - len(self.writerdbs)):
-                self.writerdbs.append( Database.Database(self.config, sql = self.sql) )
 
     def setDropIndexes(self, value):
         self.settings['dropIndexes'] = value
@@ -137,6 +138,15 @@ class Importer:
     def setStarsArchive(self, value):
         self.settings['starsArchive'] = value
 
+    def setColumnarStats(self, value):
+        self.settings['columnarStats'] = value
+
+    def setInsertBatchSize(self, value):
+        self.settings['insertBatchSize'] = max(1, int(value))
+
+    def setWarmPlayerCache(self, value):
+        self.settings['warmPlayerCache'] = value
+
 #   def setWatchTime(self):
 #       self.updated = time()
 
@@ -145,16 +155,25 @@ class Importer:
         self.updatetime = {}
         self.pos_in_file = {}
         self.filelist = {}
+        self.watching = False
 
     def closeDBs(self):
         self.database.disconnect()
-        for i in xrange(len(self.writerdbs)):
-            self.writerdbs[i].disconnect()
 
     #Add an individual file to filelist
+    #A zip archive is added as each of the files in it, which are imported (and counted) one by one
     def addImportFile(self, filename, site = "default", filter = "passthrough"):
         #TODO: test it is a valid file -> put that in config!!
-        if filename in self.filelist or not os.path.exists(filename):
+        if filename in self.filelist or not HandHistoryConverter.handHistoryExists(filename):
+            return
+        if filename.lower().endswith('.zip') and zipfile.is_zipfile(filename):
+            try:
+                members = HandHistoryConverter.zipMembers(filename)
+            except (IOError, zipfile.BadZipfile):
+                log.exception("Unable to read zip archive '%s'" % filename)
+                return
+            for member in members:
+                self.addImportFile(member, site, filter)
             return
         self.filelist[filename] = [site] + [filter]
         if site not in self.siteIds:
@@ -195,6 +214,10 @@ class Importer:
             if monitor == True:
                 self.monitor = True
                 self.dirlist[site] = [dir] + [filter]
+                if self.watcher is None:
+                    self.watcher = FileWatcher.getWatcher()
+                if self.watcher is not None:
+                    self.watcher.watchDirectory(dir, (site, filter))
 
             #print "addImportDirectory: checking files in", dir
             for file in os.listdir(dir):
@@ -217,45 +240,28 @@ class Importer:
         if 'dropHudCache' in self.settings and self.settings['dropHudCache'] == 'auto':
             self.settings['dropHudCache'] = self.calculate_auto2(self.database, 25.0, 500.0)    # returns "drop"/"don't drop"
 
+        self.warmPlayerCache()
         if self.settings['dropIndexes'] == 'drop':
+            self.database.startBulkLoad()       # COPY, LOAD DATA, or sqlite without syncing
             self.database.prepareBulkImport()
         else:
             log.debug("No need to drop indexes.")
         #print "dropInd =", self.settings['dropIndexes'], "  dropHudCache =", self.settings['dropHudCache']
 
-        if self.settings['threads'] <= 0:
-            (totstored, totdups, totpartial, toterrors) = self.importFiles(self.database, None)
+        if self.settings['threads'] <= 1:
+            (totstored, totdups, totpartial, toterrors) = self.importFiles(self.database)
         else:
-            # create queue (will probably change to deque at some point):
-            self.writeq = Queue.Queue( self.settings['writeQSize'] )
-            # start separate thread(s) to read hands from queue and write to db:
-            for i in xrange(self.settings['threads']):
-                t = threading.Thread( target=self.writerdbs[i].insert_queue_hands
-                                    , args=(self.writeq, self.settings["writeQMaxWait"])
-                                    , name="dbwriter-"+str(i) )
-                t.setDaemon(True)
-                t.start()
-            # read hands and write to q:
-            (totstored, totdups, totpartial, toterrors) = self.importFiles(self.database, self.writeq)
-
-            if self.writeq.empty():
-                print "writers finished already"
-                pass
-            else:
-                print "waiting for writers to finish ..."
-                #for t in threading.enumerate():
-                #    print "    "+str(t)
-                #self.writeq.join()
-                #using empty() might be more reliable:
-                while not self.writeq.empty() and len(threading.enumerate()) > 1:
-                    # TODO: Do we need to actually tell the progress indicator to move, or is it already moving, and we just need to process events...
-                    while gtk.events_pending(): # see http://faq.pygtk.org/index.py?req=index for more hints (3.7)
-                        gtk.main_iteration(False)
-                    sleep(0.5)
-                print "                              ... writers finished"
+            # parse in a pool of worker processes, and insert the hands from this one
+            pool = multiprocessing.Pool(self.settings['threads'], HandHistoryConverter.initParseWorker, (self.config.file,))
+            try:
+                (totstored, totdups, totpartial, toterrors) = self.importFiles(self.database, pool)
+            finally:
+                pool.close()
+                pool.join()
 
         # Tidying up after import
         if self.settings['dropIndexes'] == 'drop':
+            self.database.finishBulkLoad()
             self.database.afterBulkImport()
         else:
             print "No need to rebuild indexes."
@@ -268,10 +274,9 @@ class Importer:
         return (totstored, totdups, totpartial, toterrors, endtime-starttime)
     # end def runImport
 
-    def importFiles(self, db, q):
+    def importFiles(self, db, pool=None):
         """"Read filenames in self.filelist and pass to import_file_dict().
-            Uses a separate database connection if created as a thread (caller
-            passes None or no param as db)."""
+            If pool is given, the hands are parsed by its worker processes."""
 
         totstored = 0
         totdups = 0
@@ -280,16 +285,12 @@ class Importer:
         tottime = 0
         for file in self.filelist:
             (stored, duplicates, partial, errors, ttime) = self.import_file_dict(db, file
-                                               ,self.filelist[file][0], self.filelist[file][1], q)
+                                               ,self.filelist[file][0], self.filelist[file][1], pool)
             totstored += stored
             totdups += duplicates
             totpartial += partial
             toterrors += errors
 
-        for i in xrange( self.settings['threads'] ):
-            print "sending finish msg qlen =", q.qsize()
-            db.send_finish_msg(q)
-
         return (totstored, totdups, totpartial, toterrors)
     # end def importFiles
 
@@ -331,9 +332,12 @@ class Importer:
         # add up size of import files
         total_size = 0.0
         for file in self.filelist:
-            if os.path.exists(file):
-                stat_info = os.stat(file)
-                total_size += stat_info.st_size
+            if HandHistoryConverter.handHistoryExists(file):
+                (in_fh, size) = HandHistoryConverter.openHandHistory(file)
+                in_fh.close()
+                if size is None:    # .gz or .bz2, go by the compressed size
+                    size = os.stat(file).st_size
+                total_size += size
 
         # if hands_in_db is zero or very low, we want to drop indexes, otherwise compare
         # import size with db size somehow:
@@ -347,34 +351,28 @@ class Importer:
     #Run import on updated files, then store latest update time. Called from GuiAutoImport.py
     def runUpdated(self):
         #Check for new files in monitored directories
-        #todo: make efficient - always checks for new file, should be able to use mtime of directory
-        # ^^ May not work on windows
+        #Where there's a watcher only the first call looks at every file, after that
+        #only the files the watcher says have changed are looked at (see runChanged())
+        if self.watching:
+            changed = self.watcher.changedFiles()
+            if changed is not None:
+                self.runChanged(changed)
+                return
 
         #rulog = open('runUpdated.txt', 'a')
         #rulog.writelines("runUpdated ... ")
         for site in self.dirlist:
             self.addImportDirectory(self.dirlist[site][0], False, site, self.dirlist[site][1])
+        self.warmPlayerCache()
 
         for file in self.filelist:
-            if os.path.exists(file):
-                stat_info = os.stat(file)
+            if HandHistoryConverter.handHistoryExists(file):
+                stat_info = HandHistoryConverter.statHandHistory(file)
                 #rulog.writelines("path exists ")
                 if file in self.updatedsize: # we should be able to assume that if we're in size, we're in time as well
                     if stat_info.st_size > self.updatedsize[file] or stat_info.st_mtime > self.updatedtime[file]:
 #                        print "file",counter," updated", os.path.basename(file), stat_info.st_size, self.updatedsize[file], stat_info.st_mtime, self.updatedtime[file]
-                        try:
-                            if not os.path.isdir(file):
-                                self.caller.addText("\n"+os.path.basename(file))
-                        except KeyError: # TODO: What error happens here?
-                            pass
-                        (stored, duplicates, partial, errors, ttime) = self.import_file_dict(self.database, file, self.filelist[file][0], self.filelist[file][1], None)
-                        try:
-                            if not os.path.isdir(file): # Note: This assumes that whatever calls us has an "addText" func
-                                self.caller.addText(" %d stored, %d duplicates, %d partial, %d errors (time = %f)" % (stored, duplicates, partial, errors, ttime))
-                        except KeyError: # TODO: Again, what error happens here? fix when we find out ..
-                            pass
-                        self.updatedsize[file] = stat_info.st_size
-                        self.updatedtime[file] = time()
+                        self.importUpdated(file, stat_info)
                 else:
                     if os.path.isdir(file) or (time() - stat_info.st_mtime) < 60:
                         self.updatedsize[file] = 0
@@ -394,11 +392,56 @@ class Importer:
         self.addToDirList = {}
         self.removeFromFileList = {}
         self.database.rollback()
+        self.watching = self.watcher is not None
         #rulog.writelines("  finished\n")
         #rulog.close()
 
+    def runChanged(self, changed):
+        """runUpdated() for when the watcher has said which files have changed: changed
+is {path: (site, filter)}. Imports those files, adding any new ones (and watching
+new directories and importing the files in them), and any files runUpdated()
+found but has still to import. A new directory is only watched: dirlist keeps
+the site's own import directory."""
+        for (path, (site, filter)) in changed.iteritems():
+            if os.path.isdir(path):
+                self.watcher.watchDirectory(path, (site, filter))
+                for file in os.listdir(path):
+                    self.addImportFile(os.path.join(path, file), site, filter)
+            else:
+                self.addImportFile(path, site, filter)
+
+        for file in self.filelist.keys():
+            if self.updatedtime.get(file, 0) != 0:     # not new or still to be imported
+                if not changed or (HandHistoryConverter.splitZipPath(file) or (file,))[0] not in changed:
+                    continue
+            if not HandHistoryConverter.handHistoryExists(file):
+                del self.filelist[file]
+            elif not os.path.isdir(file):
+                self.importUpdated(file, HandHistoryConverter.statHandHistory(file))
+        self.database.rollback()
+
+    def importUpdated(self, file, stat_info):
+        """Import file for runUpdated() and note that it's been done"""
+        try:
+            if not os.path.isdir(file):
+                self.caller.addText("\n"+os.path.basename(file))
+        except KeyError: # TODO: What error happens here?
+            pass
+        (stored, duplicates, partial, errors, ttime) = self.import_file_dict(self.database, file, self.filelist[file][0], self.filelist[file][1])
+        try:
+            if not os.path.isdir(file): # Note: This assumes that whatever calls us has an "addText" func
+                self.caller.addText(" %d stored, %d duplicates, %d partial, %d errors (time = %f)" % (stored, duplicates, partial, errors, ttime))
+        except KeyError: # TODO: Again, what error happens here? fix when we find out ..
+            pass
+        self.updatedsize[file] = stat_info.st_size
+        self.updatedtime[file] = time()
+        if partial:
+            # its last hand was held back as still being written, so look at it again
+            # next time, whether or not anything more is written to it by then
+            self.updatedtime[file] = 0
+
     # This is now an internal function that should not be called directly.
-    def import_file_dict(self, db, file, site, filter, q=None):
+    def import_file_dict(self, db, file, site, filter, pool=None):
         #print "import_file_dict"
 
         if os.path.isdir(file):
@@ -411,8 +454,8 @@ class Importer:
         file =  file.decode(Configuration.LOCALE_ENCODING)
 
         # Load filter, process file, pass returned filename to import_fpdb_file
-        if self.settings['threads'] > 0 and self.writeq is not None:
-            log.info("Converting " + file + " (" + str(q.qsize()) + ")")
+        if pool is not None:
+            log.info("Converting " + file + " (%d processes)" % self.settings['threads'])
         else:
             log.info("Converting " + file)
         hhbase    = self.config.get_import_parameters().get("hhArchiveBase")
@@ -428,46 +471,53 @@ class Importer:
         mod = __import__(filter)
         obj = getattr(mod, filter_name, None)
         if callable(obj):
-            idx = 0
-            if file in self.pos_in_file:
-                idx = self.pos_in_file[file]
+            if self.monitor:
+                self.pos_in_file[file] = self.loadCheckpoint(file)
+            idx = self.pos_in_file.setdefault(file, 0)
+            hhc = self.converters.get(filter)
+            if hhc is None:
+                hhc = obj(self.config, in_path = file, out_path = out_path, index = idx, starsArchive = self.settings['starsArchive'], autostart = False)
+                self.converters[filter] = hhc
             else:
-                self.pos_in_file[file] = 0
-            hhc = obj(self.config, in_path = file, out_path = out_path, index = idx, starsArchive = self.settings['starsArchive'])
+                hhc.setInput(file, out_path, idx, self.settings['starsArchive'])
+            # a hand still being written is read again in full next time, rather than quarantined now
+            hhc.holdLastHand = self.monitor
             if hhc.getStatus():
-                handlist = hhc.getProcessedHands()
-                self.pos_in_file[file] = hhc.getLastCharacterRead()
                 to_hud = []
 
-                for hand in handlist:
+                # hands are inserted as they are parsed, insertBatchSize at a time, so only
+                # a batch is held in memory at a time (or a few, when they are parsed by a
+                # pool of processes).
+                # Hands already in the database are dropped from their headers, before parsing
+                batchSize = self.settings['insertBatchSize']
+                if self.database.bulkLoading:
+                    batchSize = max(batchSize, self.BULK_BATCH_SIZE)
+                batch = []
+                for hand in hhc.iterHands(pool, self.settings['threads'], self.database, self.settings['columnarStats']):
                     if hand is not None:
-                        hand.prepInsert(self.database)
-                        try:
-                            hand.insert(self.database)
-                        except Exceptions.FpdbHandDuplicate:
-                            duplicates += 1
-                        else:
-                            if self.callHud and hand.dbid_hands != 0:
-                                to_hud.append(hand.dbid_hands)
+                        batch.append(hand)
+                        if len(batch) >= batchSize:
+                            duplicates += self.storeHands(batch, to_hud)
+                            batch = []
                     else: # TODO: Treat empty as an error, or just ignore?
                         log.error("Hand processed but empty")
-
-                # Call hudcache update if not in bulk import mode
-                # FIXME: Need to test for bulk import that isn't rebuilding the cache
-                if self.callHud:
-                    for hand in handlist:
-                        if hand is not None and not hand.is_duplicate:
-                            hand.updateHudCache(self.database)
+                duplicates += self.storeHands(batch, to_hud)
+                self.pos_in_file[file] = hhc.getLastCharacterRead()
+                if self.monitor:
+                    self.saveCheckpoint(file)
                 self.database.commit()
 
                 #pipe the Hands.id out to the HUD
                 for hid in to_hud:
-                    print "fpdb_import: sending hand to hud", hand.dbid_hands, "pipe =", self.caller.pipe_to_hud
+                    print "fpdb_import: sending hand to hud", hid, "pipe =", self.caller.pipe_to_hud
                     self.caller.pipe_to_hud.stdin.write("%s" % (hid) + os.linesep)
 
                 errors = getattr(hhc, 'numErrors')
                 stored = getattr(hhc, 'numHands')
+                if hhc.heldLastHand:
+                    partial = 1
                 stored -= duplicates
+                duplicates += hhc.numDuplicates
             else:
                 # conversion didn't work
                 # TODO: appropriate response?
@@ -481,6 +531,109 @@ class Importer:
         #This will barf if conv.getStatus != True
         return (stored, duplicates, partial, errors, ttime)
 
+    def storeHands(self, hands, to_hud):
+        """\
+Insert hands with one Database.storeHands(), and update the HudCache for them,
+adding the ids of those for the HUD to to_hud. The players' ids are looked up
+for the whole batch at once, a site at a time, before each hand's prepInsert().
+Returns the number of them already in the database."""
+        if not hands:
+            return 0
+        sites = {}
+        for hand in hands:
+            sites.setdefault(hand.siteId, []).extend(hand.pnames)
+        for (siteId, pnames) in sites.iteritems():
+            self.database.cachePlayerIds(pnames, siteId)
+        for hand in hands:
+            hand.prepInsert(self.database)
+        stored = self.database.storeHands(hands)
+        self.database.gatherHudCache()      # each HudCache row is written once for the batch
+        for hand in stored:
+            if self.callHud and hand.dbid_hands != 0:
+                to_hud.append(hand.dbid_hands)
+            # Call hudcache update if not in bulk import mode
+            # FIXME: Need to test for bulk import that isn't rebuilding the cache
+            if self.callHud:
+                hand.updateHudCache(self.database)
+        self.database.flushHudCache()
+        return len(hands) - len(stored)
+
+    def warmPlayerCache(self):
+        """\
+With the warmPlayerCache setting, load the ids of every player of the sites
+being imported, so a first import of many files doesn't look up the same
+players again and again."""
+        if self.settings['warmPlayerCache']:
+            self.database.loadPlayerIds(self.siteIds.values())
+
+    def retryQuarantine(self):
+        """\
+Convert the hands which failed to convert when they were imported again, with
+the filter each was imported with, and insert those that now convert. They're
+read out of the QuarantinedHands table, so the files they came from don't have
+to be imported again (or even still be there). Hands that still fail stay in
+the quarantine with their latest error.
+Returns (stored, duplicates, partial, errors, time) like import_file_dict()."""
+        (stored, duplicates, partial, errors, ttime) = (0, 0, 0, 0, time())
+        for (path, offset, filter, handText) in self.database.getQuarantinedHands():
+            hhc = self.converters.get(filter)
+            if hhc is None:
+                try:
+                    obj = getattr(__import__(filter), filter.replace("ToFpdb", ""))
+                except (ImportError, AttributeError):
+                    errors += 1
+                    log.warning("Unknown filter '%s' for quarantined hand at %s in '%s'" % (filter, offset, path))
+                    continue
+                hhc = obj(self.config, in_path = path, autostart = False)
+                self.converters[filter] = hhc
+            else:
+                hhc.setInput(path)
+            try:
+                hand = hhc.processHand(handText)
+            except Exceptions.FpdbParseError, e:
+                errors += 1
+                log.warning("Quarantined hand at %s in '%s' still fails: %s" % (offset, path, e))
+                self.database.storeQuarantinedHand(path, offset, filter, str(e), handText)
+                continue
+            self.database.deleteQuarantinedHand(path, offset)
+            if hand is None:
+                continue
+            hand.prepInsert(self.database)
+            try:
+                hand.insert(self.database)
+            except Exceptions.FpdbHandDuplicate:
+                duplicates += 1
+            else:
+                stored += 1
+                if self.callHud:
+                    hand.updateHudCache(self.database)
+        self.database.commit()
+        return (stored, duplicates, partial, errors, time() - ttime)
+
+
+    def loadCheckpoint(self, file):
+        """Byte offset to carry on importing file from, as saved by saveCheckpoint().
+The checkpoint is only trusted if file is still the same file (same inode) and
+has grown or not changed since; otherwise the file is read from the start."""
+        saved = self.database.getImportCheckpoint(file)
+        if saved is None:
+            return 0
+        (inode, size, mtime, offset) = saved
+        stat_info = HandHistoryConverter.statHandHistory(file)
+        if stat_info.st_ino != inode or stat_info.st_size < size:
+            log.info("%s has been replaced since it was last imported" % file)
+            return 0
+        if stat_info.st_size == size and int(stat_info.st_mtime) != mtime:
+            log.info("%s has been rewritten since it was last imported" % file)
+            return 0
+        return offset
+
+    def saveCheckpoint(self, file):
+        """Save self.pos_in_file[file] to the database, so that a restarted
+auto-import can seek straight to it. Caller commits."""
+        stat_info = HandHistoryConverter.statHandHistory(file)
+        self.database.storeImportCheckpoint(file, stat_info.st_ino, stat_info.st_size,
+                                            int(stat_info.st_mtime), self.pos_in_file[file])
 
     def printEmailErrorMessage(self, errors, filename, line):
         traceback.print_exc(file=sys.stderr)
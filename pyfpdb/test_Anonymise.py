@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import Configuration
+import Anonymise
+import PokerStarsToFpdb
+
+config = Configuration.Config(file = "HUD_config.test.xml")
+
+def testAnonymise(tmpdir):
+    # Every seated player's name is replaced, with the same alias in every file,
+    # and the hands still convert
+    paths = ("regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt",
+             "regression-test-files/cash/Stars/Flop/NLHE-6max-EUR-0.05-0.10-200911.txt")
+    Anonymise.initAnonymiser(config.file, "PokerStarsToFpdb", {u"Swiss777": u"Player1"}, "key")
+    aliases = {}
+    texts = []
+    for path in paths:
+        out = str(tmpdir.join(path.split('/')[-1]))
+        (done, hands, new) = Anonymise.anonymiseFile(path, out)
+        aliases.update(new)
+        expected = list(PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False).iterHands())
+        anonymised = list(PokerStarsToFpdb.PokerStars(config, in_path = out, autostart=False).iterHands())
+        assert hands == len(anonymised) == len(expected)
+        text = open(out).read().decode('utf8')
+        texts.append(text)
+        for hand in expected:
+            for player in hand.players:
+                assert player.name not in text
+        assert [h.handid for h in anonymised] == [h.handid for h in expected]
+    assert u"Swiss777" not in aliases and u"Player1 " in texts[0]
+    assert len(set(aliases.values())) == len(aliases)
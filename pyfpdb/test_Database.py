@@ -2,6 +2,15 @@
 import sqlite3
 import Database
 import math
+import py
+
+import Configuration
+import PokerStarsToFpdb
+from Hand import HandRows
+from Exceptions import FpdbHandDuplicate
+
+config = Configuration.Config(file = "HUD_config.test.xml")
+db = Database.Database(config)
 
 # Should probably use our wrapper classes - creating sqlite db in memory
 sqlite3.register_converter("bool", lambda x: bool(int(x)))
@@ -65,3 +74,185 @@ def testSQLiteModFunction():
         idx = idx+1
 
     cur.execute("DROP TABLE test")
+
+def testStoreHands():
+    # A batch of hands is stored with a few multi-row inserts, each hand with its
+    # own id and HandsPlayers rows, leaving out hands already stored or repeated
+    db.recreate_tables()
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    (hands, again) = [[HandRows(hand) for hand in PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False).iterHands()]
+                      for i in (1, 2)]
+    for hand in hands + again:
+        hand.prepInsert(db)
+    hands[0].insert(db)
+    db.SQLITE_MAX_VARIABLES = 100     # 3 Hands rows, or 1 HandsPlayers row, per insert
+    try:
+        stored = db.storeHands(hands[:3] + again[1:2] + hands[3:])
+    finally:
+        del db.SQLITE_MAX_VARIABLES
+    assert stored == hands[1:]
+    assert hands[0].is_duplicate and again[1].is_duplicate
+    c = db.get_cursor()
+    c.execute("SELECT id, siteHandNo FROM Hands")
+    assert sorted(c.fetchall()) == sorted((hand.dbid_hands, int(hand.hands['siteHandNo'])) for hand in hands)
+    c.execute("SELECT handId, playerId FROM HandsPlayers")
+    assert sorted(c.fetchall()) == sorted((hand.dbid_hands, pid) for hand in hands for pid in hand.dbid_pids.values())
+
+def testStoreHandsIds():
+    # The ids of a multi-row insert are read back, as they needn't be consecutive
+    db.recreate_tables()
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    hands = [HandRows(hand) for hand in PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False).iterHands()]
+    for hand in hands:
+        hand.prepInsert(db)
+    c = db.get_cursor()
+    # as if another connection stored a hand after each of these
+    c.execute("CREATE TEMP TRIGGER gap AFTER INSERT ON Hands BEGIN UPDATE Hands SET id = NEW.id + 10 WHERE id = NEW.id; END")
+    try:
+        assert db.storeHands(hands) == hands
+    finally:
+        c.execute("DROP TRIGGER gap")
+    c.execute("SELECT id, siteHandNo FROM Hands")
+    assert sorted(c.fetchall()) == sorted((hand.dbid_hands, int(hand.hands['siteHandNo'])) for hand in hands)
+    c.execute("SELECT DISTINCT handId FROM HandsPlayers")
+    assert sorted(row[0] for row in c.fetchall()) == sorted(hand.dbid_hands for hand in hands)
+
+def testBulkLoad():
+    # Hands bulk loaded get the same rows as hands stored with inserts, after the
+    # ids already used, and the sqlite pragmas are put back afterwards
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    (hands, again) = [[HandRows(hand) for hand in PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False).iterHands()]
+                      for i in (1, 2)]
+    tables = []
+    for batch in (hands, again):
+        db.recreate_tables()
+        for hand in batch:
+            hand.prepInsert(db)
+        batch[0].insert(db)
+        c = db.get_cursor()
+        c.execute("PRAGMA synchronous")
+        synchronous = c.fetchone()
+        if batch is again:
+            db.startBulkLoad()
+            assert db.bulkLoading
+        try:
+            assert db.storeHands(batch) == batch[1:]
+        finally:
+            db.finishBulkLoad()
+        c.execute("PRAGMA synchronous")
+        assert c.fetchone() == synchronous
+        c.execute("SELECT * FROM Hands ORDER BY id")
+        rows = [row[:6] + row[7:] for row in c.fetchall()]    # but importTime
+        c.execute("SELECT * FROM HandsPlayers ORDER BY id")
+        tables.append((rows, c.fetchall()))
+    assert [hand.dbid_hands for hand in again] == [hand.dbid_hands for hand in hands]
+    assert tables[0] == tables[1]
+    assert Database.Database.bulkValue(u"a\\b\tc\nd\u00e9") == "a\\\\b\\tc\\nd\xc3\xa9"
+    assert [Database.Database.bulkValue(v) for v in (None, True, 0.5, 3)] == ["\\N", "1", "0.5", "3"]
+
+def testHudCacheUpsert():
+    # HudCache lines gathered over a batch and upserted a row at a time give the
+    # same table as lines written a hand at a time, as does updating a table
+    # without the unique key the upsert needs
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    tables = []
+    for (gather, upsert) in ((False, True), (True, True), (True, False)):
+        db.recreate_tables()
+        if not upsert:
+            db.get_cursor().execute("DROP INDEX hudCacheKey")
+            db.hudCacheUpsert = None
+        hands = [HandRows(hand) for hand in PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False).iterHands()]
+        for hand in hands:
+            hand.prepInsert(db)
+        db.storeHands(hands)
+        if gather:
+            db.gatherHudCache()
+        for hand in hands + hands[:3]:
+            hand.updateHudCache(db)
+        db.flushHudCache()
+        assert db.hudCacheUpsert == upsert
+        c = db.get_cursor()
+        c.execute("SELECT * FROM HudCache ORDER BY gametypeId, playerId, activeSeats, position, styleKey")
+        tables.append([row[1:] for row in c.fetchall()])
+    assert tables[0] == tables[1] == tables[2]
+    assert max(row[6] for row in tables[0]) > 1     # HDs
+
+def testPlayerIds():
+    # Names are looked up a few at a time, those not in Players added, and every
+    # name keeps its id, however the cache was filled
+    db.recreate_tables()
+    assert db.getSqlPlayerIDs([u"Alice"], 2) == {u"Alice": 1}
+    names = [u"Bob", u"Alice", u"Bob", u"Caf\u00e9", u"Dave", u"Eve", u"Fred"]
+    db.PLAYER_LOOKUP_SIZE = 2
+    try:
+        db.cachePlayerIds(names, 2)
+    finally:
+        del db.PLAYER_LOOKUP_SIZE
+    ids = db.getSqlPlayerIDs(names, 2)
+    assert ids[u"Alice"] == 1 and sorted(ids.values()) == range(1, 7)
+    assert db.getSqlPlayerIDs([u"Alice"], 3) == {u"Alice": 7}
+    c = db.get_cursor()
+    c.execute("SELECT COUNT(*) FROM Players")
+    assert c.fetchone()[0] == 7
+    db.pcache = db.pcacheLoaded = None
+    assert db.loadPlayerIds([2]) > 0
+    assert db.loadPlayerIds([2]) is None
+    assert db.getSqlPlayerIDs(names, 2) == ids
+
+def testHandIndex():
+    # Duplicates are found in the index of hands once a site's hands are loaded,
+    # which follows the hands stored and rolled back, and the same are found
+    # by looking them up where the site has too many hands to index
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+    hands = [HandRows(hand) for hand in hhc.iterHands()]
+    hids = [str(hand.hands['siteHandNo']) for hand in hands]
+    for maxHands in (2, 1):
+        db.recreate_tables()
+        db.handIndexMax = maxHands
+        try:
+            for hand in hands:
+                hand.prepInsert(db)
+            db.storeHands(hands[:2])
+            db.commit()
+            db.resetHandIndex()     # loaded again, with 2 hands
+            assert db.getKnownHands(2, hands[0].gametype, hids[:4]) == set(hids[:2])
+            assert db.handIndexSites == {2: maxHands == 2}
+            db.storeHands(hands[2:4])
+            assert [db.isDuplicate(hand.dbid_gt, hid) for (hand, hid) in zip(hands, hids)][:5] == [True] * 4 + [False]
+            db.rollback()
+            assert [db.isDuplicate(hand.dbid_gt, hid) for (hand, hid) in zip(hands, hids)][:5] == [True] * 2 + [False] * 3
+        finally:
+            db.handIndexMax = config.get_import_parameters()['handIndexMax']
+    assert db.isDuplicate(hands[0].dbid_gt, "not a number") == False
+    known = Database.HandNos([7, 2**60, -3, 5])
+    known.add(4)
+    assert [n in known for n in range(-3, 9)] == [True] + [False] * 6 + [True, True, False, True, False]
+    assert 2**60 in known and len(known) == 5
+
+def testStaleHandIndex():
+    # Hands another importer stored after the index of hands was loaded are
+    # turned away by Hands' unique index, and then found to be duplicates
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+    hands = [HandRows(hand) for hand in hhc.iterHands()]
+    db.recreate_tables()
+    for hand in hands:
+        hand.prepInsert(db)
+    db.storeHands(hands[:1])
+    db.commit()
+    c = db.get_cursor()
+    # as if stored by another importer, with the index already loaded
+    for hand in hands[1:3]:
+        (hand.hands['gameTypeId'], hand.hands['seats']) = (hand.dbid_gt, len(hand.dbid_pids))
+        c.execute(db.sql.query['store_hand'].replace('%s', db.sql.query['placeholder']), db.handsValues(hand.hands))
+    db.commit()
+    assert not db.isDuplicate(hands[1].dbid_gt, hands[1].hands['siteHandNo'])
+    assert db.storeHands(hands[1:]) == hands[3:]
+    assert hands[1].is_duplicate and hands[2].is_duplicate and not hands[3].is_duplicate
+    assert db.isDuplicate(hands[1].dbid_gt, hands[1].hands['siteHandNo'])
+    py.test.raises(FpdbHandDuplicate, hands[1].insert, db)  # found in the index now
+    py.test.raises(FpdbHandDuplicate, db.storeHand, hands[4].hands)    # turned away by the unique index
+    c.execute("SELECT COUNT(*) FROM Hands")
+    assert c.fetchone()[0] == len(hands)
+    db.commit()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import Configuration
+import Database
+import DerivedStats
+import PokerStarsToFpdb
+from Hand import HandRows, BatchedHandRows
+
+config = Configuration.Config(file = "HUD_config.test.xml")
+
+def testColumnarStats():
+    # Stats worked out a batch of hands at a time in columns must be stored
+    # in the rows and HudCache lines the dicts of each hand's stats give
+    class RowsDb(Database.Database):
+        def __init__(self):
+            self.use_date_in_hudcache = True
+            self.stored = []
+        def storeHandsPlayersRows(self, rows):
+            self.stored.append(rows)
+        def storeHudCacheLines(self, lines):
+            self.stored.append(lines)
+    for path in ("regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200912.Allin-pre.txt",
+                 "regression-test-files/cash/Stars/Stud/7-StudHL-USD-0.04-0.08-200911.txt"):
+        (expected, batched) = (RowsDb(), RowsDb())
+        for rows in [HandRows(hand) for hand in PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False).iterHands()]:
+            pids = dict((name, i) for (i, name) in enumerate(rows.pnames))
+            expected.storeHandsPlayers(1, pids, rows.handsplayers)
+            expected.storeHudCache(2, pids, rows.starttime, rows.handsplayers)
+            expected.stored.append(rows.hands)
+        hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+        hhc.PARSE_BATCH_SIZE = 4
+        for rows in hhc.iterHands(columnar = True):
+            assert isinstance(rows, BatchedHandRows)
+            pids = dict((name, i) for (i, name) in enumerate(rows.pnames))
+            (rows.dbid_gt, rows.dbid_pids) = (2, pids)
+            batched.storeHandsPlayersRows(rows.batch.handsPlayersRows(rows.players, 1, pids))
+            rows.updateHudCache(batched)
+            batched.stored.append(rows.hands)
+        assert repr(batched.stored) == repr(expected.stored)
+    # tournament chips in cents can be more than a 32-bit C long holds
+    batch = DerivedStats.DerivedStatsBatch(1)
+    batch.columns['winnings'][0] = batch.columns['totalProfit'][0] = 5000000000
+    batch.numRows = 1
+    batch.finish()
+    assert batch.handsPlayersRows({'Hero': 0}, 1, {'Hero': 7})[0][11:14] == (5000000000, 0, 5000000000)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import py
+import FileWatcher
+
+def testChangedFiles(tmpdir):
+    watcher = FileWatcher.getWatcher()
+    if watcher is None:
+        py.test.skip("no inotify here")
+    try:
+        old = tmpdir.join("old.txt")
+        old.write("x")
+        watcher.watchDirectory(str(tmpdir), ('PokerStars', 'PokerStarsToFpdb'))
+        assert watcher.changedFiles() == {}
+        tmpdir.join("new.txt").write("hand")
+        old.write("more", mode = 'a')
+        tmpdir.mkdir("sub")
+        assert watcher.changedFiles() == dict((str(tmpdir.join(name)), ('PokerStars', 'PokerStarsToFpdb'))
+                                              for name in ("new.txt", "old.txt", "sub"))
+        assert watcher.changedFiles() == {}
+    finally:
+        watcher.close()
+
+def testNewSubdirectory(tmpdir, monkeypatch):
+    # A directory made under a watched one must be watched and its files imported,
+    # without taking the place of the site's import directory
+    import Configuration
+    import fpdb_import
+    config = Configuration.Config(file = "HUD_config.test.xml")
+    settings = {}
+    settings.update(config.get_db_parameters())
+    settings.update(config.get_import_parameters())
+    importer = fpdb_import.Importer(False, settings, config)
+    imported = []
+    monkeypatch.setattr(importer, 'importUpdated', lambda file, stat_info: imported.append(file))
+    importer.addImportDirectory(str(tmpdir), True, 'PokerStars', 'PokerStarsToFpdb')
+    try:
+        sub = tmpdir.mkdir("sub")
+        sub.join("hands.txt").write("hand")
+        if importer.watcher is not None:
+            assert importer.watcher.changedFiles() == {str(sub): ('PokerStars', 'PokerStarsToFpdb')}
+        importer.runChanged({str(sub): ('PokerStars', 'PokerStarsToFpdb')})
+        assert importer.dirlist == {'PokerStars': [str(tmpdir), 'PokerStarsToFpdb']}
+        assert imported == [str(sub.join("hands.txt"))]
+        if importer.watcher is not None:
+            sub.join("more.txt").write("hand")
+            assert importer.watcher.changedFiles() == {str(sub.join("more.txt")): ('PokerStars', 'PokerStarsToFpdb')}
+    finally:
+        if importer.watcher is not None:
+            importer.watcher.close()
@@ -2,6 +2,11 @@
 import FulltiltToFpdb
 import py
 
+import Configuration
+from Hand import HandRows
+
+config = Configuration.Config(file = "HUD_config.test.xml")
+
 # regression-test-files/fulltilt/nlhe/NLHE-6max-1.txt
 #   Sorrowful: start: $8.85 end: $14.70 total: $5.85 
   
@@ -14,7 +19,6 @@ def checkGameInfo(hhc, header, info):
     assert hhc.determineGameType(header) == info
 
 def testGameInfo():
-    hhc = FulltiltToFpdb.Fulltilt(autostart=False)
     pairs = (
     ("Full Tilt Poker Game #10777181585: Table Deerfly (deep 6) - $0.01/$0.02 - Pot Limit Omaha Hi - 2:24:44 ET - 2009/02/22",
             {'type':'ring', 'base':'hold', 'category':'omahahi', 'limitType':'pl', 'sb':'0.01', 'bb':'0.02', 'currency':'USD'}),
@@ -25,6 +29,16 @@ def testGameInfo():
     ("Full Tilt Poker Game #10809877615: Table Danville - $0.50/$1 Ante $0.10 - Limit Razz - 21:47:27 ET - 2009/02/23",
             {'type':'ring', 'base':'stud', 'category':'razz', 'limitType':'fl', 'sb':'0.50', 'bb':'1', 'currency':'USD'})
     )
+    hhc = FulltiltToFpdb.Fulltilt(config, autostart=False)
     for (header, info) in pairs:
-        yield checkGameInfo, hhc, header, info
+        checkGameInfo(hhc, header, info)
+
 
+def testHands():
+    # Ring hold'em, razz and a sit & go all read without errors (hand-written hands, see test-fixtures/README.txt)
+    for path in ("test-fixtures/FTP/NLHE-6max-USD-0.05-0.10-200812.txt",
+                 "test-fixtures/FTP/Razz-USD-0.50-1.00-200902.txt",
+                 "test-fixtures/FTP/NLHE-SNG-USD-10+1-200903.txt"):
+        hhc = FulltiltToFpdb.Fulltilt(config, in_path = path, autostart=False)
+        rows = [HandRows(hand) for hand in hhc.iterHands()]
+        assert rows and hhc.numErrors == 0
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import Configuration
+import PartyPokerToFpdb
+
+config = Configuration.Config(file = "HUD_config.test.xml")
+
+hand = u"""Game #%(hid)s starts.
+
+#Game No : %(hid)s
+***** Hand History for Game %(hid)s *****
+$%(limit)s USD NL Texas Hold'em - Saturday, July 25, 07:53:52 EDT 2009
+Table Table  178053 (No DP) (Real Money)
+Seat 4 is the button
+Total number of players : 2/6
+Seat 1: Player1 ( $%(stack)s USD )
+Seat 4: Player2 ( $%(stack)s USD )
+Player1 posts small blind [$%(sb)s USD].
+Player2 posts big blind [$%(bb)s USD].
+** Dealing down cards **
+Dealt to Player1 [  Ah Kh ]
+Player1 folds
+Player2 wins $%(sb)s USD
+
+"""
+
+def testConverterReuse(tmpdir):
+    # A converter pointed at another file must not keep the last file's gametype
+    stakes = (dict(hid = "8362165373", limit = "10", stack = "10", sb = "0.05", bb = "0.10"),
+              dict(hid = "8362165374", limit = "100", stack = "100", sb = "0.50", bb = "1"))
+    paths = []
+    for n, stake in enumerate(stakes):
+        path = tmpdir.join("party%d.txt" % n)
+        path.write((hand % stake).encode('cp1252'), 'wb')
+        paths.append(str(path))
+    reused = PartyPokerToFpdb.PartyPoker(config, in_path = paths[0], autostart=False)
+    for path, stake in zip(paths, stakes):
+        reused.setInput(path)
+        hands = list(reused.iterHands())
+        assert [(h.handid, h.gametype['sb'], h.gametype['bb']) for h in hands] == [(stake['hid'], stake['sb'], "%.2f" % float(stake['bb']))]
+        fresh = PartyPokerToFpdb.PartyPoker(config, in_path = path, autostart=False)
+        assert [h.gametype for h in hands] == [h.gametype for h in fresh.iterHands()]
@@ -2,11 +2,15 @@
 import PokerStarsToFpdb
 from Hand import *
 import py
+import re
+import os
+import codecs
 
 import Configuration
 import Database
 import SQL
 import fpdb_import
+from Exceptions import FpdbParseError, FpdbError
 
 config = Configuration.Config(file = "HUD_config.test.xml")
 db = Database.Database(config)
@@ -182,3 +186,321 @@ def testDrawImport():
 
     # Should actually do some testing here
     assert 1 == 1
+
+def testStreamingSplit():
+    # Splitting a file a few bytes at a time must give the same hands as splitting it whole
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    whole = codecs.open(path, 'r', 'utf8').read().strip().replace('\r\n', '\n')
+    expected = re.split(PokerStarsToFpdb.PokerStars.re_SplitHands, whole)
+    for size in (37, 512, 100000):
+        hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+        hhc.READ_BULK_SIZE = size
+        assert hhc.allHandsAsList() == expected
+
+def testResumeFromByteOffset(tmpdir):
+    # When monitoring, a half written last hand is held back and the next read resumes
+    # from getLastCharacterRead(), reading that hand again in full with the rest
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    data = open(path, 'rb').read()
+    expected = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False).allHandsAsList()
+    tmp = tmpdir.join("growing.txt")
+    for cut in (0, 100, len(data) / 2, len(data) - 3, len(data)):
+        tmp.write(data[:cut], mode = 'wb')
+        hhc = PokerStarsToFpdb.PokerStars(config, in_path = str(tmp), autostart=False)
+        first = hhc.allHandsAsList()
+        assert hhc.getLastCharacterRead() == cut and not hhc.heldLastHand
+        hhc.holdLastHand = True
+        hhc.setInput(str(tmp))
+        held = hhc.allHandsAsList()
+        index = hhc.getLastCharacterRead()
+        if hhc.heldLastHand:
+            assert held == first[:-1] and data[index:].startswith("PokerStars Game #")
+        else:
+            assert held == first and index == cut
+        tmp.write(data, mode = 'wb')
+        hhc = PokerStarsToFpdb.PokerStars(config, in_path = str(tmp), index = index, autostart=False)
+        assert held + hhc.allHandsAsList() == expected
+        assert hhc.getLastCharacterRead() == len(data)
+
+def testCompleteLastHand(tmpdir):
+    # A complete last hand with no splitter after it is only held back while the
+    # file has just been written to, not once it has been left alone
+    import os, time
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    data = open(path, 'rb').read().rstrip()
+    expected = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False).allHandsAsList()
+    tmp = tmpdir.join("finished.txt")
+    tmp.write(data, mode = 'wb')
+    hhc = PokerStarsToFpdb.PokerStars(config, in_path = str(tmp), autostart=False)
+    hhc.holdLastHand = True
+    assert hhc.allHandsAsList() == expected[:-1] and hhc.heldLastHand
+    when = time.time() - hhc.HOLD_SECONDS - 1
+    os.utime(str(tmp), (when, when))
+    hhc.setInput(str(tmp), index = hhc.getLastCharacterRead())
+    assert hhc.allHandsAsList() == expected[-1:] and not hhc.heldLastHand
+    assert hhc.getLastCharacterRead() == len(data)
+    hhc.setInput(str(tmp), index = hhc.getLastCharacterRead())
+    assert hhc.allHandsAsList() == []
+
+def testParseInPool():
+    # Hands parsed by a pool of worker processes must give the same rows as parsing them here
+    import multiprocessing
+    import HandHistoryConverter
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+    expected = [HandRows(hand) for hand in hhc.iterHands()]
+    pool = multiprocessing.Pool(2, HandHistoryConverter.initParseWorker, (config.file,))
+    try:
+        hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+        hhc.PARSE_BATCH_SIZE = 7
+        rows = list(hhc.iterHands(pool, 2))
+    finally:
+        pool.close()
+        pool.join()
+    assert [r.hands for r in rows] == [r.hands for r in expected]
+    assert [r.handsplayers for r in rows] == [r.handsplayers for r in expected]
+
+def testParseWorkerInput():
+    # A parse worker's converter is set to each file its hands come from, once
+    import HandHistoryConverter
+    HandHistoryConverter.initParseWorker(config.file)
+    paths = ("regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt",
+             "regression-test-files/cash/Stars/Stud/7-Stud-USD-0.04-0.08-200911.txt")
+    for path in paths:
+        hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False, starsArchive = True)
+        source = (hhc.inputNo, hhc.in_path, hhc.starsArchive)
+        HandHistoryConverter.parseHandTexts(hhc.__class__, [], False, source)
+        worker = HandHistoryConverter.parseConverters[hhc.__class__]
+        worker.numErrors = 1
+        HandHistoryConverter.parseHandTexts(hhc.__class__, [], False, source)
+        assert (worker.in_path, worker.starsArchive, worker.numErrors) == (path, True, 1)
+
+def testPlayerRegexCache():
+    # Switching between tables must reuse the regexs compiled for each of them
+    import HandHistoryConverter
+    cache = HandHistoryConverter.playerRegexCache
+    hhc = PokerStarsToFpdb.PokerStars(config, autostart=False)
+    hands = []
+    for names in (["s0rrow", "Arbaz"], ["bys7", "Kinewma"]):
+        hand = HoldemOmahaHand(config, None, "PokerStars", gametype, text, builtFrom = "Test")
+        for (seat, name) in enumerate(names):
+            hand.addPlayer(str(seat + 1), name, "100")
+        hands.append(hand)
+    hhc.loadPlayerRegexs(hands[0])
+    hhc.loadPlayerRegexs(hands[1])
+    (hits, misses) = (cache.hits, cache.misses)
+    hhc.loadPlayerRegexs(hands[0])
+    assert hhc.re_PostSB.match("s0rrow: posts small blind $0.25")
+    assert not hhc.re_PostSB.match("bys7: posts small blind $0.25")
+    hhc.loadPlayerRegexs(hands[1])
+    hhc.loadPlayerRegexs(hands[1])
+    assert hhc.re_PostSB.match("bys7: posts small blind $0.25")
+    assert (cache.hits, cache.misses) == (hits + 2, misses)
+
+def testLexerSameHands():
+    # The line lexer must read every Stars hand as the regexs do, without falling back to them
+    import glob
+    import PokerStarsLexerToFpdb
+    paths = glob.glob("regression-test-files/cash/Stars/*/*.txt") + glob.glob("regression-test-files/tour/Stars/*/*.txt")
+    assert paths
+    for path in paths:
+        hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+        expected = list(hhc.iterHands())
+        hhc = PokerStarsLexerToFpdb.PokerStarsLexer(config, in_path = path, autostart=False)
+        hands = []
+        for hand in hhc.iterHands():
+            assert hhc.isLexed(hand), (path, hand.handid)
+            hands.append(hand)
+        assert len(hands) == len(expected)
+        for (hand, other) in zip(hands, expected):
+            for attr in ('players', 'streets', 'board', 'posted', 'actions', 'holecards', 'dealt', 'hero',
+                         'shown', 'mucked', 'collected', 'buttonpos', 'totalpot', 'rake'):
+                assert getattr(hand, attr) == getattr(other, attr), (path, hand.handid, attr)
+        assert [HandRows(hand).handsplayers for hand in hands] == [HandRows(hand).handsplayers for hand in expected]
+    hhc = PokerStarsLexerToFpdb.PokerStarsLexer(config, autostart=False)
+    assert hhc.lexActionTail(u" $0.50 and is all-in", u"$") == (u"0.50", None)
+    assert hhc.lexActionTail(u" 2 cards [7c 8d]", u"$") == (u"2", u"7c 8d")
+    assert hhc.lexActionTail(u" on [7c 8d 9h Ts Js]", u"$") is None     # re_Action doesn't take these either
+
+def testLeanHands():
+    # Lean hands must give the rows full hands give, side pots and all
+    for path in ("regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200912.Allin-pre.txt",
+                 "regression-test-files/cash/Stars/Stud/7-StudHL-USD-0.04-0.08-200911.txt",
+                 "regression-test-files/cash/Stars/Draw/3-Draw-Limit-USD-0.10-0.20-200911.txt"):
+        hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+        hands = list(hhc.iterHands())
+        expected = [HandRows(hand) for hand in hands]
+        hhc.leanHands = True
+        hhc.setInput(path)
+        lean = list(hhc.iterHands())
+        assert [hand.lean for hand in lean] == [True] * len(hands)
+        rows = [HandRows(hand) for hand in lean]
+        assert [r.hands for r in rows] == [r.hands for r in expected]
+        assert [r.handsplayers for r in rows] == [r.handsplayers for r in expected]
+        assert [str(hand.pot) for hand in lean] == [str(hand.pot) for hand in hands]
+        # and can't be written out, as they don't have what only writeHand() uses
+        py.test.raises(FpdbError, lean[0].writeHand, codecs.open(os.devnull, 'w', 'utf8'))
+        assert [(hand.pot.returned, hand.posted, hand.folded, hand.shown) for hand in lean] == [({}, [], set(), set())] * len(lean)
+
+def testDropKnownHands():
+    # Hands the database already has must be skipped from their headers, and only those
+    class KnownDb:
+        def __init__(self, known):
+            self.known = known
+            self.lookups = 0
+        def getKnownHands(self, siteid, game, siteHandNos):
+            self.lookups += 1
+            return self.known & set(siteHandNos)
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+    hids = [hand.handid for hand in hhc.iterHands()]
+    db = KnownDb(set(hids[::2]))
+    hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+    hhc.KNOWN_BATCH_SIZE = 3
+    assert [hand.handid for hand in hhc.iterHands(db = db)] == hids[1::2]
+    assert (hhc.numHands, hhc.numDuplicates) == (len(hids[1::2]), len(hids[::2]))
+    assert db.lookups == (len(hids) + 2) / 3
+
+def testConverterReuse():
+    # A converter pointed at file after file must read each as a new one would
+    paths = ("regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt",
+             "regression-test-files/cash/Stars/Stud/7-Stud-USD-0.04-0.08-200911.txt")
+    reused = PokerStarsToFpdb.PokerStars(config, in_path = paths[0], autostart=False)
+    for path in paths:
+        reused.setInput(path)
+        rows = [HandRows(hand) for hand in reused.iterHands()]
+        hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+        expected = [HandRows(hand) for hand in hhc.iterHands()]
+        assert [r.handsplayers for r in rows] == [r.handsplayers for r in expected]
+        assert (reused.numHands, reused.getLastCharacterRead()) == (hhc.numHands, hhc.getLastCharacterRead())
+
+def testCents():
+    # Money is read into integer cents, and written out the way Stars writes it
+    assert [toCents(x) for x in ("0.25", "1,000", "1.5", ".05", u"12.30", Decimal("2.3"))] == [25, 100000, 150, 5, 1230, 230]
+    assert [str(fromCents(x)) for x in (25, 100000, 150, 5, -30)] == ["0.25", "1000", "1.50", "0.05", "-0.30"]
+    hhc = PokerStarsToFpdb.PokerStars(config, in_path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt", autostart=False)
+    hand = hhc.iterHands().next()
+    assert [type(v) for v in hand.stacks.values() + [hand.totalpot, hand.rake]] == [int] * (len(hand.stacks) + 2)
+
+def testRecords():
+    # Players and actions are tuple records, sharing one copy of each player name
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    hands = list(PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False).iterHands())
+    player = hands[0].players[0]
+    assert isinstance(player, Player) and player[1] is player.name
+    acts = [act for hand in hands for street in hand.actionStreets for act in hand.actions[street]]
+    assert set(type(act) for act in acts) <= set([Action, Bet, Raise, Post])
+    names = dict((p.name, p.name) for hand in hands for p in hand.players)
+    assert all(act.player is names[act.player] for act in acts)
+    assert all(type(act.amount) is int for act in acts if isinstance(act, (Bet, Post)))
+
+def testCompressedFiles(tmpdir):
+    # Hands are read straight out of .gz and .bz2 files and out of zip archives,
+    # each file in a zip archive being read on its own, and resuming works in all of them
+    import gzip, bz2, zipfile
+    import HandHistoryConverter
+    paths = ("regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt",
+             "regression-test-files/cash/Stars/Stud/7-Stud-USD-0.04-0.08-200911.txt")
+    data = [open(path, 'rb').read() for path in paths]
+    gz = str(tmpdir.join("hands.txt.gz"))
+    gzip.open(gz, 'wb').write(data[0])
+    bz = str(tmpdir.join("hands.txt.bz2"))
+    bz2.BZ2File(bz, 'wb').write(data[0])
+    zf = zipfile.ZipFile(str(tmpdir.join("hands.zip")), 'w', zipfile.ZIP_DEFLATED)
+    zf.writestr("2009/holdem.txt", data[0])
+    zf.writestr("2009/stud.txt", data[1])
+    zf.close()
+    members = HandHistoryConverter.zipMembers(str(tmpdir.join("hands.zip")))
+    assert [HandHistoryConverter.splitZipPath(m)[1] for m in members] == ["2009/holdem.txt", "2009/stud.txt"]
+    for (path, plain) in ((gz, paths[0]), (bz, paths[0]), (members[0], paths[0]), (members[1], paths[1])):
+        text = open(plain, 'rb').read()
+        for index in (0, text.rfind("PokerStars Game #", 0, len(text) / 2)):
+            hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, index = index, autostart=False)
+            expected = PokerStarsToFpdb.PokerStars(config, in_path = plain, index = index, autostart=False)
+            assert hhc.allHandsAsList() == expected.allHandsAsList()
+            assert hhc.getLastCharacterRead() == len(text)
+
+def testTailHandTexts():
+    # Tailing a file which turns up a few characters at a time must give the same
+    # hands as reading it whole, each as soon as the splitter after it is there
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    text = codecs.open(path, 'r', 'utf8').read().replace('\r\n', '\n')
+    hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+    expected = hhc.allHandsAsList()
+    for size in (1, 37, 100000):
+        chunks = [text[i:i + size] for i in xrange(0, len(text), size)]
+        assert [hand.strip() for hand in hhc.tailHandTexts(chunks)] == expected
+    tailed = hhc.tailHandTexts(iter([expected[0] + u"\n\n\n", expected[1]]))
+    assert tailed.next() == expected[0]
+
+def testFindCodepage(tmpdir):
+    # The codec is worked out from the start of the file once, and switched if a
+    # plain ascii start turns out to be followed by something else
+    import HandHistoryConverter
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    text = codecs.open(path, 'r', 'utf8').read().lstrip(u'\ufeff').encode('ascii', 'replace').decode('ascii')
+    late = text * 2 + text.replace(u's0rrow', u's\xe9rrow')
+    for (name, data, kodec) in (("bom.txt", codecs.BOM_UTF8 + late.encode('utf8'), 'utf8'),
+                                ("early.txt", late[::-1].encode('cp1252'), 'cp1252'),
+                                ("late.txt", late.encode('cp1252'), 'cp1252')):
+        tmp = tmpdir.join(name)
+        tmp.write(data, mode = 'wb')
+        hhc = PokerStarsToFpdb.PokerStars(config, in_path = str(tmp), autostart=False)
+        assert u''.join(hhc.readChunks()).lstrip(u'\ufeff') == (late if name != "early.txt" else late[::-1])
+        assert HandHistoryConverter.codepageCache[str(tmp)][1:] == (kodec, True)
+    # A file none of the codecs can read is an error, and no hands are read from it
+    tmp = tmpdir.join("neither.txt")
+    tmp.write("\x81\x8d\x8f" + text.encode('ascii'), mode = 'wb')
+    hhc = PokerStarsToFpdb.PokerStars(config, in_path = str(tmp), autostart=False)
+    py.test.raises(FpdbParseError, list, hhc.readChunks())
+    assert list(hhc.iterHands()) == []
+
+def testQuarantine(tmpdir):
+    # Hands that fail are kept with the byte offset of their first line, whether
+    # parsed here or in a pool, and can be converted again from the quarantine
+    import multiprocessing
+    import HandHistoryConverter
+    class QuarantineDb:
+        def __init__(self):
+            self.quarantined = []
+        def getKnownHands(self, siteid, game, siteHandNos):
+            return set()
+        def storeQuarantinedHand(self, path, byteOffset, filter, error, handText):
+            self.quarantined.append((path, byteOffset, filter, handText))
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    texts = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False).allHandsAsList()
+    broken = [1, 4, len(texts) - 1]
+    for i in broken:
+        texts[i] = texts[i].replace("*** HOLE CARDS ***", "*** HOLE KARDS ***")
+    data = u"\r\n\r\n\r\n".join(texts).encode('utf8')
+    tmp = str(tmpdir.join("broken.txt"))
+    open(tmp, 'wb').write(data)
+    expected = [(tmp, data.index(texts[i].split('\n')[0].encode('utf8')), 'PokerStarsToFpdb', texts[i]) for i in broken]
+    pool = multiprocessing.Pool(2, HandHistoryConverter.initParseWorker, (config.file,))
+    try:
+        for args in ((None, 1), (pool, 2)):
+            db = QuarantineDb()
+            hhc = PokerStarsToFpdb.PokerStars(config, in_path = tmp, autostart=False)
+            hhc.PARSE_BATCH_SIZE = 3
+            hands = list(hhc.iterHands(args[0], args[1], db))
+            assert (len(hands), hhc.numErrors) == (len(texts) - len(broken), len(broken))
+            assert db.quarantined == expected
+    finally:
+        pool.close()
+        pool.join()
+    hhc = PokerStarsToFpdb.PokerStars(config, in_path = tmp, autostart=False)
+    fixed = hhc.processHand(expected[0][3].replace("*** HOLE KARDS ***", "*** HOLE CARDS ***"))
+    assert fixed.handid in expected[0][3].split('\n')[0]
+
+def testGameTypeCache():
+    # Hands with the same header are given the gametype worked out for the first,
+    # each as a dict of its own
+    path = "regression-test-files/cash/Stars/Flop/NLHE-6max-USD-0.05-0.10-200911.txt"
+    hhc = PokerStarsToFpdb.PokerStars(config, in_path = path, autostart=False)
+    texts = hhc.allHandsAsList()
+    gametypes = [hhc.readGameType(text) for text in texts]
+    assert gametypes == [hhc.determineGameType(text) for text in texts]
+    assert len(hhc.gametypeCache) == 1
+    gametypes[0]['currency'] = 'play'
+    assert hhc.readGameType(texts[0])['currency'] == 'USD'
+    assert ('ring', 'hold', 'nl') in hhc.supportedGames